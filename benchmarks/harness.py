@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Shared benchmark harness: stand-in ffprobe and HandBrakeCLI executables,
+synthetic library trees and JSON result output. The fakes sleep for modelled
+durations and print the same shape of output as the real tools, so
+throughput can be measured without media or an FFmpeg/HandBrake install.
+
+Timings are read from the environment when the fakes run:
+
+    DLRIPPYR_SIM_PROBE_SECONDS   latency of each ffprobe call
+    DLRIPPYR_SIM_ENCODE_SECONDS  wall time of each encode at 1080p; scaled by
+                                 pixel count for other resolutions
+"""
+
+import json
+import os
+import platform
+import stat
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# A shell script rather than Python, so interpreter start-up doesn't swamp
+# short modelled latencies. Resolution is picked from a checksum of the path,
+# so each file probes the same way every time.
+FAKE_FFPROBE = r'''#!/bin/sh
+sleep "${DLRIPPYR_SIM_PROBE_SECONDS:-0.02}"
+for last; do :; done
+sum=$(printf %s "$last" | cksum | cut -d' ' -f1)
+case $((sum % 4)) in
+  0) w=1280; h=720;  codec=h264 ;;
+  1) w=1920; h=1080; codec=h264 ;;
+  2) w=3840; h=2160; codec=h264 ;;
+  3) w=1920; h=1080; codec=hevc ;;
+esac
+cat <<JSON
+{"streams": [{"codec_name": "$codec", "profile": "Main",
+  "avg_frame_rate": "24000/1001", "height": $h, "width": $w}],
+ "format": {"format_name": "matroska,webm", "duration": "2640.0",
+  "bit_rate": "$((w * h * 4))", "size": "$((w * h * 4 * 330))"}}
+JSON
+'''
+
+# Encode time scales with the pixel count picked by the fake ffprobe above
+FAKE_HANDBRAKE = r'''#!/bin/sh
+prev=""
+for arg; do
+  [ "$prev" = "-i" ] && src="$arg"
+  [ "$prev" = "-o" ] && out="$arg"
+  prev="$arg"
+done
+sum=$(printf %s "$src" | cksum | cut -d' ' -f1)
+case $((sum % 4)) in
+  0) scale=0.45 ;;
+  2) scale=4 ;;
+  *) scale=1 ;;
+esac
+step=$(awk "BEGIN { print ${DLRIPPYR_SIM_ENCODE_SECONDS:-0.2} * $scale / 4 }")
+for i in 0 1 2 3; do
+  eta=$(awk "BEGIN { printf \"%d\", $step * (4 - $i) }")
+  cat <<JSON
+Progress: {
+    "State": "WORKING",
+    "Working": {
+        "ETASeconds": $eta,
+        "Pass": 1,
+        "PassCount": 1,
+        "Progress": 0.$((i * 25)),
+        "Rate": 120.0,
+        "RateAvg": 110.0
+    }
+}
+JSON
+  sleep "$step"
+done
+cat <<JSON
+Progress: {
+    "State": "WORKDONE",
+    "WorkDone": {
+        "Error": 0
+    }
+}
+JSON
+head -c 4096 /dev/zero > "$out"
+'''
+
+
+def install_fakes(bindir: Path) -> None:
+    """Write fake ffprobe and HandBrakeCLI to bindir and put it first on
+    PATH"""
+    bindir.mkdir(parents=True, exist_ok=True)
+    for name, script in (('ffprobe', FAKE_FFPROBE),
+                         ('HandBrakeCLI', FAKE_HANDBRAKE)):
+        exe = bindir / name
+        exe.write_text(script)
+        exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+    os.environ['PATH'] = f'{bindir}{os.pathsep}{os.environ["PATH"]}'
+
+
+def make_tree(root: Path, files: int, per_dir: int = 20) -> None:
+    """Lay out empty video files like a TV library: show/season/episode,
+    with a sprinkling of non-video files the scanner has to pass over"""
+    for i in range(files):
+        season = root / f'show-{i // (per_dir * 10):05d}' / \
+            f'season-{i // per_dir % 10:02d}'
+        if i % per_dir == 0:
+            season.mkdir(parents=True, exist_ok=True)
+            (season / 'folder.jpg').touch()
+        ext = ('mkv', 'mp4', 'MKV', 'avi')[i % 4]
+        (season / f'episode-{i:07d}.{ext}').touch()
+
+
+def timed(fn, *args, **kwargs) -> float:
+    """Wall time of a single call to fn"""
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def emit(suite: str, results: List[Dict], output: Optional[str]) -> None:
+    """Write results as a JSON document, to output or stdout, for tracking
+    regressions between runs"""
+    document = {
+        'suite': suite,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    text = json.dumps(document, indent=2)
+    if output:
+        Path(output).write_text(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
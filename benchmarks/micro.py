@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the CPU-side hot paths: walking a library with
+find_vfiles, Metadata.parse_json and HandBrakeCLI command building.
+
+    python benchmarks/micro.py --files 10000 100000 --output micro.json
+
+Trees are built once per size under --workdir (default: a temporary
+directory) and reused by later runs pointed at the same directory.
+"""
+
+import argparse
+import copy
+import tempfile
+from pathlib import Path
+
+from harness import emit, make_tree, timed
+
+from dlrippyr.classes import HandBrakeJob, Metadata, SampleJob
+from dlrippyr.utils import find_vfiles
+
+PROBE_JSON = {
+    'streams': [{
+        'codec_name': 'h264',
+        'profile': 'High',
+        'avg_frame_rate': '24000/1001',
+        'height': 1080,
+        'width': 1920,
+    }],
+    'format': {
+        'format_name': 'matroska,webm',
+        'duration': '2640.000000',
+        'bit_rate': '8294400',
+        'size': '2737152000',
+    },
+}
+PRESET = 'conf/x265-1080p-mkv.json'
+
+
+def bench_scan(root: Path, files: int) -> dict:
+    tree = root / f'tree-{files}'
+    if not tree.exists():
+        make_tree(tree, files)
+
+    found = 0
+
+    def walk():
+        nonlocal found
+        found = sum(1 for _ in find_vfiles(str(tree)))
+
+    seconds = timed(walk)
+    return {
+        'name': 'find_vfiles',
+        'files': files,
+        'found': found,
+        'seconds': seconds,
+        'per_second': found / seconds,
+    }
+
+
+def bench_parse(iterations: int) -> dict:
+    blobs = [copy.deepcopy(PROBE_JSON) for _ in range(iterations)]
+
+    def parse():
+        for blob in blobs:
+            meta = Metadata.__new__(Metadata)
+            meta.path = Path('a.mkv')
+            meta.parse_json(blob)
+
+    seconds = timed(parse)
+    return {
+        'name': 'Metadata.parse_json',
+        'iterations': iterations,
+        'seconds': seconds,
+        'per_second': iterations / seconds,
+    }
+
+
+def bench_cmds(iterations: int) -> dict:
+    paths = [Path(f'/library/show/episode-{i:07d}.mkv')
+             for i in range(iterations)]
+
+    def build():
+        for path in paths:
+            HandBrakeJob(path, preset=PRESET)
+            SampleJob(path, preset=PRESET, start_tm=60, end_tm=70)
+
+    seconds = timed(build)
+    return {
+        'name': 'make_cmd',
+        'iterations': iterations * 2,
+        'seconds': seconds,
+        'per_second': iterations * 2 / seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files',
+                        type=int,
+                        nargs='+',
+                        default=[10_000, 100_000],
+                        help='tree sizes to scan; up to 1000000 is sensible')
+    parser.add_argument('--iterations', type=int, default=100_000)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(args.workdir or tmp)
+        results = [bench_scan(root, files) for files in args.files]
+    results.append(bench_parse(args.iterations))
+    results.append(bench_cmds(args.iterations))
+
+    emit('micro', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
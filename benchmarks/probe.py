@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Compare serial and pooled Metadata construction over a synthetic directory.
+
+The stand-in ffprobe from harness.py is put first on PATH. It sleeps for a
+fixed latency (modelling a network share) before printing canned JSON, so no
+real media or FFmpeg install is needed:
+
+    python benchmarks/probe.py --files 2000 --jobs 1 8 32
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from harness import emit, install_fakes, make_tree
+
+from dlrippyr.probe import ProbePool
+from dlrippyr.utils import find_vfiles
+
+
+def bench(paths, jobs: int) -> float:
+    start = time.perf_counter()
+    with ProbePool(workers=jobs, cache=None) as pool:
+        probed = sum(1 for _, meta in pool.as_completed(paths) if meta)
+    elapsed = time.perf_counter() - start
+    assert probed == len(paths), f'only {probed}/{len(paths)} probed'
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0.02,
+                        help='seconds each fake probe sleeps')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    os.environ['DLRIPPYR_SIM_PROBE_SECONDS'] = str(args.latency)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        install_fakes(root / 'bin')
+        make_tree(root / 'lib', args.files)
+        paths = list(find_vfiles(str(root / 'lib')))
+
+        results = []
+        for jobs in args.jobs:
+            elapsed = bench(paths, jobs)
+            results.append({
+                'name': 'probe_pool',
+                'files': len(paths),
+                'latency': args.latency,
+                'probe_jobs': jobs,
+                'seconds': elapsed,
+                'per_second': len(paths) / elapsed,
+                'speedup': results[0]['seconds'] / elapsed
+                if results else 1.0,
+            })
+
+    emit('probe', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
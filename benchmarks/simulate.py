@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Scale simulator for the scan -> probe -> encode pipeline. Fake ffprobe and
+HandBrakeCLI executables sleep for modelled durations, so scheduler and
+pipeline throughput can be measured over thousands of files without media:
+
+    python benchmarks/simulate.py --files 2000 --jobs 4 16 \\
+        --encode-seconds 0.2 --output simulate.json
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from harness import emit, install_fakes, make_tree
+
+from dlrippyr.classes import HandBrakeJob
+from dlrippyr.pipeline import Pipeline
+from dlrippyr.probe import ProbePool
+from dlrippyr.scheduler import Scheduler
+
+PRESET = 'conf/x265-1080p-mkv.json'
+
+
+class SimJob(HandBrakeJob):
+    """HandBrakeJob which notes when each encode actually starts"""
+    starts: list = []
+    lock = threading.Lock()
+
+    def run_handbrake(self, on_progress=None) -> int:
+        with SimJob.lock:
+            SimJob.starts.append(time.monotonic())
+        return super().run_handbrake(on_progress)
+
+
+def simulate(lib: Path, outdir: Path, slots: int, probe_jobs: int) -> dict:
+    SimJob.starts = []
+    skips = []
+
+    def classify(path, meta):
+        if meta.codec_name == 'hevc':
+            return 'already encoded in HEVC'
+        return SimJob(path,
+                      preset=PRESET,
+                      output=outdir / f'{path.stem}.mp4',
+                      meta=meta)
+
+    start = time.monotonic()
+    with ProbePool(workers=probe_jobs) as pool:
+        pipeline = Pipeline(pool,
+                            Scheduler(slots=slots),
+                            classify,
+                            on_skip=lambda path, why: skips.append(path))
+        summary = pipeline.run([str(lib)])
+    elapsed = time.monotonic() - start
+
+    encoded = len(summary.succeeded)
+    busy = sum(result.elapsed for result in summary.results)
+    return {
+        'name': 'pipeline',
+        'slots': slots,
+        'probe_jobs': probe_jobs,
+        'encoded': encoded,
+        'failed': len(summary.failed),
+        'skipped': len(skips),
+        'seconds': elapsed,
+        'jobs_per_second': encoded / elapsed,
+        'first_encode_seconds': min(SimJob.starts, default=start) - start,
+        # Share of the available slot-time spent encoding
+        'slot_utilisation': busy / (elapsed * slots),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--probe-jobs', type=int, default=8)
+    parser.add_argument('--probe-seconds', type=float, default=0.02)
+    parser.add_argument('--encode-seconds',
+                        type=float,
+                        default=0.2,
+                        help='modelled wall time of a 1080p encode')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    os.environ['DLRIPPYR_SIM_PROBE_SECONDS'] = str(args.probe_seconds)
+    os.environ['DLRIPPYR_SIM_ENCODE_SECONDS'] = str(args.encode_seconds)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        install_fakes(root / 'bin')
+        make_tree(root / 'lib', args.files)
+        results = []
+        for slots in args.jobs:
+            outdir = root / f'out-{slots}'
+            outdir.mkdir()
+            result = simulate(root / 'lib', outdir, slots, args.probe_jobs)
+            result.update(files=args.files,
+                          probe_seconds=args.probe_seconds,
+                          encode_seconds=args.encode_seconds)
+            results.append(result)
+
+    emit('simulate', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Time `dlrippyr --help`, from importing dlrippyr to printing help, in fresh
+interpreters so nothing is already imported. The interpreter's own start is
+left out, as it is the same whatever dlrippyr does:
+
+    python benchmarks/startup.py --runs 10 --budget 0.1
+
+Exits non-zero if the best run is slower than --budget, if given.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+from harness import emit
+
+TIMED = '''
+import time
+start = time.perf_counter()
+from dlrippyr.cli import cli
+try:
+    cli(['--help'])
+except SystemExit:
+    pass
+print(time.perf_counter() - start)
+'''
+
+
+def bench(runs: int) -> dict:
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    timings = [
+        float(
+            subprocess.run([sys.executable, '-c', TIMED],
+                           env=env,
+                           stdout=subprocess.PIPE,
+                           check=True,
+                           text=True).stdout.split()[-1])
+        for _ in range(runs)
+    ]
+    return {
+        'name': 'dlrippyr --help',
+        'runs': runs,
+        # The best run, as the others mostly measure the rest of the machine
+        'seconds': min(timings),
+        'median': sorted(timings)[runs // 2],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget',
+                        type=float,
+                        default=None,
+                        help='seconds the best run must beat')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    result = bench(args.runs)
+    emit('startup', [result], args.output)
+    if args.budget is not None and result['seconds'] > args.budget:
+        sys.exit(f'Startup took {result["seconds"]:.3f}s, over the '
+                 f'{args.budget}s budget')
+
+
+if __name__ == '__main__':
+    main()
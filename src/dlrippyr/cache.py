@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Persistent, on-disk cache of ffprobe results so that unchanged files are not
+re-probed on every invocation. Entries are keyed on path and invalidated by
+the file's size, mtime and inode.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import click
+
+from dlrippyr.log import logger
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+# Batch up writes; a commit per probe would dominate a warm run
+COMMIT_EVERY = 500
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS probes (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode    INTEGER NOT NULL,
+    probe    TEXT NOT NULL,
+    accessed REAL NOT NULL DEFAULT (julianday('now'))
+)
+'''
+
+
+def default_cache_dir() -> Path:
+    """Per-user cache directory, honouring $XDG_CACHE_HOME"""
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'dlrippyr'
+
+
+def fingerprint(path: Path) -> Optional[tuple]:
+    """(size, mtime_ns, inode) of a file, or None if it cannot be stat'ed"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class MetadataCache:
+    """SQLite-backed store of raw ffprobe JSON, safe to share across threads"""
+    db_path: Path
+    rebuild: bool
+    max_entries: int
+
+    def __init__(self,
+                 db_path: Optional[Path] = None,
+                 rebuild: bool = False,
+                 max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        if db_path is None:
+            db_path = default_cache_dir() / 'metadata.sqlite'
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        # When rebuilding, every lookup misses so each file is re-probed and
+        # its entry overwritten
+        self.rebuild = rebuild
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(_SCHEMA)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}("{self.db_path}")'
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM probes').fetchone()[0]
+
+    def __enter__(self) -> 'MetadataCache':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def get(self, path: Path) -> Optional[Dict]:
+        """Return the cached probe for path if the file is unchanged"""
+        if self.rebuild:
+            return None
+        fp = fingerprint(path)
+        if fp is None:
+            return None
+
+        key = str(Path(path).resolve())
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, mtime_ns, inode, probe FROM probes '
+                'WHERE path = ?', (key, )).fetchone()
+            if row is None or tuple(row[:3]) != fp:
+                return None
+            self._conn.execute(
+                "UPDATE probes SET accessed = julianday('now') "
+                'WHERE path = ?', (key, ))
+            self._mark_dirty()
+
+        return json.loads(row[3])
+
+    def put(self, path: Path, probe: Dict) -> None:
+        """Store a freshly acquired probe against the file's fingerprint"""
+        fp = fingerprint(path)
+        if fp is None:
+            return
+
+        key = str(Path(path).resolve())
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO probes '
+                '(path, size, mtime_ns, inode, probe) VALUES (?, ?, ?, ?, ?)',
+                (key, *fp, json.dumps(probe)))
+            self._mark_dirty()
+
+    def prune(self) -> int:
+        """Drop entries for files which have been removed or modified"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, size, mtime_ns, inode FROM probes').fetchall()
+        stale = [(row[0], ) for row in rows
+                 if fingerprint(Path(row[0])) != tuple(row[1:])]
+
+        with self._lock:
+            self._conn.executemany('DELETE FROM probes WHERE path = ?', stale)
+            self._conn.commit()
+        return len(stale)
+
+    def trim(self, max_entries: Optional[int] = None) -> int:
+        """Evict least recently used entries beyond the size cap"""
+        if max_entries is None:
+            max_entries = self.max_entries
+
+        with self._lock:
+            cur = self._conn.execute(
+                'DELETE FROM probes WHERE path IN ('
+                'SELECT path FROM probes ORDER BY accessed DESC '
+                'LIMIT -1 OFFSET ?)', (max_entries, ))
+            self._conn.commit()
+        return cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM probes')
+            self._conn.commit()
+            self._conn.execute('VACUUM')
+
+    def close(self) -> None:
+        self.trim()
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def _mark_dirty(self) -> None:
+        # Caller must hold self._lock
+        self._dirty += 1
+        if self._dirty >= COMMIT_EVERY:
+            self._conn.commit()
+            self._dirty = 0
+
+
+@click.command()
+@click.option('--prune',
+              is_flag=True,
+              default=False,
+              help='Remove entries for files that have since been modified '
+              'or deleted')
+@click.option('--clear',
+              is_flag=True,
+              default=False,
+              help='Remove every entry from the cache')
+@click.option('--max-entries',
+              type=int,
+              default=DEFAULT_MAX_ENTRIES,
+              show_default=True,
+              help='Evict least recently used entries beyond this many')
+def cache(prune, clear, max_entries):
+    """
+    Inspect and maintain the on-disk cache of video file metadata used by
+    convert and info.
+    """
+    with MetadataCache(max_entries=max_entries) as store:
+        if clear:
+            store.clear()
+            logger.info(f'Cleared {store.db_path}')
+        if prune:
+            logger.info(f'Pruned {store.prune()} stale entries')
+        evicted = store.trim()
+        if evicted:
+            logger.info(f'Evicted {evicted} entries over the size cap')
+        click.echo(f'{store.db_path}: {len(store)} entries')
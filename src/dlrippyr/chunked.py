@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""
+Segment-parallel encoding of a single long file. The source is split at
+keyframes into segments which are encoded concurrently with SampleJob's
+start/stop mechanism, then joined losslessly with ffmpeg's concat demuxer and
+checked against the source for duration and A/V sync.
+"""
+
+import json
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dlrippyr.classes import (BasicJob, Job, Metadata, SampleJob,
+                              output_name_from_input, partial_name,
+                              segment_dir)
+from dlrippyr.log import logger
+from dlrippyr.runner import Progress
+from dlrippyr.scheduler import Scheduler
+
+DEFAULT_CHUNKS = 1
+# Segments shorter than this aren't worth the seek and concat overhead
+MIN_CHUNK_SECONDS = 300
+# Allowed drift between source and joined output, in seconds
+DURATION_TOLERANCE = 1.0
+SYNC_TOLERANCE = 0.1
+# Further A/V drift allowed per segment boundary, for audio frame padding
+SYNC_TOLERANCE_PER_SEGMENT = 0.025
+# Seconds either side of a cut searched for a keyframe to cut at, wider than
+# the keyframe interval of any sensible encode
+KEYFRAME_WINDOW = 10.0
+
+
+def keyframes(path: Path,
+              around: List[float],
+              window: float = KEYFRAME_WINDOW,
+              timeout: Optional[float] = None) -> List[float]:
+    """Timestamps of the video keyframes within window seconds either side
+    of each time in around, read from the packet index without decoding.
+    Only those stretches of the file are read, not every packet in it"""
+    if not around:
+        return []
+    intervals = ','.join(f'{max(0.0, t - window):.3f}%+{2 * window:.3f}'
+                         for t in around)
+    raw = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals',
+        intervals, '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0',
+        f'{path}'
+    ],
+                         stdout=subprocess.PIPE,
+                         timeout=timeout,
+                         check=True)
+
+    times = set()
+    for line in raw.stdout.decode().splitlines():
+        pts, _, flags = line.partition(',')
+        if 'K' in flags and pts not in ('', 'N/A'):
+            times.add(float(pts))
+    return sorted(times)
+
+
+def split_points(frames: List[float], duration: float,
+                 chunks: int) -> List[float]:
+    """Keyframe timestamps nearest to chunks evenly spaced cut points,
+    starting with 0"""
+    points = [0.0]
+    for i in range(1, chunks):
+        target = duration * i / chunks
+        nearest = min(frames, key=lambda t: abs(t - target), default=target)
+        if nearest > points[-1]:
+            points.append(nearest)
+    return points
+
+
+def probe_durations(path: Path) -> Dict[str, float]:
+    """Container duration plus the first video and audio stream durations"""
+    raw = subprocess.run([
+        'ffprobe', '-v', 'error', '-print_format', 'json', '-show_entries',
+        'format=duration:stream=codec_type,duration', f'{path}'
+    ],
+                         stdout=subprocess.PIPE,
+                         check=True)
+    _json = json.loads(raw.stdout)
+
+    durations = {'format': float(_json['format'].get('duration', 0.0))}
+    for stream in _json.get('streams', []):
+        kind = stream.get('codec_type')
+        if kind in ('video', 'audio') and kind not in durations:
+            durations[kind] = float(stream.get('duration', 0.0))
+    return durations
+
+
+def verify(source: Path, output: Path, segments: int) -> Tuple[bool, str]:
+    """Check the joined output against its source for total duration and for
+    drift between its audio and video"""
+    src = probe_durations(source)
+    out = probe_durations(output)
+
+    drift = abs(src['format'] - out['format'])
+    if drift > DURATION_TOLERANCE:
+        return False, (f'duration {out["format"]:.2f}s differs from source '
+                       f'{src["format"]:.2f}s')
+
+    if 'audio' in src and 'video' in src:
+        if 'audio' not in out or 'video' not in out:
+            return False, 'audio or video stream missing from output'
+        src_skew = src['audio'] - src['video']
+        out_skew = out['audio'] - out['video']
+        tolerance = SYNC_TOLERANCE + SYNC_TOLERANCE_PER_SEGMENT * segments
+        if abs(out_skew - src_skew) > tolerance:
+            return False, (f'audio/video drift of {out_skew - src_skew:.3f}s '
+                           'against source')
+    return True, 'ok'
+
+
+class ChunkedJob(BasicJob):
+    """Encode one file as several concurrently encoded segments"""
+    chunks: int
+    segdir: Path
+
+    def __init__(self,
+                 input: Path,
+                 preset: str = 'x265',
+                 output: Optional[Path] = None,
+                 chunks: int = DEFAULT_CHUNKS,
+                 meta: Optional[Metadata] = None) -> None:
+        self.input = input
+        self.meta = meta
+        if not output:
+            self.output = output_name_from_input(self.input)
+        else:
+            self.output = output
+        self.preset = preset
+        self.chunks = chunks
+        self.concurrency = chunks
+        self.segdir = segment_dir(self.output)
+        self.cmd = self.make_cmd()
+
+    def __str__(self) -> str:
+        return f'{self.chunks} segments of {self.input} ==> ' + ' '.join(
+            self.cmd)
+
+    def make_cmd(self) -> List[str]:
+        """ffmpeg incantation joining the encoded segments, without
+        re-encoding, into the output"""
+        return [
+            'ffmpeg', '-hide_banner', '-v', 'error', '-y', '-f', 'concat',
+            '-safe', '0', '-i',
+            str(self.segdir / 'segments.txt'), '-map', '0', '-c', 'copy',
+            str(partial_name(self.output))
+        ]
+
+    def plan(self) -> List[SampleJob]:
+        """SampleJobs for each segment, cut at keyframes"""
+        duration = self.meta.duration
+        cuts = [duration * i / self.chunks for i in range(1, self.chunks)]
+        points = split_points(keyframes(self.input, cuts), duration,
+                              self.chunks)
+        # The final segment runs past the end so nothing is trimmed
+        ends = points[1:] + [duration + 1]
+
+        return [
+            SampleJob(self.input,
+                      preset=self.preset,
+                      output=self.segdir / f'segment{i:03d}.mp4',
+                      start_tm=start,
+                      end_tm=end,
+                      meta=self.meta)
+            for i, (start, end) in enumerate(zip(points, ends))
+        ]
+
+    def run_handbrake(self, on_progress=None) -> int:
+        start = time.monotonic()
+        self.segdir.mkdir(parents=True, exist_ok=True)
+        try:
+            segments = self.plan()
+            # Only as many at once as the share of the outer scheduler this
+            # job was given
+            summary = Scheduler(slots=min(len(segments), self.concurrency),
+                                on_progress=self._combine(
+                                    segments, on_progress)).run(segments)
+            if summary.failed:
+                logger.error(f'Segment encodes failed for {self.input}:\n'
+                             f'{summary}')
+                returncode = 1
+            else:
+                returncode = self.join(segments)
+
+            if returncode == 0:
+                ok, reason = verify(self.input, partial_name(self.output),
+                                    len(segments))
+                if not ok:
+                    logger.error(f'Joined output of {self.input} failed '
+                                 f'verification: {reason}')
+                    returncode = 1
+            self.finalise(returncode)
+            self.record(returncode, time.monotonic() - start)
+            return returncode
+        finally:
+            shutil.rmtree(self.segdir, ignore_errors=True)
+
+    def join(self, segments: List[SampleJob]) -> int:
+        """Concatenate the encoded segments into the partial output"""
+        listing = ''.join("file '{}'\n".format(
+            str(s.output.resolve()).replace("'", "'\\''")) for s in segments)
+        (self.segdir / 'segments.txt').write_text(listing)
+        return subprocess.run(self.cmd).returncode
+
+    def _combine(self, segments: List[SampleJob],
+                 on_progress) -> Callable[[Job, Progress], None]:
+        """on_progress for the segments, reporting the job's progress as a
+        whole, with each segment counting by its length"""
+        lengths = {
+            segment.output:
+            min(segment.end_tm, self.meta.duration) - segment.start_tm
+            for segment in segments
+        }
+        total = sum(lengths.values()) or 1.0
+        latest: Dict[Path, Progress] = {}
+        lock = threading.Lock()
+
+        def update(segment: Job, progress: Progress) -> None:
+            with lock:
+                latest[segment.output] = progress
+                done = 0.0
+                for output, seen in latest.items():
+                    passes = max(1, seen.pass_count)
+                    pass_id = min(max(1, seen.pass_id), passes)
+                    done += lengths[output] * (pass_id - 1 +
+                                               seen.percent / 100) / passes
+                running = [
+                    seen for seen in latest.values() if seen.state == 'WORKING'
+                ]
+                self.progress = Progress(
+                    state='WORKING',
+                    percent=100 * done / total,
+                    fps=sum(seen.fps for seen in running),
+                    avg_fps=sum(seen.avg_fps for seen in latest.values()))
+            if on_progress is not None:
+                on_progress(self, self.progress)
+
+        return update
+
+
+def chunks_for(meta: Metadata, chunks: int) -> int:
+    """How many segments a file should actually be split into, given the
+    requested number and the minimum useful segment length"""
+    return max(1, min(chunks, int(meta.duration // MIN_CHUNK_SECONDS)))
@@ -1,17 +1,17 @@
 #!/usr/bin/env python
-import json
-import subprocess
-import sys
+import os
+import time
 from abc import ABC, abstractmethod
+from fractions import Fraction
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
-from loguru import logger
-
-logger.add(sys.stderr,
-           format="{time} {level} {message}",
-           filter="my_module",
-           level="INFO")
+from dlrippyr.cache import MetadataCache
+from dlrippyr.container import parse_header
+from dlrippyr.log import logger
+from dlrippyr.metrics import (ENCODE_BUCKETS, FPS_BUCKETS, RATIO_BUCKETS,
+                              metrics)
+from dlrippyr.runner import Progress, run_handbrake
 
 
 # TODO: This needs to be *much* smarter
@@ -21,8 +21,35 @@ def output_name_from_input(input: Path) -> Path:
     return Path(f"{input.stem}_x265.mp4")
 
 
+def partial_name(output: Path, tag: str = '') -> Path:
+    """Temporary name an output is written under until its encode succeeds,
+    alongside the output so the final rename is atomic. tag sets apart the
+    partials of encodes which may overlap, like re-leased remote jobs"""
+    output = Path(output)
+    tag = f'.{tag}' if tag else ''
+
+    return output.with_name(f'.{output.stem}{tag}.partial{output.suffix}')
+
+
+def segment_dir(output: Path) -> Path:
+    """Directory a segmented encode keeps its segments in until they are
+    joined into output"""
+    output = Path(output)
+
+    return output.with_name(f'.{output.stem}.chunks')
+
+
 class Metadata:
-    """doc"""
+    """Video metadata for a source file, read from its container headers
+    where they can be parsed in-process, or from ffprobe otherwise.
+
+    Slotted to keep a library's worth of these small. Created with
+    lazy=True, nothing is read until one of FIELDS is first accessed.
+    """
+    FIELDS = ('format_name', 'codec_name', 'profile', 'avg_frame_rate',
+              'height', 'width', 'bit_rate', 'size', 'duration')
+    __slots__ = ('path', 'cache', 'timeout', 'fast') + FIELDS
+
     path: Path
     format_name: str
     codec_name: str
@@ -32,15 +59,40 @@ class Metadata:
     width: str
     bit_rate: int
     size: int
+    duration: float
+    cache: Optional[MetadataCache]
+    timeout: Optional[float]
+    fast: bool
 
-    def __init__(self, path: Path) -> None:
+    def __init__(self,
+                 path: Path,
+                 cache: Optional[MetadataCache] = None,
+                 timeout: Optional[float] = None,
+                 fast: bool = True,
+                 lazy: bool = False) -> None:
         # Track the path of the source file
         self.path = path
-
-        # call initialisation methods to populate attributes from json
+        # Optional persistent store consulted before spawning ffprobe
+        self.cache = cache
+        # Seconds to wait on ffprobe before giving up on the file
+        self.timeout = timeout
+        # Try parsing MP4/MOV and Matroska headers before spawning ffprobe
+        self.fast = fast
+
+        if not lazy:
+            self.load()
+
+    def __getattr__(self, name: str):
+        # Only reached for slots not yet filled in
+        if name in Metadata.FIELDS:
+            self.load()
+            return object.__getattribute__(self, name)
+        raise AttributeError(name)
+
+    def load(self) -> None:
+        """Populate the metadata fields from the cache, headers or ffprobe"""
         _json = self.get_json()
         self.parse_json(_json)
-        # logger.info(f'{self.__repr__}')
 
     def __repr__(self) -> str:
         return (f'{self.__class__.__name__}("{self.path}")')
@@ -59,8 +111,30 @@ class Metadata:
                 f'  Bit Rate: {f_bit_rate:<12}\n'
                 f'      Size: {f_size:<12}\n')
 
+    @property
+    def fps(self) -> float:
+        """Average frame rate as a number; 0.0 where ffprobe reports 0/0"""
+        try:
+            return float(Fraction(self.avg_frame_rate))
+        except (ValueError, ZeroDivisionError):
+            return 0.0
+
+    @property
+    def frames(self) -> float:
+        """Approximate frame count, from duration and average frame rate"""
+        return self.duration * self.fps
+
+    @property
+    def bits_per_pixel(self) -> float:
+        """Bits spent per pixel per frame; 0.0 where it can't be known"""
+        pixel_rate = int(self.width) * int(self.height) * self.fps
+        if not pixel_rate:
+            return 0.0
+        return self.bit_rate * 1000**2 / pixel_rate
+
     def get_json(self) -> Dict:
-        r"""Execute ffprobe under subprocess to acquire json-formatted metadata
+        r"""Read json-formatted metadata from the cache, the container headers
+        or, failing those, by executing ffprobe under subprocess
 
         ### Parameters
         1. video_file: str
@@ -72,15 +146,40 @@ class Metadata:
              Bulk/raw metadata of input video file as a string in JSON format
         """
 
+        if self.cache is not None:
+            cached = self.cache.get(self.path)
+            if cached is not None:
+                metrics.inc('dlrippyr_probe_cache_hits_total')
+                return cached
+
+        _json = parse_header(self.path) if self.fast else None
+        if _json is not None:
+            metrics.inc('dlrippyr_probe_header_total')
+            if self.cache is not None:
+                self.cache.put(self.path, _json)
+            return _json
+
+        # Imported here as most runs are served from the cache or the header
+        import json
+        import subprocess
+
         # ffprobe incantation to get metadata how we want it
+        start = time.monotonic()
         raw = subprocess.run([
             'ffprobe', '-hide_banner', '-v', 'panic', '-print_format', 'json',
             '-show_format', '-show_streams', '-select_streams', 'v:0',
             f'{self.path}'
         ],
-                             stdout=subprocess.PIPE)
+                             stdout=subprocess.PIPE,
+                             timeout=self.timeout)
+        elapsed = time.monotonic() - start
+        metrics.observe('dlrippyr_probe_seconds', elapsed)
+        metrics.event('probe', path=str(self.path), seconds=elapsed)
         _json = json.loads(raw.stdout)
 
+        if self.cache is not None:
+            self.cache.put(self.path, _json)
+
         return _json
 
     def parse_json(self, _json: Dict) -> None:
@@ -106,23 +205,39 @@ class Metadata:
                         _json[k][field] = (int(_json[k][field]) / 1024**2)
                     setattr(self, field, _json[k][field])
 
+        # Not every container reports a duration, so don't insist on one
+        self.duration = float(_json['format'].get('duration', 0.0))
+
 
 class Job(ABC):
     input: Path
     output: Optional[Path]
     preset: str
     cmd: list[str]
-
-    def __init__(self, input, output=None) -> None:
+    # Probed source metadata, when known, used to schedule and size the job
+    meta: Optional[Metadata]
+    # Latest progress reported by HandBrakeCLI while the job runs
+    progress: Optional[Progress] = None
+    # The Scratch the job was staged on, and the local copies the encode
+    # reads from and writes to, when staged
+    staging = None
+    staged_input: Optional[Path] = None
+    staged_output: Optional[Path] = None
+    # Encodes the job runs at once. A Scheduler weighs the job by them, and
+    # lowers this to fit the share it was given
+    concurrency: int = 1
+
+    def __init__(self, input, output=None, meta=None) -> None:
         self.input = input
         self.output = output
+        self.meta = meta
 
     @abstractmethod
     def make_cmd(self):
         pass
 
     @abstractmethod
-    def run_handbrake(self):
+    def run_handbrake(self, on_progress=None):
         pass
 
 
@@ -131,16 +246,95 @@ class BasicJob(Job):
     def make_cmd(self):
         pass
 
-    def run_handbrake(self) -> None:
-        process = subprocess.Popen(self.cmd)
-        # Regurgitate HandBrakeCLI back to stdout after it is gobbled up by
-        # subprocess
-        while True:
-            sout = process.communicate()[0]
-            if process.poll() is not None:
-                break
-            if sout:
-                print(sout)
+    def run_handbrake(
+        self,
+        on_progress: Optional[Callable[['Job', Progress], None]] = None
+    ) -> int:
+        """Run the job's command to completion, returning its exit status.
+        on_progress(job, progress) is called for each HandBrakeCLI update"""
+
+        def track(tag: str, progress: Progress) -> None:
+            self.progress = progress
+            if on_progress is not None:
+                on_progress(self, progress)
+
+        start = time.monotonic()
+        returncode = run_handbrake(
+            self.cmd,
+            on_progress=track,
+            on_output=lambda tag, line: logger.debug(line))
+        self.finalise(returncode)
+        self.record(returncode, time.monotonic() - start)
+        return returncode
+
+    def finalise(self, returncode: int) -> None:
+        """Move a successful encode's output into place, or discard the
+        partial output of a failed one"""
+        if self.staging is not None:
+            # Bring a staged output back from scratch first
+            self.staging.unstage(self, returncode)
+        partial = partial_name(self.output)
+        if not partial.exists():
+            return
+        if returncode == 0:
+            os.replace(partial, self.output)
+        else:
+            partial.unlink()
+
+    def source_bytes(self) -> Optional[int]:
+        """Bytes of source the job encodes, or None if unknown"""
+        try:
+            return os.stat(self.input).st_size
+        except OSError:
+            return None
+
+    def record(self, returncode: int, elapsed: float) -> None:
+        """Report a finished encode's wall time, size ratio and frame rate
+        to the metrics registry"""
+        kind = type(self).__name__
+        status = 'ok' if returncode == 0 else 'failed'
+        metrics.inc('dlrippyr_encodes_total', job=kind, status=status)
+        metrics.observe('dlrippyr_encode_seconds',
+                        elapsed,
+                        ENCODE_BUCKETS,
+                        job=kind)
+        event = {
+            'input': str(self.input),
+            'output': str(self.output),
+            'job': kind,
+            'returncode': returncode,
+            'seconds': elapsed,
+        }
+
+        if self.progress is not None and self.progress.avg_fps:
+            fps = self.progress.avg_fps
+            metrics.observe('dlrippyr_encode_fps', fps, FPS_BUCKETS, job=kind)
+            event['fps'] = fps
+
+        insize = self.source_bytes()
+        if returncode == 0 and insize:
+            try:
+                outsize = os.stat(self.output).st_size
+            except OSError:
+                outsize = None
+            if outsize is not None:
+                ratio = outsize / insize
+                metrics.inc('dlrippyr_encode_input_bytes_total',
+                            insize,
+                            job=kind)
+                metrics.inc('dlrippyr_encode_output_bytes_total',
+                            outsize,
+                            job=kind)
+                metrics.observe('dlrippyr_encode_ratio',
+                                ratio,
+                                RATIO_BUCKETS,
+                                job=kind)
+                event.update(input_bytes=insize,
+                             output_bytes=outsize,
+                             ratio=ratio)
+
+        metrics.event('encode', **event)
+        metrics.flush()
 
 
 class DryRunJob(BasicJob):
@@ -148,8 +342,10 @@ class DryRunJob(BasicJob):
     def __init__(self,
                  input: Path,
                  preset: str = 'x265',
-                 output: Optional[Path] = None) -> None:
+                 output: Optional[Path] = None,
+                 meta: Optional[Metadata] = None) -> None:
         self.input = input
+        self.meta = meta
         if not output:
             self.output = output_name_from_input(self.input)
         else:
@@ -166,7 +362,7 @@ class DryRunJob(BasicJob):
 
         # Presets are being stored in conf dir, which needs to be stripped, along
         # with json extension
-        preset_name = self.preset.split('/')[1].strip('.json')
+        preset_name = Path(self.preset).stem
         cmd = 'nice -n 10 HandBrakeCLI '.split()
         _preset = f'--preset-import-file {self.preset} -Z {preset_name} '.split(
         )
@@ -175,8 +371,9 @@ class DryRunJob(BasicJob):
         cmd.extend(_preset + _in + _out)
         return cmd
 
-    def run_handbrake(self) -> None:
+    def run_handbrake(self, on_progress=None) -> int:
         print(self)
+        return 0
 
 
 class SampleJob(BasicJob):
@@ -188,8 +385,10 @@ class SampleJob(BasicJob):
                  preset: str = 'x265',
                  output: Optional[Path] = None,
                  start_tm: int = 10,
-                 end_tm: int = 20) -> None:
+                 end_tm: int = 20,
+                 meta: Optional[Metadata] = None) -> None:
         self.input = input
+        self.meta = meta
         if not output:
             self.output = output_name_from_input(self.input)
         else:
@@ -202,19 +401,29 @@ class SampleJob(BasicJob):
     def __str__(self) -> str:
         return ' '.join(self.cmd)
 
+    def source_bytes(self) -> Optional[int]:
+        """The sampled share of the source, assuming an even bit rate"""
+        size = super().source_bytes()
+        if size is None or self.meta is None or not self.meta.duration:
+            return None
+        span = min(self.end_tm, self.meta.duration) - self.start_tm
+        return int(size * max(0.0, span) / self.meta.duration)
+
     def make_cmd(self) -> List[str]:
         """SampleJob convert """
 
         # Presets are being stored in conf dir, which needs to be stripped, along
         # with json extension
-        preset_name = self.preset.split('/')[1].strip('.json')
+        preset_name = Path(self.preset).stem
         cmd = 'nice -n 10 HandBrakeCLI '.split()
         _preset = f'--preset-import-file {self.preset} -Z {preset_name} '.split(
         )
         start_tm = f'--start-at seconds:{self.start_tm} '.split()
-        end_tm = f'--stop-at seconds:{self.end_tm} '.split()
+        # HandBrakeCLI's --stop-at is a duration counted from --start-at, not
+        # a timecode
+        end_tm = f'--stop-at seconds:{self.end_tm - self.start_tm} '.split()
         _in = ['-i', str(self.input)]
-        _out = ['-o', str(self.output)]
+        _out = ['-o', str(partial_name(self.output))]
         cmd.extend(_preset + start_tm + end_tm + _in + _out)
         return cmd
 
@@ -224,8 +433,10 @@ class HandBrakeJob(BasicJob):
     def __init__(self,
                  input: Path,
                  preset: str = 'x265',
-                 output: Optional[Path] = None):
+                 output: Optional[Path] = None,
+                 meta: Optional[Metadata] = None):
         self.input = input
+        self.meta = meta
         if not output:
             self.output = output_name_from_input(self.input)
         else:
@@ -241,11 +452,11 @@ class HandBrakeJob(BasicJob):
 
         # Presets are being stored in conf dir, which needs to be stripped,
         # along with json extension
-        preset_name = self.preset.split('/')[1].strip('.json')
+        preset_name = Path(self.preset).stem
         cmd = 'nice -n 10 HandBrakeCLI '.split()
         _preset = f'--preset-import-file {self.preset} -Z {preset_name} '.split(
         )
-        _in = ['-i', str(self.input)]
-        _out = ['-o', str(self.output)]
+        _in = ['-i', str(self.staged_input or self.input)]
+        _out = ['-o', str(self.staged_output or partial_name(self.output))]
         cmd.extend(_preset + _in + _out)
         return cmd
@@ -7,18 +7,60 @@ Github: https://github.com/headcase
 Description: A CLI utility for encoding video files
 """
 
+from importlib import import_module
+
 import click
-from loguru import logger
 
-from dlrippyr.convert import convert 
-from dlrippyr.info import info
+from dlrippyr import log
 
+# Subcommand -> (module:attribute, one-line help). Modules are imported only
+# when their subcommand runs, so `--help` and one command don't pay for the
+# rest
+SUBCOMMANDS = {
+    'cache': ('dlrippyr.cache:cache',
+              'Inspect and maintain the on-disk cache of video file metadata'),
+    'convert': ('dlrippyr.convert:convert',
+                'Encode AVC (H264) video files to HEVC (H265)'),
+    'info': ('dlrippyr.info:info',
+             'Print the metadata of video files, with library totals'),
+    'serve': ('dlrippyr.distributed:serve',
+              'Hand out encode jobs to `dlrippyr worker`s'),
+    'watch': ('dlrippyr.watch:watch',
+              'Watch a directory tree and encode video files as they arrive'),
+    'worker': ('dlrippyr.distributed:worker',
+               'Run encode jobs handed out by a `dlrippyr serve` coordinator'),
+}
 
-@click.group()
-@click.version_option()
-def cli():
-    pass
 
+class LazyGroup(click.Group):
+    """A group whose subcommands are imported on first use"""
+
+    def __init__(self, *args, lazy_subcommands=None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted({*super().list_commands(ctx), *self.lazy_subcommands})
 
-cli.add_command(convert)
-cli.add_command(info)
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            target = self.lazy_subcommands[cmd_name][0]
+            module, attr = target.split(':')
+            self.add_command(getattr(import_module(module), attr), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        # From the table above, rather than importing every subcommand
+        rows = [(name, self.lazy_subcommands[name][1]
+                 if name in self.lazy_subcommands and name not in self.commands
+                 else self.commands[name].get_short_help_str())
+                for name in self.list_commands(ctx)]
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_subcommands=SUBCOMMANDS)
+@click.version_option()
+def cli():
+    log.setup()
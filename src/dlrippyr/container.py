@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+"""
+In-process container header parsing. Reads just the MP4/MOV `moov` box or the
+Matroska `Info` and `Tracks` elements with bounded reads, and reports the
+first video track in the same shape as the ffprobe JSON Metadata asks for,
+so most files never need an ffprobe process. Anything these parsers don't
+understand returns None, and is left to ffprobe.
+"""
+
+import os
+import struct
+from fractions import Fraction
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+# Largest moov box, or Matroska Info/Tracks element, read into memory
+HEADER_LIMIT = 16 * 1024**2
+# Largest denominator kept for average frame rates, as in 24000/1001
+FPS_DENOMINATOR = 1001
+
+# ffprobe's names for the containers and codecs understood here
+MP4_FORMAT = 'mov,mp4,m4a,3gp,3g2,mj2'
+MKV_FORMAT = 'matroska,webm'
+MP4_CODECS = {
+    b'avc1': 'h264',
+    b'avc3': 'h264',
+    b'hvc1': 'hevc',
+    b'hev1': 'hevc',
+    b'av01': 'av1',
+    b'vp09': 'vp9',
+    b'mp4v': 'mpeg4',
+}
+MKV_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264',
+    'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_AV1': 'av1',
+    'V_VP9': 'vp9',
+    'V_VP8': 'vp8',
+    'V_MPEG2': 'mpeg2video',
+    'V_MPEG4/ISO/ASP': 'mpeg4',
+}
+AVC_PROFILES = {
+    66: 'Baseline',
+    77: 'Main',
+    88: 'Extended',
+    100: 'High',
+    110: 'High 10',
+    122: 'High 4:2:2',
+    244: 'High 4:4:4 Predictive',
+}
+HEVC_PROFILES = {1: 'Main', 2: 'Main 10', 3: 'Main Still Picture', 4: 'Rext'}
+
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+
+# Matroska element IDs, with their length markers
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+DEFAULT_DURATION = 0x23E383
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+VIDEO_TRACK = 1
+
+
+class HeaderError(Exception):
+    pass
+
+
+def _read(f: BinaryIO, pos: int, size: int) -> bytes:
+    if size > HEADER_LIMIT:
+        raise HeaderError(f'{size} byte header exceeds the read limit')
+    f.seek(pos)
+    data = f.read(size)
+    if len(data) < size:
+        raise HeaderError('truncated header')
+    return data
+
+
+def _profile(codec: str, config: Optional[bytes]) -> str:
+    """Profile name from an avcC/hvcC record, whose second byte carries the
+    profile number"""
+    if not config or len(config) < 2:
+        return ''
+    if codec == 'h264':
+        return AVC_PROFILES.get(config[1], '')
+    if codec == 'hevc':
+        return HEVC_PROFILES.get(config[1] & 0x1F, '')
+    return ''
+
+
+def _rate(rate: Optional[Fraction]) -> str:
+    if not rate:
+        return '0/0'
+    rate = rate.limit_denominator(FPS_DENOMINATOR)
+    return f'{rate.numerator}/{rate.denominator}'
+
+
+def _probe_json(format_name: str, codec: str, profile: str,
+                rate: Optional[Fraction], width: int, height: int,
+                duration: float, size: int) -> Dict:
+    """Shape the parsed header as Metadata.parse_json expects ffprobe's"""
+    return {
+        'streams': [{
+            'codec_name': codec,
+            'profile': profile,
+            'avg_frame_rate': _rate(rate),
+            'height': height,
+            'width': width,
+        }],
+        'format': {
+            'format_name': format_name,
+            'duration': f'{duration:.6f}',
+            'bit_rate': str(int(size * 8 / duration)),
+            'size': str(size),
+        },
+    }
+
+
+###############
+# MP4 and MOV #
+###############
+
+
+def _boxes(buf: bytes, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """(type, payload start, end) of each box laid out in buf[start:end]"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', buf, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise HeaderError(f'bad {kind!r} box')
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _child(buf: bytes, start: int, end: int,
+           path: Tuple[bytes, ...]) -> Optional[Tuple[int, int]]:
+    """Payload bounds of the first box found along path"""
+    for kind, child_start, child_end in _boxes(buf, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return child_start, child_end
+            return _child(buf, child_start, child_end, path[1:])
+    return None
+
+
+def _timing(buf: bytes, start: int) -> Tuple[int, int]:
+    """(timescale, duration) from an mvhd or mdhd payload"""
+    if buf[start] == 1:
+        return struct.unpack_from('>IQ', buf, start + 20)
+    return struct.unpack_from('>II', buf, start + 12)
+
+
+def _find_moov(f: BinaryIO, size: int) -> bytes:
+    """Top-level boxes are walked by their headers alone, so a moov written
+    after the media data costs a few seeks rather than a read of the file"""
+    pos = 0
+    while pos + 8 <= size:
+        head = _read(f, pos, min(16, size - pos))
+        length, kind = struct.unpack_from('>I4s', head)
+        header = 8
+        if length == 1:
+            length, = struct.unpack_from('>Q', head, 8)
+            header = 16
+        elif length == 0:
+            length = size - pos
+        if length < header:
+            break
+        if kind == b'moov':
+            return _read(f, pos + header, length - header)
+        pos += length
+    raise HeaderError('no moov box')
+
+
+def _mp4(f: BinaryIO, size: int) -> Optional[Dict]:
+    moov = _find_moov(f, size)
+    end = len(moov)
+
+    mvhd = _child(moov, 0, end, (b'mvhd', ))
+    if mvhd is None:
+        return None
+    timescale, duration = _timing(moov, mvhd[0])
+
+    for kind, start, stop in _boxes(moov, 0, end):
+        if kind != b'trak':
+            continue
+        hdlr = _child(moov, start, stop, (b'mdia', b'hdlr'))
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+
+        mdhd = _child(moov, start, stop, (b'mdia', b'mdhd'))
+        stbl = _child(moov, start, stop, (b'mdia', b'minf', b'stbl'))
+        if mdhd is None or stbl is None:
+            return None
+        media_scale, media_duration = _timing(moov, mdhd[0])
+        stsd = _child(moov, stbl[0], stbl[1], (b'stsd', ))
+        if stsd is None:
+            return None
+
+        # The first sample entry follows stsd's version, flags and count
+        entry = stsd[0] + 8
+        entry_size, fourcc = struct.unpack_from('>I4s', moov, entry)
+        codec = MP4_CODECS.get(fourcc)
+        if codec is None:
+            return None
+        width, height = struct.unpack_from('>HH', moov, entry + 32)
+
+        # Codec configuration boxes follow the 78 byte visual sample entry
+        config = None
+        for box, box_start, box_end in _boxes(moov, entry + 86,
+                                              entry + entry_size):
+            if box in (b'avcC', b'hvcC'):
+                config = moov[box_start:box_end]
+        profile = _profile(codec, config)
+
+        rate = None
+        stts = _child(moov, stbl[0], stbl[1], (b'stts', ))
+        if stts is not None and media_duration:
+            count, = struct.unpack_from('>I', moov, stts[0] + 4)
+            frames = sum(
+                struct.unpack_from('>I', moov, stts[0] + 8 + 8 * i)[0]
+                for i in range(count))
+            rate = Fraction(frames * media_scale, media_duration)
+
+        seconds = (duration / timescale if timescale and duration else
+                   media_duration / media_scale if media_scale else 0.0)
+        # Fragmented files carry no duration here; leave those to ffprobe
+        if not seconds or not width or not height:
+            return None
+        return _probe_json(MP4_FORMAT, codec, profile, rate, width, height,
+                           seconds, size)
+
+    return None
+
+
+############
+# Matroska #
+############
+
+
+def _vint(buf: bytes, pos: int, marker: bool = False) -> Tuple[Optional[int], int]:
+    """Decode an EBML variable length integer, returning it and its length.
+    IDs keep their length marker; sizes of all ones mean unknown (None)"""
+    if pos >= len(buf) or not buf[pos]:
+        raise HeaderError('bad EBML integer')
+    length = 9 - buf[pos].bit_length()
+    if pos + length > len(buf):
+        raise HeaderError('truncated EBML integer')
+    value = buf[pos] if marker else buf[pos] & (0xFF >> length)
+    for byte in buf[pos + 1:pos + length]:
+        value = value << 8 | byte
+    if not marker and value == (1 << 7 * length) - 1:
+        return None, length
+    return value, length
+
+
+def _elements(buf: bytes, start: int,
+              end: int) -> Iterator[Tuple[int, int, int]]:
+    """(id, data start, end) of each element laid out in buf[start:end]"""
+    pos = start
+    while pos < end:
+        element, id_length = _vint(buf, pos, marker=True)
+        size, size_length = _vint(buf, pos + id_length)
+        data = pos + id_length + size_length
+        if size is None or data + size > end:
+            raise HeaderError('bad EBML element size')
+        yield element, data, data + size
+        pos = data + size
+
+
+def _uint(data: bytes) -> int:
+    return int.from_bytes(data, 'big')
+
+
+def _float(data: bytes) -> float:
+    return struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+
+
+def _element_at(f: BinaryIO, pos: int) -> Tuple[int, int, Optional[int]]:
+    """Read the header of the element at pos: (id, data start, size)"""
+    f.seek(pos)
+    head = f.read(12)
+    element, id_length = _vint(head, 0, marker=True)
+    size, size_length = _vint(head, id_length)
+    return element, pos + id_length + size_length, size
+
+
+def _mkv(f: BinaryIO, size: int) -> Optional[Dict]:
+    element, data, length = _element_at(f, 0)
+    if element != EBML or length is None:
+        return None
+    header = _read(f, data, length)
+    for child, start, stop in _elements(header, 0, length):
+        if child == DOC_TYPE:
+            doc_type = header[start:stop].rstrip(b'\0')
+            if doc_type not in (b'matroska', b'webm'):
+                return None
+
+    element, segment, length = _element_at(f, data + length)
+    if element != SEGMENT:
+        return None
+    segment_end = size if length is None else min(size, segment + length)
+
+    # Walk the segment's top level until the first cluster, noting where the
+    # seek head says Info and Tracks are in case they come after it
+    found: Dict[int, bytes] = {}
+    seeks: Dict[int, int] = {}
+    pos = segment
+    while pos < segment_end and not (INFO in found and TRACKS in found):
+        element, start, length = _element_at(f, pos)
+        if element == CLUSTER or length is None:
+            break
+        if element in (INFO, TRACKS):
+            found[element] = _read(f, start, length)
+        elif element == SEEK_HEAD:
+            heads = _read(f, start, length)
+            for seek, seek_start, seek_end in _elements(heads, 0, length):
+                if seek != SEEK:
+                    continue
+                fields = {
+                    child: heads[child_start:child_end]
+                    for child, child_start, child_end in _elements(
+                        heads, seek_start, seek_end)
+                }
+                if SEEK_ID in fields and SEEK_POSITION in fields:
+                    seeks[_uint(fields[SEEK_ID])] = _uint(
+                        fields[SEEK_POSITION])
+        pos = start + length
+
+    for wanted in (INFO, TRACKS):
+        if wanted not in found and wanted in seeks:
+            element, start, length = _element_at(f, segment + seeks[wanted])
+            if element == wanted and length is not None:
+                found[wanted] = _read(f, start, length)
+    if INFO not in found or TRACKS not in found:
+        return None
+
+    info = found[INFO]
+    scale = 1000000
+    duration = 0.0
+    for child, start, stop in _elements(info, 0, len(info)):
+        if child == TIMECODE_SCALE:
+            scale = _uint(info[start:stop])
+        elif child == DURATION:
+            duration = _float(info[start:stop])
+    seconds = duration * scale / 1e9
+
+    tracks = found[TRACKS]
+    for child, start, stop in _elements(tracks, 0, len(tracks)):
+        if child != TRACK_ENTRY:
+            continue
+        fields = {
+            field: tracks[field_start:field_end]
+            for field, field_start, field_end in _elements(tracks, start, stop)
+        }
+        if _uint(fields.get(TRACK_TYPE, b'')) != VIDEO_TRACK:
+            continue
+
+        codec = MKV_CODECS.get(
+            fields.get(CODEC_ID, b'').rstrip(b'\0').decode('ascii', 'replace'))
+        if codec is None:
+            return None
+        video = fields.get(VIDEO, b'')
+        dimensions = {
+            field: _uint(video[field_start:field_end])
+            for field, field_start, field_end in _elements(video, 0, len(video))
+        }
+        width = dimensions.get(PIXEL_WIDTH, 0)
+        height = dimensions.get(PIXEL_HEIGHT, 0)
+        profile = _profile(codec, fields.get(CODEC_PRIVATE))
+        frame_ns = _uint(fields.get(DEFAULT_DURATION, b''))
+        rate = Fraction(10**9, frame_ns) if frame_ns else None
+
+        if not seconds or not width or not height:
+            return None
+        return _probe_json(MKV_FORMAT, codec, profile, rate, width, height,
+                           seconds, size)
+
+    return None
+
+
+def parse_header(path: Path) -> Optional[Dict]:
+    """ffprobe-shaped metadata for the first video track of an MP4/MOV or
+    Matroska file, read from its headers; None where ffprobe is needed"""
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            magic = f.read(8)
+            if magic[:4] == EBML_MAGIC:
+                return _mkv(f, size)
+            if magic[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide',
+                              b'skip'):
+                return _mp4(f, size)
+    except (OSError, HeaderError, struct.error, IndexError, ValueError,
+            ZeroDivisionError):
+        pass
+    return None
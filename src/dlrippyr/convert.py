@@ -7,17 +7,40 @@ Github: https://github.com/headcase
 Description: A CLI utility for encoding video files
 """
 
+from collections import defaultdict
 from pathlib import Path
 
 import click
 
-from dlrippyr.classes import DryRunJob, HandBrakeJob, Metadata, SampleJob
-from dlrippyr.utils import find_vfiles
+from dlrippyr.cache import MetadataCache
+from dlrippyr.chunked import DEFAULT_CHUNKS, ChunkedJob, chunks_for
+from dlrippyr.classes import DryRunJob, HandBrakeJob, SampleJob
+from dlrippyr.dedupe import Deduper
+from dlrippyr.history import History, Plan
+from dlrippyr.index import ScanIndex
+from dlrippyr.journal import PENDING, Journal, preset_hash
+from dlrippyr.metrics import metrics
+from dlrippyr.pipeline import Pipeline
+from dlrippyr.policy import DEFAULT_MIN_BPP, Policy
+from dlrippyr.predict import (DEFAULT_MIN_SAVING, DEFAULT_SAMPLES,
+                              Predictor)
+from dlrippyr.priority import ORDERS, Prioritiser
+from dlrippyr.probe import DEFAULT_PROBE_JOBS, ProbePool
+from dlrippyr.progress import LibraryProgress
+from dlrippyr.scheduler import Scheduler, parse_jobs
+from dlrippyr.staging import DEFAULT_SCRATCH_SIZE, Scratch
+from dlrippyr.throttle import Throttle, parse_windows
+from dlrippyr.verify import OFF, SAMPLED, TIERS, Verifier
 
 # TODO: Break these out into a config file
 DEFAULT_PRESET = 'conf/x265-1080p-mkv.json'
 EXTS = ['mkv', 'mp4', 'mov', 'wmv', 'avi']
 
+# Skip reasons, worded to follow "skipped as they are ..."
+HEVC_SKIP = 'already encoded in HEVC'
+RESUME_SKIP = 'already converted by a previous run'
+PREDICT_SKIP = 'predicted to shrink by less than {:g}%'
+
 
 class OutputOptionError(Exception):
     pass
@@ -35,7 +58,10 @@ class IncompatibleOptionsError(Exception):
     pass
 
 
-# TODO: sample default does not work as intended
+class JobFailedError(Exception):
+    pass
+
+
 @click.command()
 @click.version_option()
 @click.argument('srcs', nargs=-1, type=click.Path())
@@ -51,8 +77,8 @@ class IncompatibleOptionsError(Exception):
 @click.option('-s',
               '--sample',
               nargs=2,
-              default=(10, 20),
-              show_default=True,
+              type=int,
+              default=None,
               help='Convert only a sample, between the two supplied timecodes,'
               ' which are given as a space separated pair in total seconds.')
 @click.option('-d',
@@ -72,7 +98,169 @@ class IncompatibleOptionsError(Exception):
               is_flag=True,
               default=False,
               help='Optional flag to force (re)encoding of an HEVC file')
-def convert(srcs, output, preset, force, dry_run, sample):
+@click.option('--no-cache',
+              is_flag=True,
+              default=False,
+              help='Always probe files with ffprobe, bypassing the metadata '
+              'cache')
+@click.option('--rebuild-cache',
+              is_flag=True,
+              default=False,
+              help='Re-probe every file and overwrite its cached metadata')
+@click.option('--probe-jobs',
+              type=click.IntRange(min=1),
+              default=DEFAULT_PROBE_JOBS,
+              show_default=True,
+              help='Number of files to probe for metadata concurrently')
+@click.option('-j',
+              '--jobs',
+              default='1',
+              show_default=True,
+              callback=parse_jobs,
+              help='Number of encodes to run concurrently, or "auto" to size '
+              'encode slots from the core count and each source\'s '
+              'resolution')
+@click.option('--resume',
+              is_flag=True,
+              default=False,
+              help='Skip files the job journal records as already converted '
+              'with this preset, and clean up the partial outputs of an '
+              'interrupted run')
+@click.option('--order',
+              type=click.Choice(ORDERS),
+              default='scan',
+              show_default=True,
+              help='Order to encode in. "savings" puts the most disk freed '
+              'per CPU-second first, "size" the largest sources. Any order but '
+              '"scan" probes every file before the first encode starts')
+@click.option('--max-jobs',
+              type=click.IntRange(min=0),
+              default=None,
+              help='Encode at most this many files')
+@click.option('--budget',
+              type=click.FloatRange(min=0),
+              default=None,
+              help='Stop queueing encodes once their estimated cost reaches '
+              'this many CPU-hours')
+@click.option('--predict',
+              is_flag=True,
+              default=False,
+              help=f'Encode {DEFAULT_SAMPLES} short samples spread across each '
+              'file first, and skip files predicted to shrink by less than '
+              '--min-saving')
+@click.option('--min-saving',
+              type=click.FloatRange(0, 100),
+              default=DEFAULT_MIN_SAVING,
+              show_default=True,
+              help='Smallest predicted saving, as a percentage of the source '
+              'size, worth a full encode. Used with --predict')
+@click.option('--chunks',
+              type=click.IntRange(min=1),
+              default=DEFAULT_CHUNKS,
+              show_default=True,
+              help='Split each long file at keyframes into up to this many '
+              'segments, encode them concurrently and join the results')
+@click.option('--metrics-log',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Append scan, probe and encode events to this file as '
+              'JSON lines')
+@click.option('--metrics-textfile',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Keep Prometheus metrics in this file, for the '
+              'node_exporter textfile collector')
+@click.option('-q',
+              '--quiet',
+              is_flag=True,
+              default=False,
+              help='Instead of a live progress line, log a summary of overall '
+              'progress and ETA every minute. Suited to cron')
+@click.option('--changed-only',
+              is_flag=True,
+              default=False,
+              help='Only look at files added or modified since the last '
+              '--changed-only run, listing only directories whose mtime has '
+              'changed')
+@click.option('--min-bpp',
+              type=click.FloatRange(min=0),
+              default=DEFAULT_MIN_BPP,
+              help='Skip sources with fewer bits per pixel per frame than '
+              'this, which an encode is unlikely to shrink. Off by default; '
+              'the presets land on about 0.05')
+@click.option('--min-size',
+              type=click.FloatRange(min=0),
+              default=0,
+              help='Skip sources smaller than this many MiB')
+@click.option('--upscale/--no-upscale',
+              default=True,
+              show_default=True,
+              help='Whether to encode sources which HandBrake would scale up '
+              'to fit the preset\'s PictureWidth x PictureHeight, being '
+              'smaller in both dimensions')
+@click.option('--adaptive',
+              is_flag=True,
+              default=False,
+              help='Back off when other work loads the machine: run fewer '
+              'encodes at once, and pause them outright while it spikes')
+@click.option('--full-speed',
+              multiple=True,
+              metavar='HH:MM-HH:MM',
+              callback=parse_windows,
+              help='Daily window, which may span midnight, in which --adaptive '
+              'is off and encodes run flat out. May be given more than once')
+@click.option('--scratch',
+              type=click.Path(file_okay=False),
+              default=None,
+              help='Local directory, ideally on an SSD or tmpfs, to copy each '
+              'source to before its encode and write the output to, rather '
+              'than working over the network')
+@click.option('--scratch-size',
+              type=click.FloatRange(min=0),
+              default=DEFAULT_SCRATCH_SIZE,
+              show_default=True,
+              help='Most GiB of sources to stage on --scratch at once; larger '
+              'sources are encoded in place')
+@click.option('--scratch-bwlimit',
+              type=click.FloatRange(min=0),
+              default=0,
+              help='Cap copies to and from --scratch at this many MiB/s')
+@click.option('--verify',
+              type=click.Choice(TIERS),
+              default=None,
+              help='Check each finished encode, alongside the next: "probe" '
+              'compares duration, streams and frame count with the source, '
+              '"sampled" also compares PSNR/SSIM of a few decoded samples and '
+              '"full" also decodes the whole output. Default: "sampled" with '
+              '--replace-source, else "off"')
+@click.option('--replace-source',
+              is_flag=True,
+              default=False,
+              help='Once an encode passes verification, move it into its '
+              'source\'s place and delete the source')
+@click.option('--plan',
+              is_flag=True,
+              default=False,
+              help='Encode nothing; print the predicted encode time and space '
+              'saved for the files which would be, from past encodes of '
+              'similar files where there are enough of them')
+@click.option('--dedupe/--no-dedupe',
+              default=True,
+              show_default=True,
+              help='Encode only the first of any sources with identical '
+              'content, such as hard links or copies in several folders, and '
+              'skip the rest')
+@click.option('--link-duplicates',
+              is_flag=True,
+              default=False,
+              help='Link each skipped duplicate\'s output name to the output '
+              'encoded from its original')
+def convert(srcs, output, preset, force, dry_run, sample, no_cache,
+            rebuild_cache, probe_jobs, jobs, resume, order, max_jobs, budget,
+            predict, min_saving, chunks, metrics_log, metrics_textfile, quiet,
+            changed_only, min_bpp, min_size, upscale, adaptive, full_speed,
+            scratch, scratch_size, scratch_bwlimit, verify, replace_source,
+            plan, dedupe, link_duplicates):
     """
     A tool for encoding AVC (H264) video files to the more space-efficient
     HEVC (H265) codec using HandBrakeCLI. Accepts any number (or mix) of video
@@ -83,12 +271,25 @@ def convert(srcs, output, preset, force, dry_run, sample):
     # Constants #
     #############
 
-    job_list = []
-    flist = set()
-    skips = list()
+    skips = defaultdict(list)
+    # Files finished with, so --changed-only needn't show them again
+    settled = set()
     out = None
-    start_tm, end_tm = sample
+    cache = None if no_cache else MetadataCache(rebuild=rebuild_cache)
+    # Dry runs and plans change nothing on disk, so have nothing to journal
+    rehearsal = dry_run or plan
+    journal = None if rehearsal else Journal()
+    tracker = None if rehearsal else LibraryProgress(quiet=quiet)
+    history = None if dry_run else History()
+    planner = Plan(history, slots=jobs) if plan else None
+    deduper = Deduper() if dedupe else None
+    start_tm, end_tm = sample or (None, None)
+    policy = Policy.from_options(preset,
+                                 bpp=min_bpp,
+                                 size=min_size,
+                                 upscale=upscale)
     srcs = list(srcs)
+    metrics.configure(events=metrics_log, textfile=metrics_textfile)
 
     ######################
     # Exception handling #
@@ -110,40 +311,191 @@ def convert(srcs, output, preset, force, dry_run, sample):
         raise IncompatibleOptionsError(
             'Dry run (-d) and sample (-s) flags are incompatible')
 
+    if predict and sample:
+        raise IncompatibleOptionsError(
+            'Predict (--predict) and sample (-s) flags are incompatible')
+
+    if chunks > 1 and sample:
+        raise IncompatibleOptionsError(
+            'Chunked (--chunks) and sample (-s) encodes are incompatible')
+
+    if verify is None:
+        verify = SAMPLED if replace_source else OFF
+    if replace_source and verify == OFF:
+        raise IncompatibleOptionsError(
+            'Replacing sources (--replace-source) needs verification '
+            '(--verify) to be on')
+
+    if plan and (dry_run or sample):
+        raise IncompatibleOptionsError(
+            'Plan (--plan) is incompatible with dry run (-d) and sample (-s)')
+
+    if replace_source and sample:
+        raise IncompatibleOptionsError(
+            'Replace source (--replace-source) and sample (-s) flags are '
+            'incompatible')
+
     #############
     # Main loop #
     #############
 
-    # Support for user supplying a mixture of one or many files and/or
-    # directories
-    for src in srcs:
-        flist = flist.union(find_vfiles(src))
+    def prefilter(file):
+        # Every file goes past the deduper, so it knows every original
+        if deduper is not None:
+            reason = deduper(file)
+            if reason is not None:
+                return reason
+        # Rehearsals keep no journal, so resume against nothing
+        if resume and journal is not None and journal.is_done(file, preset):
+            return RESUME_SKIP
+        return None
 
-    for file in flist:
-        meta = Metadata(file)
+    def classify(file, meta):
         if meta.codec_name == 'hevc' and not force:
-            skips.append(file)
-        elif dry_run:
-            job_list.append(DryRunJob(file, preset=preset, output=out))
-        elif sample:
-            job_list.append(
-                SampleJob(file,
-                          preset=preset,
-                          output=out,
-                          start_tm=start_tm,
-                          end_tm=end_tm))
+            return HEVC_SKIP
+        reason = policy(meta)
+        if reason is not None:
+            return reason
+        if dry_run:
+            return DryRunJob(file, preset=preset, output=out, meta=meta)
+
+        if predictor is not None:
+            prediction = predictor.predict(meta)
+            if prediction is not None and prediction.saving < min_saving:
+                return PREDICT_SKIP.format(min_saving)
+
+        if sample:
+            job = SampleJob(file,
+                            preset=preset,
+                            output=out,
+                            start_tm=start_tm,
+                            end_tm=end_tm,
+                            meta=meta)
+        elif chunks_for(meta, chunks) > 1:
+            job = ChunkedJob(file,
+                             preset=preset,
+                             output=out,
+                             chunks=chunks_for(meta, chunks),
+                             meta=meta)
         else:
-            job_list.append(HandBrakeJob(file, preset=preset, output=out))
+            job = HandBrakeJob(file, preset=preset, output=out, meta=meta)
+        if journal is not None:
+            journal.mark(job, PENDING)
+        if tracker is not None:
+            tracker.add(job)
+        return job
+
+    if resume and journal is not None:
+        for partial in journal.recover():
+            click.echo(f'Removed partial output {partial}')
 
-    if not job_list:
+    # Support for user supplying a mixture of one or many files and/or
+    # directories. Scanning, probing and encoding run concurrently as a
+    # pipeline, so the first encode starts as soon as its file is probed
+    def on_skip(file, reason):
+        skips[reason].append(file)
+        # Files which need no encode whatever the options; others, like those
+        # cut by --budget or a policy, are looked at again next time
+        if reason in (HEVC_SKIP, RESUME_SKIP) or (deduper is not None and
+                                                  file in deduper.duplicates):
+            settled.add(file)
+        # Budget and --max-jobs skips come after the job was queued
+        if tracker is not None:
+            tracker.discard(file)
+
+    # Per preset, as a file encoded with one is still new to another
+    index = ScanIndex(consumer=f'convert-{preset_hash(preset)}'
+                      ) if changed_only else None
+    if index is not None:
+        diff = index.scan(srcs)
+        click.echo(f'Since the last run: {diff}')
+        files = diff.changed
+
+    verifier = None if rehearsal or verify == OFF else Verifier(
+        verify, replace=replace_source)
+    scratch = None if rehearsal else Scratch.from_options(
+        scratch, scratch_size, scratch_bwlimit)
+    scheduler = Scheduler(slots=jobs,
+                          journal=journal,
+                          tracker=tracker,
+                          scratch=scratch,
+                          verifier=verifier,
+                          on_done=None if history is None else history.record)
+    predictor = Predictor(preset, budget=scheduler
+                          ) if predict and not rehearsal else None
+    throttle = (Throttle(scheduler, windows=full_speed)
+                if adaptive and not rehearsal else None)
+    prioritiser = Prioritiser(order=order,
+                              max_jobs=max_jobs,
+                              budget=budget,
+                              on_skip=on_skip)
+
+    if tracker is not None:
+        tracker.start()
+    if throttle is not None:
+        throttle.start()
+    try:
+        with ProbePool(workers=probe_jobs, cache=cache) as pool:
+            pipeline = Pipeline(pool,
+                                scheduler,
+                                classify,
+                                on_skip=on_skip,
+                                prefilter=prefilter,
+                                arrange=prioritiser if planner is None else
+                                lambda jobs: planner(prioritiser(jobs)))
+            if index is None:
+                summary = pipeline.run(srcs)
+            else:
+                summary = pipeline.feed(files)
+    finally:
+        if throttle is not None:
+            throttle.stop()
+        if tracker is not None:
+            tracker.stop()
+        if scratch is not None:
+            scratch.close()
+
+    if cache is not None:
+        cache.close()
+    if journal is not None:
+        journal.close()
+    if history is not None:
+        history.close()
+    if index is not None:
+        # Keep everything not encoded or settled in the next delta, like
+        # failures, unprobeable files and budget cuts; a rehearsal consumes
+        # nothing
+        if not rehearsal:
+            settled.update(Path(result.job.input)
+                           for result in summary.succeeded)
+            for file in files:
+                if Path(file) not in settled:
+                    index.forget(file)
+            index.commit()
+        index.close()
+    metrics.close()
+
+    # An unchanged library is nothing to complain about
+    planned = planner is not None and planner.files
+    if not summary.results and not skips and not changed_only and not planned:
         raise SourceFileNotFoundError('No processable media files were found.')
 
-    for job in job_list:
-        job.run_handbrake()
+    if summary.results:
+        click.echo(summary)
+    if link_duplicates and deduper is not None and not rehearsal:
+        outputs = {r.job.input: r.job.output for r in summary.succeeded}
+        for link, target in deduper.link(outputs):
+            click.echo(f'Linked {link} to {target}')
+    if planner is not None:
+        click.echo(planner)
 
-    if skips:
-        click.echo('The following files were skipped as they are already'
-                   ' encoded in HEVC:')
-        for file in skips:
+    for reason, files in skips.items():
+        click.echo(f'The following files were skipped as they are {reason}:')
+        for file in files:
             click.echo(f'     {file}')
-        click.echo('You can force their encoding with -f/--force')
+        if reason == HEVC_SKIP:
+            click.echo('You can force their encoding with -f/--force')
+
+    if summary.failed:
+        raise JobFailedError(f'{len(summary.failed)} of '
+                             f'{len(summary.results)} jobs failed')
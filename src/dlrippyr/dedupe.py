@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Duplicate source detection, as files come off the scanner. Hard links to a
+file already seen are caught from the inode alone. Otherwise only files of
+the same size can be copies of each other, so a file is hashed only once
+another of its size turns up: first a quick hash of blocks from its head,
+middle and tail, read through mmap, and then, if that matches, a hash of the
+whole file to be sure. The first of each set of duplicates is encoded and the
+rest are skipped, and their outputs can be linked to its output afterwards.
+"""
+
+import hashlib
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from dlrippyr.classes import output_name_from_input
+from dlrippyr.log import logger
+from dlrippyr.metrics import metrics
+
+# Skip reasons, worded to follow "skipped as they are ..."
+HARDLINK_SKIP = 'hard links to {}'
+DUPLICATE_SKIP = 'duplicates of {}'
+
+# Bytes hashed from each of the head, middle and tail for the quick hash
+BLOCK_SIZE = 1024**2
+# Bytes hashed at a time for the full hash
+CHUNK_SIZE = 16 * 1024**2
+
+
+def _digest(path: Path, full: bool) -> bytes:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return digest.digest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if full:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                for offset in range(0, size, CHUNK_SIZE):
+                    digest.update(mm[offset:offset + CHUNK_SIZE])
+            else:
+                middle = max(0, size // 2 - BLOCK_SIZE // 2)
+                for offset in (0, middle, max(0, size - BLOCK_SIZE)):
+                    digest.update(mm[offset:offset + BLOCK_SIZE])
+    return digest.digest()
+
+
+def partial_hash(path: Path) -> bytes:
+    """Hash of the blocks at path's head, middle and tail"""
+    return _digest(path, full=False)
+
+
+def full_hash(path: Path) -> bytes:
+    return _digest(path, full=True)
+
+
+class _Original:
+    """The first file seen with some content, hashed only when needed"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._partial: Optional[bytes] = None
+        self._full: Optional[bytes] = None
+
+    @property
+    def partial(self) -> bytes:
+        if self._partial is None:
+            self._partial = partial_hash(self.path)
+        return self._partial
+
+    @property
+    def full(self) -> bytes:
+        if self._full is None:
+            self._full = full_hash(self.path)
+        return self._full
+
+
+class Deduper:
+    """Pipeline prefilter which skips files whose content has already been
+    seen, returning the reason, and remembers which file each duplicates"""
+    duplicates: Dict[Path, Path]
+
+    def __init__(self) -> None:
+        self._inodes: Dict[Tuple[int, int], Path] = {}
+        self._sizes: Dict[int, List[_Original]] = {}
+        # Duplicate -> the original that is encoded in its place
+        self.duplicates = {}
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}({len(self.duplicates)} '
+                'duplicates)')
+
+    def __call__(self, path: Path) -> Optional[str]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Left for the probe to report
+            return None
+
+        inode = (st.st_dev, st.st_ino)
+        if inode in self._inodes:
+            first = self._inodes[inode]
+            if first in self.duplicates:
+                # A hard link to a copy is a copy of that copy's original
+                return self._skip(path, self.duplicates[first],
+                                  DUPLICATE_SKIP, 'hardlink')
+            return self._skip(path, first, HARDLINK_SKIP, 'hardlink')
+        self._inodes[inode] = path
+        if not st.st_size:
+            return None
+
+        originals = self._sizes.setdefault(st.st_size, [])
+        candidate = _Original(path)
+        try:
+            for original in originals:
+                if (candidate.partial == original.partial
+                        and candidate.full == original.full):
+                    return self._skip(path, original.path, DUPLICATE_SKIP,
+                                      'content')
+        except OSError as err:
+            logger.warning(f'Unable to check {path} for duplicates: {err}')
+            return None
+        originals.append(candidate)
+        return None
+
+    def link(self, outputs: Dict[Path, Path]) -> List[Tuple[Path, Path]]:
+        """Give each duplicate whose original was encoded, per outputs
+        (input -> output), a link to that output under the name its own
+        encode would have had. Returns the (link, target) pairs made"""
+        made = []
+        for duplicate, original in self.duplicates.items():
+            target = outputs.get(original)
+            if target is None:
+                continue
+            name = output_name_from_input(duplicate)
+            if name.exists() or Path(target).resolve() == name.resolve():
+                continue
+            try:
+                os.link(target, name)
+            except OSError:
+                # Across filesystems, or where hard links aren't supported
+                os.symlink(os.path.abspath(target), name)
+            made.append((name, Path(target)))
+        return made
+
+    def _skip(self, path: Path, original: Path, reason: str,
+              kind: str) -> str:
+        self.duplicates[path] = original
+        metrics.inc('dlrippyr_duplicates_total', kind=kind)
+        return reason.format(original)
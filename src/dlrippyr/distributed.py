@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+"""
+Distributed encoding. `dlrippyr serve` scans and probes the library as
+convert does and hands the resulting jobs out to any number of `dlrippyr
+worker` processes over TCP or a Unix socket. Workers report progress and
+results; a job whose worker goes quiet is re-queued.
+
+Jobs travel as their input, output and preset rather than as a command line:
+each worker builds its own HandBrakeCLI command from them, so a coordinator
+can't have a worker run anything else.
+
+Messages are JSON objects, one per line. Workers and coordinator must see the
+library and preset at the same paths, e.g. on a shared mount.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import click
+
+from dlrippyr.cache import MetadataCache
+from dlrippyr.classes import (HandBrakeJob, Job, output_name_from_input,
+                              partial_name)
+from dlrippyr.log import logger
+from dlrippyr.pipeline import Pipeline
+from dlrippyr.probe import DEFAULT_PROBE_JOBS, ProbePool
+from dlrippyr.runner import Progress
+from dlrippyr.scheduler import JobResult, Summary
+
+DEFAULT_ADDRESS = 'localhost:7272'
+DEFAULT_PRESET = 'conf/x265-1080p-mkv.json'
+# Seconds without word from a worker before its job is handed to another
+LEASE_TIMEOUT = 300
+HEARTBEAT_INTERVAL = 30
+# Seconds an idle worker waits before asking again for work
+POLL_INTERVAL = 5
+# Jobs probed and waiting for a worker
+QUEUE_SIZE = 16
+
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(address: str) -> Address:
+    """`unix:/path/to.sock` for a Unix socket, otherwise `host:port`"""
+    if address.startswith('unix:'):
+        return address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def send(stream, **message) -> None:
+    stream.write(json.dumps(message).encode() + b'\n')
+    stream.flush()
+
+
+def receive(stream) -> Optional[Dict]:
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Lease:
+    job: Job
+    worker: str
+    token: str
+    timeout: float
+    deadline: float
+    progress: Optional[Dict]
+    # Set once the worker is cleared to move its output into place, after
+    # which the lease no longer times out
+    finishing: bool
+
+    def __init__(self, job: Job, worker: str, token: str,
+                 timeout: float) -> None:
+        self.job = job
+        self.worker = worker
+        # Unique to this lease of the job, so a worker still running an
+        # expired lease neither writes over the new one's partial output nor
+        # has its result taken for the new one's
+        self.token = token
+        self.timeout = timeout
+        self.progress = None
+        self.finishing = False
+        self.renew()
+
+    def renew(self) -> None:
+        self.deadline = time.monotonic() + self.timeout
+
+
+class Coordinator:
+    """Own the job queue and lease jobs out to workers.
+
+    Stands in for a Scheduler at the end of a Pipeline: run() consumes the
+    job stream, holding back once capacity jobs are waiting, and returns a
+    Summary once every job has a result.
+    """
+    address: Address
+    capacity: int
+    lease_timeout: float
+
+    def __init__(self,
+                 address: Address,
+                 capacity: int = QUEUE_SIZE,
+                 lease_timeout: float = LEASE_TIMEOUT) -> None:
+        self.capacity = capacity
+        self.lease_timeout = lease_timeout
+        self._queue: deque = deque()
+        self._leases: Dict[int, Lease] = {}
+        self._results: List[JobResult] = []
+        self._started: Dict[int, float] = {}
+        self._next_id = 0
+        self._next_lease = 0
+        self._feeding = True
+        self._cond = threading.Condition()
+        self._server = self._make_server(address)
+        self.address = self._server.server_address
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.address!r})'
+
+    def run(self, jobs: Iterable[Job]) -> Summary:
+        start = time.monotonic()
+        threading.Thread(target=self._server.serve_forever,
+                         name='dlrippyr-serve',
+                         daemon=True).start()
+        threading.Thread(target=self._reap, name='dlrippyr-reap',
+                         daemon=True).start()
+        logger.info(f'Coordinator listening on {self.address}')
+
+        try:
+            for job in jobs:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: len(self._queue) < self.capacity)
+                    self._queue.append((self._next_id, job))
+                    self._next_id += 1
+                    self._cond.notify_all()
+            with self._cond:
+                self._feeding = False
+                self._cond.wait_for(self._finished)
+        finally:
+            self._server.shutdown()
+            self._server.server_close()
+            if isinstance(self.address, str):
+                Path(self.address).unlink(missing_ok=True)
+
+        return Summary(self._results, time.monotonic() - start)
+
+    # The methods below are called from connection handler threads
+
+    def lease(self, worker: str) -> Dict:
+        """The next job for worker, or word to wait or stop"""
+        with self._cond:
+            if not self._queue:
+                return {'type': 'done' if self._finished() else 'wait'}
+            job_id, job = self._queue.popleft()
+            token = f'lease{self._next_lease}'
+            self._next_lease += 1
+            self._leases[job_id] = Lease(job, worker, token,
+                                         self.lease_timeout)
+            self._started.setdefault(job_id, time.monotonic())
+            self._cond.notify_all()
+
+        logger.info(f'Job {job_id} ({job.input}) leased to {worker}')
+        message = {
+            'type': 'job',
+            'id': job_id,
+            'lease': token,
+            'input': str(job.input),
+            'output': str(job.output),
+            'preset': str(job.preset),
+        }
+        if getattr(job, 'start_tm', None) is not None:
+            # A sample of the source rather than all of it
+            message.update(start=job.start_tm, end=job.end_tm)
+        return message
+
+    def heartbeat(self, job_id: int, token: str, progress: Dict) -> None:
+        with self._cond:
+            lease = self._leases.get(job_id)
+            if lease is not None and lease.token == token:
+                lease.renew()
+                lease.progress = progress
+
+    def confirm(self, job_id: int, token: str) -> bool:
+        """Whether a worker's lease of a job still stands, so that it may
+        move its output into place. Once confirmed, the lease is not timed
+        out and handed to another worker"""
+        with self._cond:
+            lease = self._leases.get(job_id)
+            if lease is None or lease.token != token:
+                return False
+            lease.finishing = True
+            return True
+
+    def complete(self, job_id: int, token: str, returncode: int) -> None:
+        with self._cond:
+            lease = self._leases.get(job_id)
+            if lease is None or lease.token != token:
+                # A stale lease; the job was re-queued, and the result of
+                # its current lease is the one that stands
+                return
+            worker = lease.worker
+            del self._leases[job_id]
+            elapsed = time.monotonic() - self._started.pop(job_id)
+            self._results.append(
+                JobResult(lease.job, returncode=returncode, elapsed=elapsed))
+            self._cond.notify_all()
+        logger.info(f'Job {job_id} finished on {worker} with {returncode}')
+
+    def release(self, worker: str) -> None:
+        """Re-queue every job leased to a worker which has disconnected"""
+        with self._cond:
+            for job_id, lease in list(self._leases.items()):
+                if lease.worker == worker:
+                    self._requeue(job_id)
+
+    def _reap(self) -> None:
+        while True:
+            time.sleep(min(self.lease_timeout, HEARTBEAT_INTERVAL) / 2)
+            now = time.monotonic()
+            with self._cond:
+                for job_id, lease in list(self._leases.items()):
+                    if not lease.finishing and lease.deadline < now:
+                        logger.warning(f'Job {job_id} timed out on '
+                                       f'{lease.worker}')
+                        self._requeue(job_id)
+
+    def _requeue(self, job_id: int) -> None:
+        # Caller must hold self._cond
+        lease = self._leases.pop(job_id)
+        self._queue.appendleft((job_id, lease.job))
+        self._cond.notify_all()
+
+    def _finished(self) -> bool:
+        return not (self._feeding or self._queue or self._leases)
+
+    def _make_server(self, address: Address) -> socketserver.BaseServer:
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self) -> None:
+                worker = f'{self.client_address or "unix"}-{id(self)}'
+                try:
+                    while True:
+                        message = receive(self.rfile)
+                        if message is None:
+                            break
+                        kind = message.get('type')
+                        if kind == 'hello':
+                            worker = message.get('worker', worker)
+                        elif kind == 'request':
+                            send(self.wfile, **coordinator.lease(worker))
+                        elif kind == 'progress':
+                            coordinator.heartbeat(message['id'],
+                                                  message.get('lease'),
+                                                  message)
+                        elif kind == 'finish':
+                            send(self.wfile,
+                                 type='finish',
+                                 ok=coordinator.confirm(
+                                     message['id'], message.get('lease')))
+                        elif kind == 'result':
+                            coordinator.complete(message['id'],
+                                                 message.get('lease'),
+                                                 message['returncode'])
+                except (OSError, ValueError) as err:
+                    logger.warning(f'Lost worker {worker}: {err!r}')
+                finally:
+                    coordinator.release(worker)
+
+        if isinstance(address, str):
+            Path(address).unlink(missing_ok=True)
+            return _UnixServer(address, Handler)
+        return _TCPServer(address, Handler)
+
+
+class RemoteJob(HandBrakeJob):
+    """A job received from a coordinator. Its command is built here from
+    the fields of the message, writing to a partial output of its lease's
+    own, which only replaces the output once the coordinator confirms the
+    lease still stands"""
+    token: str
+    start_tm: Optional[int]
+    end_tm: Optional[int]
+    confirm: Callable[[], bool]
+
+    def __init__(self,
+                 input: Path,
+                 output: Path,
+                 preset: str,
+                 token: str,
+                 start_tm: Optional[int] = None,
+                 end_tm: Optional[int] = None,
+                 confirm: Callable[[], bool] = lambda: True) -> None:
+        self.token = token
+        self.start_tm = start_tm
+        self.end_tm = end_tm
+        self.confirm = confirm
+        super().__init__(input, preset=preset, output=output)
+
+    @classmethod
+    def from_message(cls, message: Dict, **kwargs) -> 'RemoteJob':
+        """The job a lease message describes. Raises ValueError for fields
+        missing or out of place"""
+        paths = [message.get(field) for field in ('input', 'output', 'preset')]
+        if not all(isinstance(path, str) and os.path.isabs(path)
+                   for path in paths):
+            raise ValueError('input, output and preset must be absolute paths')
+        token = message.get('lease')
+        if not isinstance(token, str) or not token.isalnum():
+            raise ValueError(f'Bad lease token {token!r}')
+        window = [message.get('start'), message.get('end')]
+        if window != [None, None] and not all(
+                isinstance(tm, int) and tm >= 0 for tm in window):
+            raise ValueError(f'Bad sample window {window!r}')
+
+        input, output, preset = paths
+        return cls(Path(input), Path(output), preset, token, *window,
+                   **kwargs)
+
+    @property
+    def partial(self) -> Path:
+        return partial_name(self.output, self.token)
+
+    def make_cmd(self) -> List[str]:
+        preset_name = Path(self.preset).stem
+        cmd = 'nice -n 10 HandBrakeCLI '.split()
+        cmd.extend(
+            ['--preset-import-file', self.preset, '-Z', preset_name])
+        if self.start_tm is not None:
+            cmd.extend([
+                '--start-at', f'seconds:{self.start_tm}', '--stop-at',
+                f'seconds:{self.end_tm - self.start_tm}'
+            ])
+        cmd.extend(['-i', str(self.input), '-o', str(self.partial)])
+        return cmd
+
+    def finalise(self, returncode: int) -> None:
+        if not self.partial.exists():
+            return
+        if returncode == 0 and self.confirm():
+            os.replace(self.partial, self.output)
+            return
+        if returncode == 0:
+            logger.warning(f'Lease of {self.input} expired; discarding '
+                           'its output')
+        self.partial.unlink()
+
+
+class Worker:
+    """Pull jobs from a coordinator and run them until told to stop"""
+    address: Address
+    name: str
+    poll_interval: float
+
+    def __init__(self,
+                 address: Address,
+                 name: Optional[str] = None,
+                 poll_interval: float = POLL_INTERVAL) -> None:
+        self.address = address
+        self.name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self.poll_interval = poll_interval
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}("{self.name}")'
+
+    def run(self) -> int:
+        """Work until the coordinator has no more jobs, returning how many
+        this worker ran"""
+        family = (socket.AF_UNIX
+                  if isinstance(self.address, str) else socket.AF_INET)
+        if family == socket.AF_INET:
+            sock = socket.create_connection(self.address)
+        else:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.connect(self.address)
+
+        ran = 0
+        with sock, sock.makefile('rwb') as stream:
+            lock = threading.Lock()
+            send(stream, type='hello', worker=self.name)
+            while True:
+                with lock:
+                    send(stream, type='request')
+                    message = receive(stream)
+                if message is None or message['type'] == 'done':
+                    break
+                if message['type'] == 'wait':
+                    time.sleep(self.poll_interval)
+                    continue
+                self._run_job(message, stream, lock)
+                ran += 1
+        return ran
+
+    def _run_job(self, message: Dict, stream, lock: threading.Lock) -> None:
+        job_id = message['id']
+        token = message.get('lease')
+
+        def confirm() -> bool:
+            with lock:
+                send(stream, type='finish', id=job_id, lease=token)
+                reply = receive(stream)
+            return bool(reply and reply.get('ok'))
+
+        try:
+            job = RemoteJob.from_message(message, confirm=confirm)
+        except ValueError as err:
+            logger.error(f'Refusing job {job_id}: {err}')
+            with lock:
+                send(stream, type='result', id=job_id, lease=token,
+                     returncode=-1)
+            return
+        finished = threading.Event()
+
+        def report(progress: Optional[Progress]) -> None:
+            fields = {} if progress is None else {
+                'percent': progress.percent,
+                'fps': progress.fps,
+                'eta': progress.eta,
+            }
+            with lock:
+                send(stream,
+                     type='progress',
+                     id=job_id,
+                     lease=token,
+                     **fields)
+
+        def heartbeat() -> None:
+            while not finished.wait(HEARTBEAT_INTERVAL):
+                report(job.progress)
+
+        logger.info(f'Running job {job_id}: {job}')
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            returncode = job.run_handbrake()
+        except Exception:
+            logger.exception(f'Job {job_id} raised')
+            returncode = -1
+        finally:
+            finished.set()
+        with lock:
+            send(stream,
+                 type='result',
+                 id=job_id,
+                 lease=token,
+                 returncode=returncode)
+
+
+@click.command()
+@click.argument('srcs', nargs=-1, type=click.Path(), required=True)
+@click.option('-a',
+              '--address',
+              default=DEFAULT_ADDRESS,
+              show_default=True,
+              help='Address to listen on, as host:port or unix:/path')
+@click.option('-p',
+              '--preset',
+              default=DEFAULT_PRESET,
+              show_default=True,
+              help='Conversion preset as created using the HandBrake GUI.'
+              'JSON format.')
+@click.option('-f',
+              '--force',
+              is_flag=True,
+              default=False,
+              help='Optional flag to force (re)encoding of an HEVC file')
+@click.option('--probe-jobs',
+              type=click.IntRange(min=1),
+              default=DEFAULT_PROBE_JOBS,
+              show_default=True,
+              help='Number of files to probe for metadata concurrently')
+@click.option('--timeout',
+              type=click.FloatRange(min=1),
+              default=LEASE_TIMEOUT,
+              show_default=True,
+              help='Seconds without word from a worker before its job is '
+              're-queued')
+def serve(srcs, address, preset, force, probe_jobs, timeout):
+    """
+    Scan and probe the supplied files and/or directories and coordinate their
+    encoding across workers started with `dlrippyr worker`.
+    """
+    skips = []
+
+    def classify(file, meta):
+        if meta.codec_name == 'hevc' and not force:
+            return 'already encoded in HEVC'
+        # Absolute, as workers needn't share the coordinator's directory
+        return HandBrakeJob(Path(file).resolve(),
+                            preset=os.path.abspath(preset),
+                            output=Path.cwd() / output_name_from_input(file),
+                            meta=meta)
+
+    coordinator = Coordinator(parse_address(address), lease_timeout=timeout)
+    with MetadataCache() as cache, ProbePool(workers=probe_jobs,
+                                             cache=cache) as pool:
+        pipeline = Pipeline(pool,
+                            coordinator,
+                            classify,
+                            on_skip=lambda file, reason: skips.append(file))
+        summary = pipeline.run(srcs)
+
+    click.echo(summary)
+    if skips:
+        click.echo(f'{len(skips)} files were skipped as they are already '
+                   'encoded in HEVC')
+
+
+@click.command()
+@click.option('-a',
+              '--address',
+              default=DEFAULT_ADDRESS,
+              show_default=True,
+              help='Coordinator to pull jobs from, as host:port or '
+              'unix:/path')
+@click.option('-n',
+              '--name',
+              default=None,
+              help='Name to report to the coordinator. Default: host-pid')
+def worker(address, name):
+    """
+    Run encode jobs handed out by a `dlrippyr serve` coordinator until it has
+    none left.
+    """
+    ran = Worker(parse_address(address), name=name).run()
+    click.echo(f'Ran {ran} jobs')
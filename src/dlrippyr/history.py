@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+History of finished encodes: how long each took and how small it came out,
+by preset, kind of job and source resolution. New jobs' encode times and
+output sizes are predicted from the history of similar ones, falling back
+to a rough model of resolution and duration where there is none, so
+`convert --plan` can say up front whether a batch fits its window.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from statistics import median
+from typing import Iterable, Iterator, Optional
+
+from dlrippyr.classes import DryRunJob, Job, SampleJob
+from dlrippyr.journal import default_state_dir, preset_hash
+from dlrippyr.priority import (estimate_cpu_seconds, estimate_output_bytes,
+                               input_bytes)
+from dlrippyr.scheduler import JobResult, encode_threads
+
+# Similar jobs needed before history is trusted over the model
+MIN_HISTORY = 3
+# Most recent similar jobs a prediction is drawn from
+HISTORY_WINDOW = 50
+# Sources within this factor of each other's height count as similar
+HEIGHT_FACTOR = 1.34
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS encodes (
+    preset_hash  TEXT NOT NULL,
+    preset       TEXT NOT NULL,
+    job          TEXT NOT NULL,
+    width        INTEGER NOT NULL,
+    height       INTEGER NOT NULL,
+    fps          REAL NOT NULL,
+    duration     REAL NOT NULL,
+    wall_seconds REAL NOT NULL,
+    avg_fps      REAL,
+    input_bytes  INTEGER NOT NULL,
+    output_bytes INTEGER NOT NULL,
+    finished     REAL NOT NULL DEFAULT (julianday('now'))
+);
+CREATE INDEX IF NOT EXISTS encodes_by_kind ON encodes (preset_hash, job);
+'''
+
+
+class Estimate:
+    """Predicted wall time and output size of one encode"""
+    input_bytes: float
+    output_bytes: float
+    wall_seconds: float
+    from_history: bool
+
+    def __init__(self, input_bytes: float, output_bytes: float,
+                 wall_seconds: float, from_history: bool) -> None:
+        self.input_bytes = input_bytes
+        self.output_bytes = output_bytes
+        self.wall_seconds = wall_seconds
+        self.from_history = from_history
+
+    def __repr__(self) -> str:
+        source = 'history' if self.from_history else 'model'
+        return (f'{self.__class__.__name__}({self.wall_seconds:.0f}s, '
+                f'{self.output_bytes / 1024**2:.0f} MiB, from {source})')
+
+
+def _pixels(width: int, height: int, frames: float) -> float:
+    return width * height * frames
+
+
+class History:
+    """SQLite-backed record of finished encodes, safe to share across
+    threads"""
+    db_path: Path
+
+    def __init__(self, db_path: Optional[Path] = None) -> None:
+        if db_path is None:
+            db_path = default_state_dir() / 'history.sqlite'
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._hashes: dict = {}
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}("{self.db_path}")'
+
+    def __enter__(self) -> 'History':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def record(self, result: JobResult) -> None:
+        """Remember a successful full encode; a Scheduler's on_done"""
+        job = result.job
+        if (not result.ok or job.meta is None
+                or isinstance(job, (SampleJob, DryRunJob))):
+            return
+        try:
+            outsize = Path(job.output).stat().st_size
+        except OSError:
+            return
+        meta = job.meta
+        avg_fps = None if job.progress is None else job.progress.avg_fps
+        row = (self._hash(job.preset), job.preset, type(job).__name__,
+               int(meta.width), int(meta.height), meta.fps, meta.duration,
+               result.elapsed, avg_fps, int(input_bytes(meta)), outsize)
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO encodes (preset_hash, preset, job, width, '
+                'height, fps, duration, wall_seconds, avg_fps, input_bytes, '
+                'output_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            self._conn.commit()
+
+    def estimate(self, job: Job) -> Estimate:
+        """Predict a job's encode time and output size from similar past
+        encodes, or from resolution and duration without enough of them"""
+        meta = job.meta
+        height = int(meta.height)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT width, height, fps, duration, wall_seconds, '
+                'output_bytes FROM encodes WHERE preset_hash = ? AND job = ? '
+                'AND height BETWEEN ? AND ? ORDER BY finished DESC LIMIT ?',
+                (self._hash(job.preset), type(job).__name__,
+                 height / HEIGHT_FACTOR, height * HEIGHT_FACTOR,
+                 HISTORY_WINDOW)).fetchall()
+
+        insize = input_bytes(meta)
+        pixels = _pixels(int(meta.width), height, meta.frames)
+        rates = []
+        bits = []
+        for past_width, past_height, fps, duration, wall, outsize in rows:
+            done = _pixels(past_width, past_height, duration * fps)
+            if done and wall:
+                rates.append(done / wall)
+                bits.append(outsize * 8 / done)
+        if len(rates) < MIN_HISTORY or not pixels:
+            return Estimate(insize, estimate_output_bytes(meta),
+                            estimate_cpu_seconds(meta) / encode_threads(job),
+                            False)
+        # Medians, so one encode which shared the box with something heavy
+        # doesn't skew the rest
+        return Estimate(insize, min(insize,
+                                    median(bits) * pixels / 8),
+                        pixels / median(rates), True)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _hash(self, preset: str) -> str:
+        if preset not in self._hashes:
+            self._hashes[preset] = preset_hash(preset)
+        return self._hashes[preset]
+
+
+class Plan:
+    """Totals of the estimates for a batch of jobs, which it consumes
+    without running. Used as the last arrange() step of a Pipeline"""
+    history: History
+    slots: Optional[int]
+
+    def __init__(self, history: History, slots: Optional[int] = 1) -> None:
+        self.history = history
+        # Encodes run at once, to spread the time over; None if unknown
+        self.slots = slots
+        self.files = 0
+        self.from_history = 0
+        self.input_bytes = 0.0
+        self.output_bytes = 0.0
+        self.wall_seconds = 0.0
+
+    def __str__(self) -> str:
+        saving = self.input_bytes - self.output_bytes
+        share = 100 * saving / self.input_bytes if self.input_bytes else 0.0
+        return (f'Plan: {self.files} files, {self.input_bytes / 1024**3:.1f} '
+                f'GiB in, a predicted {self.output_bytes / 1024**3:.1f} GiB '
+                f'out, saving {saving / 1024**3:.1f} GiB ({share:.0f}%)\n'
+                f'Predicted encode time: {self.wall_seconds / 3600:.1f} hours '
+                f'({self.from_history} of {self.files} files from history)' +
+                (f', or about {self.wall_seconds / 3600 / self.slots:.1f} '
+                 f'hours across {self.slots} slots' if self.slots and self.slots > 1
+                 else ''))
+
+    def __call__(self, jobs: Iterable[Job]) -> Iterator[Job]:
+        for job in jobs:
+            if job.meta is None:
+                continue
+            estimate = self.history.estimate(job)
+            self.files += 1
+            self.from_history += estimate.from_history
+            self.input_bytes += estimate.input_bytes
+            self.output_bytes += estimate.output_bytes
+            self.wall_seconds += estimate.wall_seconds
+        # Nothing goes on to be encoded
+        yield from ()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+Persistent index of a library's directories and video files, so a re-scan
+lists only the directories whose mtime has changed and reports what was
+added, removed or modified since the last committed scan.
+
+A directory's mtime moves when entries are created, deleted or renamed in
+it, not when a file in it is rewritten in place, so an in-place rewrite is
+only noticed once something else in its directory changes.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dlrippyr.cache import default_cache_dir
+from dlrippyr.log import logger
+from dlrippyr.metrics import metrics
+from dlrippyr.utils import SCAN_WORKERS, is_vfile
+
+# Directories modified this recently may change again within the same mtime
+# tick, so they are listed again on the next scan rather than trusted
+RACY_NS = 2 * 10**9
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    path     TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    dir      TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+'''
+
+Stat = Tuple[int, int]
+
+
+class ScanDiff:
+    """Video files added, removed and modified since the last scan"""
+    added: List[Path]
+    removed: List[Path]
+    modified: List[Path]
+    listed: int
+    skipped: int
+
+    def __init__(self) -> None:
+        self.added = []
+        self.removed = []
+        self.modified = []
+        # Directories listed, and unchanged directories not listed
+        self.listed = 0
+        self.skipped = 0
+
+    def __str__(self) -> str:
+        return (f'{len(self.added)} added, {len(self.modified)} modified and '
+                f'{len(self.removed)} removed; listed {self.listed} of '
+                f'{self.listed + self.skipped} directories')
+
+    @property
+    def changed(self) -> List[Path]:
+        """Files which need looking at: those added or modified"""
+        return self.added + self.modified
+
+
+class _Visit:
+    """What a worker found at one directory. files and subdirs are None when
+    its mtime was unchanged and it wasn't listed"""
+
+    def __init__(self,
+                 path: str,
+                 mtime_ns: Optional[int],
+                 files: Optional[Dict[str, Stat]] = None,
+                 subdirs: Optional[List[str]] = None) -> None:
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.files = files
+        self.subdirs = subdirs
+
+
+def _visit(path: str, known_mtime: Optional[int]) -> _Visit:
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return _Visit(path, None)
+    if mtime_ns == known_mtime:
+        return _Visit(path, mtime_ns)
+
+    files = {}
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file() and is_vfile(entry.name):
+                        st = entry.stat()
+                        files[entry.path] = (st.st_size, st.st_mtime_ns)
+                except OSError as err:
+                    logger.warning(f'Skipping {entry.path}: {err}')
+    except OSError as err:
+        logger.warning(f'Unable to scan {path}: {err}')
+    return _Visit(path, mtime_ns, files, subdirs)
+
+
+class ScanIndex:
+    """SQLite-backed record of each directory's mtime and listing.
+
+    scan() updates the index as it goes but nothing is kept until commit(),
+    so a run which dies part way sees the same changes again next time. Each
+    consumer, like `info` or `convert` with one preset, keeps an index of its
+    own, so one's run doesn't use up the changes another has yet to see.
+    """
+    db_path: Path
+
+    def __init__(self,
+                 db_path: Optional[Path] = None,
+                 consumer: str = 'info') -> None:
+        if db_path is None:
+            db_path = default_cache_dir() / f'index-{consumer}.sqlite'
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}("{self.db_path}")'
+
+    def __enter__(self) -> 'ScanIndex':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def scan(self,
+             srcs: Iterable[str],
+             workers: int = SCAN_WORKERS) -> ScanDiff:
+        """Compare the supplied files and/or directories with the index"""
+        diff = ScanDiff()
+        with self._lock:
+            dirs = {
+                path: (mtime_ns, json.loads(subdirs))
+                for path, mtime_ns, subdirs in self._conn.execute(
+                    'SELECT path, mtime_ns, subdirs FROM dirs')
+            }
+
+        for src in srcs:
+            path = os.path.abspath(src)
+            if os.path.isfile(path):
+                self._check_file(path, diff)
+            elif os.path.isdir(path):
+                self._walk(path, dirs, diff, workers)
+            else:
+                self._drop_tree(path, diff)
+
+        metrics.inc('dlrippyr_dirs_scanned_total', diff.listed)
+        metrics.inc('dlrippyr_dirs_unchanged_total', diff.skipped)
+        return diff
+
+    def forget(self, path: Path) -> None:
+        """Drop a file from the index, so the next scan reports it as added
+        again; for files whose encode failed"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._conn.execute('DELETE FROM files WHERE path = ?', (path, ))
+            # Make sure its directory is listed again
+            self._conn.execute('UPDATE dirs SET mtime_ns = 0 WHERE path = ?',
+                               (os.path.dirname(path), ))
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Close the index, discarding anything not committed"""
+        with self._lock:
+            self._conn.close()
+
+    def _walk(self, root: str, dirs: Dict[str, Tuple[int, List[str]]],
+              diff: ScanDiff, workers: int) -> None:
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='dlrippyr-index') as pool:
+            known = dirs.get(root, (None, ))[0]
+            pending = {pool.submit(_visit, root, known)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    visit = future.result()
+                    for subdir in self._update(visit, dirs, diff):
+                        known = dirs.get(subdir, (None, ))[0]
+                        pending.add(pool.submit(_visit, subdir, known))
+
+    def _update(self, visit: _Visit, dirs: Dict[str, Tuple[int, List[str]]],
+                diff: ScanDiff) -> List[str]:
+        """Record a visit, returning the sub-directories still to visit"""
+        if visit.mtime_ns is None:
+            self._drop_tree(visit.path, diff)
+            return []
+        if visit.files is None:
+            diff.skipped += 1
+            return dirs[visit.path][1]
+
+        diff.listed += 1
+        old_subdirs = set(dirs.get(visit.path, (None, []))[1])
+        for gone in old_subdirs.difference(visit.subdirs):
+            self._drop_tree(gone, diff)
+
+        with self._lock:
+            stored = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self._conn.execute(
+                    'SELECT path, size, mtime_ns FROM files WHERE dir = ?',
+                    (visit.path, ))
+            }
+            for path, stat in visit.files.items():
+                if path not in stored:
+                    diff.added.append(Path(path))
+                elif stored[path] != stat:
+                    diff.modified.append(Path(path))
+            removed = [path for path in stored if path not in visit.files]
+            diff.removed.extend(Path(path) for path in removed)
+
+            self._conn.executemany('DELETE FROM files WHERE path = ?',
+                                   [(path, ) for path in removed])
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO files (path, dir, size, mtime_ns) '
+                'VALUES (?, ?, ?, ?)',
+                [(path, visit.path, *stat)
+                 for path, stat in visit.files.items()
+                 if stored.get(path) != stat])
+            racy = time.time_ns() - visit.mtime_ns < RACY_NS
+            self._conn.execute(
+                'INSERT OR REPLACE INTO dirs (path, mtime_ns, subdirs) '
+                'VALUES (?, ?, ?)', (visit.path, 0 if racy else
+                                     visit.mtime_ns, json.dumps(visit.subdirs)))
+        return visit.subdirs
+
+    def _check_file(self, path: str, diff: ScanDiff) -> None:
+        if not is_vfile(path):
+            # Passed explicitly, so looked at whatever it's called
+            diff.added.append(Path(path))
+            return
+        st = os.stat(path)
+        stat = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, mtime_ns FROM files WHERE path = ?',
+                (path, )).fetchone()
+            if row is None:
+                diff.added.append(Path(path))
+            elif tuple(row) != stat:
+                diff.modified.append(Path(path))
+            else:
+                return
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (path, dir, size, mtime_ns) '
+                'VALUES (?, ?, ?, ?)', (path, os.path.dirname(path), *stat))
+
+    def _drop_tree(self, path: str, diff: ScanDiff) -> None:
+        """Forget a directory which has gone, and everything beneath it"""
+        # Everything beneath path sorts between 'path/' and 'path0'
+        bounds = (path, path + os.sep, path + chr(ord(os.sep) + 1))
+        with self._lock:
+            gone = self._conn.execute(
+                'SELECT path FROM files WHERE dir = ? OR '
+                '(dir >= ? AND dir < ?)', bounds).fetchall()
+            diff.removed.extend(Path(row[0]) for row in gone)
+            self._conn.execute(
+                'DELETE FROM files WHERE dir = ? OR (dir >= ? AND dir < ?)',
+                bounds)
+            self._conn.execute(
+                'DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)',
+                bounds)
@@ -2,25 +2,114 @@
 
 import click
 
-from dlrippyr.classes import Metadata
-from dlrippyr.utils import find_vfiles
+from dlrippyr.cache import MetadataCache
+from dlrippyr.index import ScanIndex
+from dlrippyr.metrics import metrics
+from dlrippyr.probe import DEFAULT_PROBE_JOBS, ProbePool
+from dlrippyr.report import FORMATS, WRITERS, Totals, record
+from dlrippyr.utils import iter_vfiles
 
 
 @click.command()
 @click.argument('args', nargs=-1)
-def info(args, print=True):
-    # set() ensures we don't pickup unforeseen duplicates
-    f_list = set()
+@click.option('--no-cache',
+              is_flag=True,
+              default=False,
+              help='Always probe files with ffprobe, bypassing the metadata '
+              'cache')
+@click.option('--rebuild-cache',
+              is_flag=True,
+              default=False,
+              help='Re-probe every file and overwrite its cached metadata')
+@click.option('--probe-jobs',
+              type=click.IntRange(min=1),
+              default=DEFAULT_PROBE_JOBS,
+              show_default=True,
+              help='Number of files to probe for metadata concurrently')
+@click.option('--metrics-log',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Append scan, probe and encode events to this file as '
+              'JSON lines')
+@click.option('--metrics-textfile',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Keep Prometheus metrics in this file, for the '
+              'node_exporter textfile collector')
+@click.option('--changed-only',
+              is_flag=True,
+              default=False,
+              help='Only look at files added or modified since the last '
+              '--changed-only run, listing only directories whose mtime has '
+              'changed')
+@click.option('--format',
+              'fmt',
+              type=click.Choice(FORMATS),
+              default='text',
+              show_default=True,
+              help='"jsonl" and "csv" stream a record per file as it is '
+              'probed, in no particular order. jsonl ends with totals by codec '
+              'and resolution and the estimated reclaimable space; csv writes '
+              'them only with --totals')
+@click.option('--totals',
+              'totals_path',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Write the totals of --format jsonl or csv to this file, '
+              'in the same format, rather than after the records')
+def info(args,
+         no_cache,
+         rebuild_cache,
+         probe_jobs,
+         metrics_log=None,
+         metrics_textfile=None,
+         changed_only=False,
+         fmt='text',
+         totals_path=None,
+         print=True):
     objs = []
+    # Machine-readable formats are streamed, so keep nothing but totals
+    writer = WRITERS[fmt](click.get_text_stream('stdout'), totals_path) if (
+        print and fmt in WRITERS) else None
+    totals = Totals()
+    metrics.configure(events=metrics_log, textfile=metrics_textfile)
+    cache = None if no_cache else MetadataCache(rebuild=rebuild_cache)
+    index = ScanIndex(consumer='info') if changed_only else None
 
-    # click args come in as a tuple, even singletons
-    for path in args:
-        f_list = find_vfiles(path)
+    # click args come in as a tuple, even singletons. iter_vfiles() ensures we
+    # don't pickup unforeseen duplicates across them
+    if index is None:
+        files = iter_vfiles(args)
+    else:
+        diff = index.scan(args)
+        files = diff.changed
+        if print and writer is None:
+            click.echo(f'Since the last run: {diff}')
+            for path in sorted(diff.removed):
+                click.echo(f'   Removed: {path}')
 
-    for item in sorted(f_list):
-        meta = Metadata(item)
-        objs.append(meta)
-        if print:
-            click.echo(meta)
+    with ProbePool(workers=probe_jobs, cache=cache) as pool:
+        if writer is not None:
+            for _, meta in pool.as_completed(files):
+                if meta is not None:
+                    writer.write(meta)
+            writer.close()
+        else:
+            for _, meta in pool.map(sorted(files)):
+                if meta is None:
+                    continue
+                objs.append(meta)
+                totals.add(meta, record(meta))
+                if print:
+                    click.echo(meta)
+            if print and objs:
+                click.echo(totals)
+
+    if cache is not None:
+        cache.close()
+    if index is not None:
+        index.commit()
+        index.close()
+    metrics.close()
 
     return objs
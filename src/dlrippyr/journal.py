@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Persistent journal of encode job states, so that an interrupted library run
+can be resumed without redoing finished work or trusting half-written
+outputs.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from dlrippyr.cache import fingerprint
+from dlrippyr.classes import Job, partial_name, segment_dir
+from dlrippyr.log import logger
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    input       TEXT NOT NULL,
+    preset_hash TEXT NOT NULL,
+    output      TEXT NOT NULL,
+    size        INTEGER,
+    mtime_ns    INTEGER,
+    inode       INTEGER,
+    state       TEXT NOT NULL,
+    error       TEXT,
+    updated     REAL NOT NULL DEFAULT (julianday('now')),
+    PRIMARY KEY (input, preset_hash)
+)
+'''
+
+
+def default_state_dir() -> Path:
+    """Per-user state directory, honouring $XDG_STATE_HOME"""
+    base = (os.environ.get('XDG_STATE_HOME')
+            or Path.home() / '.local' / 'state')
+    return Path(base) / 'dlrippyr'
+
+
+def preset_hash(preset: str) -> str:
+    """Digest of a preset file's contents, so an edited preset is treated as
+    new work. Falls back to the name if the file can't be read"""
+    try:
+        data = Path(preset).read_bytes()
+    except OSError:
+        data = preset.encode()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class Journal:
+    """SQLite-backed record of each job's state, safe to share across
+    threads"""
+    db_path: Path
+
+    def __init__(self, db_path: Optional[Path] = None) -> None:
+        if db_path is None:
+            db_path = default_state_dir() / 'journal.sqlite'
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._hashes: dict = {}
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(_SCHEMA)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}("{self.db_path}")'
+
+    def __enter__(self) -> 'Journal':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def mark(self, job: Job, state: str, error: Optional[str] = None) -> None:
+        """Record a job's transition to state"""
+        fp = fingerprint(job.input) or (None, None, None)
+        row = (str(Path(job.input).resolve()), self._hash(job.preset),
+               str(Path(job.output).resolve()), *fp, state, error)
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO jobs (input, preset_hash, output, '
+                'size, mtime_ns, inode, state, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', row)
+            self._conn.commit()
+
+    def is_done(self, input: Path, preset: str) -> bool:
+        """True when input was encoded with this preset, is unchanged since,
+        and the output is still in place"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT output, size, mtime_ns, inode FROM jobs '
+                'WHERE input = ? AND preset_hash = ? AND state = ?',
+                (str(Path(input).resolve()), self._hash(preset),
+                 DONE)).fetchone()
+
+        return (row is not None and tuple(row[1:]) == fingerprint(input)
+                and Path(row[0]).exists())
+
+    def recover(self) -> List[Path]:
+        """Clean up after an interrupted run: delete the partial outputs and
+        segment directories of jobs which never finished and return them to
+        pending"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT output FROM jobs WHERE state = ?',
+                (RUNNING, )).fetchall()
+            self._conn.execute('UPDATE jobs SET state = ? WHERE state = ?',
+                               (PENDING, RUNNING))
+            self._conn.commit()
+
+        removed = []
+        for (output, ) in rows:
+            segments = segment_dir(Path(output))
+            if segments.is_dir():
+                shutil.rmtree(segments, ignore_errors=True)
+                removed.append(segments)
+            partial = partial_name(Path(output))
+            try:
+                partial.unlink()
+            except FileNotFoundError:
+                continue
+            except OSError as err:
+                logger.warning(f'Unable to remove {partial}: {err}')
+                continue
+            removed.append(partial)
+        return removed
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _hash(self, preset: str) -> str:
+        # Hashed once per run rather than re-reading the file for every job
+        if preset not in self._hashes:
+            self._hashes[preset] = preset_hash(preset)
+        return self._hashes[preset]
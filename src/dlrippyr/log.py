@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+The loguru logger, imported only when something is first logged. loguru
+pulls in asyncio and friends, which costs more than the rest of a short
+command like `dlrippyr info` on one cached file, so modules log through
+`logger` here rather than importing loguru themselves.
+"""
+
+import sys
+import threading
+
+
+class _LazyLogger:
+    """Stands in for loguru's logger until it's first used"""
+
+    def __init__(self) -> None:
+        self._logger = None
+        self._setup = False
+        # Threads which log for the first time together would otherwise
+        # each configure loguru, adding a sink apiece
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._logger is not None else 'not loaded'
+        return f'{self.__class__.__name__}({state})'
+
+    def __getattr__(self, name: str):
+        if self._logger is None:
+            with self._lock:
+                if self._logger is None:
+                    from loguru import logger
+                    if self._setup:
+                        _configure(logger)
+                    self._logger = logger
+        return getattr(self._logger, name)
+
+
+logger = _LazyLogger()
+
+
+def _configure(target) -> None:
+    # loguru's default handler logs everything from DEBUG up, which would
+    # include every line of HandBrakeCLI's log
+    target.remove()
+    target.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+
+
+def setup() -> None:
+    """Log INFO and above to stderr, once loguru is loaded. Called by the
+    CLI rather than on import, so neither costs anything until a log line"""
+    with logger._lock:
+        if logger._setup:
+            return
+        logger._setup = True
+        if logger._logger is not None:
+            _configure(logger._logger)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Per-stage counters, timers and histograms for scanning, probing and encoding.
+Metrics can be written out as a JSON-lines event log and/or as a Prometheus
+textfile for node_exporter's textfile collector.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ENCODE_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 14400, 28800, 57600)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.5)
+FPS_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400)
+
+HELP = {
+    'dlrippyr_files_scanned_total': 'Video files found by the scanner',
+    'dlrippyr_dirs_scanned_total': 'Directories listed by the scanner',
+    'dlrippyr_dirs_unchanged_total': 'Indexed directories left unlisted',
+    'dlrippyr_scan_seconds_total': 'Wall time spent walking source trees',
+    'dlrippyr_probe_cache_hits_total': 'Probes answered by the cache',
+    'dlrippyr_probe_header_total': 'Probes answered from container headers',
+    'dlrippyr_probe_seconds': 'ffprobe round-trip latency',
+    'dlrippyr_encodes_total': 'Encodes finished, by status',
+    'dlrippyr_encode_seconds': 'Encode wall time',
+    'dlrippyr_encode_input_bytes_total': 'Source bytes encoded',
+    'dlrippyr_encode_output_bytes_total': 'Output bytes written',
+    'dlrippyr_encode_ratio': 'Output size as a fraction of input size',
+    'dlrippyr_encode_fps': 'Average encode frame rate',
+    'dlrippyr_scratch_bytes_total': 'Bytes copied to and from scratch',
+    'dlrippyr_verify_total': 'Finished encodes verified, by tier and status',
+    'dlrippyr_duplicates_total': 'Sources skipped as duplicates, by kind',
+}
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(pairs: Sequence[Tuple[str, str]], **extra) -> str:
+    pairs = list(pairs) + [(k, str(v)) for k, v in extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class Histogram:
+    buckets: Tuple[float, ...]
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms, with optional event
+    log and textfile outputs"""
+    events_path: Optional[Path]
+    textfile: Optional[Path]
+
+    def __init__(self) -> None:
+        self.events_path = None
+        self.textfile = None
+        self.host = socket.gethostname()
+        self._counters: Dict[Key, float] = {}
+        self._histograms: Dict[Key, Histogram] = {}
+        self._events = None
+        self._lock = threading.Lock()
+
+    def configure(self,
+                  events: Optional[Path] = None,
+                  textfile: Optional[Path] = None) -> None:
+        """Start writing JSON-lines events to events and/or the Prometheus
+        exposition to textfile"""
+        self.close()
+        self.events_path = Path(events) if events else None
+        self.textfile = Path(textfile) if textfile else None
+        if self.events_path is not None:
+            self._events = open(self.events_path, 'a', buffering=1)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self,
+                name: str,
+                value: float,
+                buckets: Sequence[float] = LATENCY_BUCKETS,
+                **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self,
+              name: str,
+              buckets: Sequence[float] = LATENCY_BUCKETS,
+              **labels) -> Iterator[None]:
+        """Observe the wall time of the enclosed block into a histogram"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, buckets, **labels)
+
+    def event(self, kind: str, **fields) -> None:
+        """Append an event to the JSON-lines log, if one is configured"""
+        if self._events is None:
+            return
+        record = {'ts': time.time(), 'host': self.host, 'event': kind}
+        record.update(fields)
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._events.write(line + '\n')
+
+    def render(self) -> str:
+        """Prometheus text exposition of every metric"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(),
+                                key=lambda item: item[0])
+            lines = []
+            seen = set()
+
+            for (name, labels), value in counters:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                    lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name}{_labels(labels)} {value:g}')
+
+            for (name, labels), hist in histograms:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                    lines.append(f'# TYPE {name} histogram')
+                cumulative = 0
+                for bound, count in zip(hist.buckets + (float('inf'), ),
+                                        hist.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                    lines.append(f'{name}_bucket{_labels(labels, le=le)} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {hist.sum:g}')
+                lines.append(f'{name}_count{_labels(labels)} {hist.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def flush(self) -> None:
+        """Rewrite the textfile, atomically so the collector never reads a
+        partial one"""
+        if self.textfile is None:
+            return
+        tmp = self.textfile.with_name(f'.{self.textfile.name}.{os.getpid()}')
+        tmp.write_text(self.render())
+        os.replace(tmp, self.textfile)
+
+    def close(self) -> None:
+        self.flush()
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+
+
+# Process-wide registry the instrumented stages report into
+metrics = Metrics()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Streaming scan -> probe -> filter -> encode pipeline. Stages are joined by
+bounded queues, so encoding starts as soon as the first eligible file has
+been probed, memory stays flat however large the library, and a full queue
+holds the earlier stages back rather than letting them race ahead.
+"""
+
+import threading
+from pathlib import Path
+from queue import Queue
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+from dlrippyr.classes import Job, Metadata
+from dlrippyr.log import logger
+from dlrippyr.probe import ProbePool
+from dlrippyr.scheduler import Scheduler, Summary
+from dlrippyr.utils import iter_vfiles
+
+# Paths waiting to be probed; cheap, so let the scanner run well ahead
+SCAN_QUEUE_SIZE = 1024
+# Probed jobs waiting for an encode slot, per slot
+JOBS_PER_SLOT = 2
+
+# classify() returns a Job to run, or the reason the file is being skipped
+Classifier = Callable[[Path, Metadata], Union[Job, str]]
+# prefilter() may skip a file before it is probed, returning the reason
+Prefilter = Callable[[Path], Optional[str]]
+# arrange() may reorder or cut short the stream of jobs headed for encoding
+Arranger = Callable[[Iterable[Job]], Iterable[Job]]
+
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+    """Pump an iterable into a bounded queue from a background thread"""
+
+    def __init__(self, name: str, source: Iterable, queue: Queue) -> None:
+        super().__init__(name=f'dlrippyr-{name}', daemon=True)
+        self.source = source
+        self.queue = queue
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            for item in self.source:
+                self.queue.put(item)
+        except BaseException as err:
+            self.error = err
+        finally:
+            self.queue.put(_DONE)
+
+
+def _drain(queue: Queue) -> Iterator:
+    while True:
+        item = queue.get()
+        if item is _DONE:
+            return
+        yield item
+
+
+class Pipeline:
+    """Wire the scanner, a ProbePool and a Scheduler together.
+
+    Files that survive the optional prefilter() are probed and passed to
+    classify(); jobs pass through the optional arrange() and are queued for
+    encoding, and skips are reported through on_skip(path, reason) as they
+    happen.
+    """
+    pool: ProbePool
+    scheduler: Scheduler
+    classify: Classifier
+    prefilter: Optional[Prefilter]
+    arrange: Optional[Arranger]
+    on_skip: Optional[Callable[[Path, str], None]]
+
+    def __init__(self,
+                 pool: ProbePool,
+                 scheduler: Scheduler,
+                 classify: Classifier,
+                 on_skip: Optional[Callable[[Path, str], None]] = None,
+                 prefilter: Optional[Prefilter] = None,
+                 arrange: Optional[Arranger] = None,
+                 scan_queue_size: int = SCAN_QUEUE_SIZE,
+                 job_queue_size: Optional[int] = None) -> None:
+        self.pool = pool
+        self.scheduler = scheduler
+        self.classify = classify
+        self.prefilter = prefilter
+        self.arrange = arrange
+        self.on_skip = on_skip
+        self.scan_queue_size = scan_queue_size
+        if job_queue_size is None:
+            job_queue_size = JOBS_PER_SLOT * scheduler.capacity
+        self.job_queue_size = job_queue_size
+
+    def run(self, srcs: Iterable[str]) -> Summary:
+        return self.feed(iter_vfiles(srcs))
+
+    def feed(self, files: Iterable[Path]) -> Summary:
+        """Run the pipeline over a stream of video files, rather than a scan
+        of source directories; it finishes once the stream does"""
+        paths: Queue = Queue(maxsize=self.scan_queue_size)
+        jobs: Queue = Queue(maxsize=self.job_queue_size)
+        filtered = self._filter(_drain(paths))
+        if self.arrange is not None:
+            filtered = self.arrange(filtered)
+        stages = [
+            _Stage('scan', files, paths),
+            _Stage('probe', filtered, jobs),
+        ]
+        for stage in stages:
+            stage.start()
+
+        summary = self.scheduler.run(_drain(jobs))
+
+        for stage in stages:
+            stage.join()
+            if stage.error is not None:
+                raise stage.error
+        return summary
+
+    def _filter(self, paths: Iterable[Path]) -> Iterator[Job]:
+        for path, meta in self.pool.as_completed(self._prefilter(paths)):
+            if meta is None:
+                continue
+            outcome = self.classify(path, meta)
+            if isinstance(outcome, str):
+                self._skip(path, outcome)
+            else:
+                yield outcome
+
+    def _prefilter(self, paths: Iterable[Path]) -> Iterator[Path]:
+        for path in paths:
+            reason = None if self.prefilter is None else self.prefilter(path)
+            if reason is None:
+                yield path
+            else:
+                self._skip(path, reason)
+
+    def _skip(self, path: Path, reason: str) -> None:
+        logger.info(f'Skipping {path}: {reason}')
+        if self.on_skip is not None:
+            self.on_skip(path, reason)
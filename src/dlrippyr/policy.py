@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Skip policy: rules which, from a file's probed metadata alone, pick out
+encodes likely to be wasted, such as sources already leaner than the preset
+would make them. Each rule returns the reason a file is skipped, worded to
+follow "skipped as they are ...", or None to let it through.
+"""
+
+import json
+from typing import Callable, List, Optional, Tuple
+
+from dlrippyr.classes import Metadata
+
+# Off unless asked for, so that convert encodes everything it always has.
+# Sources at or below the bits per pixel per frame the presets land on
+# (priority.TARGET_BPP, 0.05) have little to gain from an encode
+DEFAULT_MIN_BPP = 0.0
+
+Rule = Callable[[Metadata], Optional[str]]
+
+
+def preset_size(preset: str) -> Optional[Tuple[int, int]]:
+    """(PictureWidth, PictureHeight) of a HandBrake preset file, or None if
+    it doesn't set them. HandBrake treats these as the largest picture it
+    will make, not as the size of every picture"""
+    try:
+        with open(preset) as f:
+            settings = json.load(f)['PresetList'][0]
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+    width = settings.get('PictureWidth') or 0
+    height = settings.get('PictureHeight') or 0
+    if not width or not height:
+        return None
+    return width, height
+
+
+def min_bpp(threshold: float) -> Rule:
+    reason = f'below {threshold:g} bits per pixel per frame'
+
+    def rule(meta: Metadata) -> Optional[str]:
+        # 0.0 means the rate couldn't be worked out, which is no reason
+        bpp = meta.bits_per_pixel
+        return reason if 0 < bpp < threshold else None
+
+    return rule
+
+
+def min_size(mib: float) -> Rule:
+    reason = f'smaller than {mib:g} MiB'
+
+    def rule(meta: Metadata) -> Optional[str]:
+        return reason if meta.size < mib else None
+
+    return rule
+
+
+def fit_scale(width: int, height: int, max_width: int,
+              max_height: int) -> float:
+    """How much HandBrake scales a picture to fit within a preset's largest
+    picture size, keeping its aspect ratio"""
+    return min(max_width / width, max_height / height)
+
+
+def no_upscale(width: int, height: int) -> Rule:
+    reason = (f'smaller than the preset\'s {width}x{height} picture size in '
+              'both dimensions, so would be upscaled')
+
+    def rule(meta: Metadata) -> Optional[str]:
+        source = int(meta.width), int(meta.height)
+        # Unknown dimensions are no reason
+        if not all(source):
+            return None
+        # A letterboxed 1920x800 fits a 1920x1080 preset as it is
+        return reason if fit_scale(*source, width, height) > 1 else None
+
+    return rule
+
+
+class Policy:
+    """An ordered set of skip rules; the first to object decides"""
+    rules: List[Rule]
+
+    def __init__(self, rules: Optional[List[Rule]] = None) -> None:
+        self.rules = list(rules or [])
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({len(self.rules)} rules)'
+
+    def __call__(self, meta: Metadata) -> Optional[str]:
+        for rule in self.rules:
+            reason = rule(meta)
+            if reason is not None:
+                return reason
+        return None
+
+    @classmethod
+    def from_options(cls,
+                     preset: str,
+                     bpp: float = DEFAULT_MIN_BPP,
+                     size: float = 0,
+                     upscale: bool = True) -> 'Policy':
+        """Build the policy convert's options ask for; zero thresholds turn
+        their rules off"""
+        rules = []
+        if bpp:
+            rules.append(min_bpp(bpp))
+        if size:
+            rules.append(min_size(size))
+        picture = None if upscale else preset_size(preset)
+        if picture is not None:
+            rules.append(no_upscale(*picture))
+        return cls(rules)
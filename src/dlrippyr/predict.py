@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Predict a full encode's output size and duration from a handful of short
+samples spread across the source, encoded concurrently. Files which would
+barely shrink can then be skipped before hours of CPU are spent on them.
+"""
+
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from dlrippyr.classes import Metadata, SampleJob
+from dlrippyr.log import logger
+from dlrippyr.priority import input_bytes
+from dlrippyr.scheduler import Scheduler
+
+DEFAULT_SAMPLES = 4
+DEFAULT_SAMPLE_LENGTH = 10
+DEFAULT_MIN_SAVING = 15.0
+# Opening titles and closing credits encode unrepresentatively well, so keep
+# samples out of this fraction at either end
+MARGIN = 0.05
+
+
+def sample_windows(duration: float, count: int,
+                   length: int) -> List[Tuple[int, int]]:
+    """(start, end) timecodes of count evenly spaced samples of length
+    seconds, or none if the samples would cover over half the file, when a
+    full encode is as cheap as predicting one"""
+    if count < 1 or 2 * count * length > duration:
+        return []
+
+    margin = duration * MARGIN
+    span = duration - 2 * margin - length
+    step = span / max(count - 1, 1)
+    starts = [int(margin + i * step) for i in range(count)]
+    return [(start, start + length) for start in starts]
+
+
+class Prediction:
+    input_bytes: float
+    output_bytes: float
+    encode_seconds: float
+
+    def __init__(self, input_bytes: float, output_bytes: float,
+                 encode_seconds: float) -> None:
+        self.input_bytes = input_bytes
+        self.output_bytes = output_bytes
+        self.encode_seconds = encode_seconds
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(saving={self.saving:.1f}%, '
+                f'encode_seconds={self.encode_seconds:.0f})')
+
+    @property
+    def saving(self) -> float:
+        """Predicted reduction in size, as a percentage of the input"""
+        if not self.input_bytes:
+            return 0.0
+        return 100 * (1 - self.output_bytes / self.input_bytes)
+
+
+class Predictor:
+    """Encode samples of a file with SampleJob and extrapolate from them"""
+    preset: str
+    samples: int
+    length: int
+    slots: int
+    budget: Optional[Scheduler]
+
+    def __init__(self,
+                 preset: str,
+                 samples: int = DEFAULT_SAMPLES,
+                 length: int = DEFAULT_SAMPLE_LENGTH,
+                 slots: Optional[int] = None,
+                 workdir: Optional[Path] = None,
+                 budget: Optional[Scheduler] = None) -> None:
+        self.preset = preset
+        self.samples = samples
+        self.length = length
+        # By default every sample of a file is encoded at once
+        self.slots = slots or samples
+        self.workdir = workdir
+        # Optional scheduler of the real encodes, whose capacity samples
+        # share, so predicting doesn't oversubscribe the host
+        self.budget = budget
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(samples={self.samples})'
+
+    def predict(self, meta: Metadata) -> Optional[Prediction]:
+        """Predict the full encode of meta's file, or None if it can't be
+        sampled"""
+        windows = sample_windows(meta.duration, self.samples, self.length)
+        if not windows:
+            return None
+
+        tmpdir = Path(tempfile.mkdtemp(prefix='dlrippyr-predict-',
+                                       dir=self.workdir))
+        try:
+            jobs = [
+                SampleJob(meta.path,
+                          preset=self.preset,
+                          output=tmpdir / f'sample{i}.mp4',
+                          start_tm=start,
+                          end_tm=end,
+                          meta=meta) for i, (start, end) in enumerate(windows)
+            ]
+            if self.budget is None:
+                summary = Scheduler(slots=self.slots).run(jobs)
+            else:
+                with self.budget.reserve(jobs[0], self.slots) as slots:
+                    summary = Scheduler(slots=slots).run(jobs)
+            if summary.failed:
+                logger.warning(f'Unable to sample {meta.path}')
+                return None
+            sampled_bytes = sum(job.output.stat().st_size for job in jobs)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        # The samples ran side by side, much as a full encode uses the whole
+        # host, so scale their combined wall time by the content covered
+        scale = meta.duration / (len(windows) * self.length)
+        prediction = Prediction(input_bytes(meta), sampled_bytes * scale,
+                                summary.elapsed * scale)
+        logger.info(f'{meta.path}: {prediction!r}')
+        return prediction
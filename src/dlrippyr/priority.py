@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Order encode jobs so that, in a limited window, the biggest disk savings are
+made first. Savings and cost are rough estimates from each source's bit rate,
+resolution, frame rate and duration.
+"""
+
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from dlrippyr.classes import Job, Metadata
+
+# Bits per pixel per frame the x265 presets typically land on
+TARGET_BPP = 0.05
+# Pixels x265 gets through per CPU-second at the presets' speed settings
+PIXELS_PER_CPU_SECOND = 12e6
+
+ORDERS = ['scan', 'savings', 'size', 'path']
+BUDGET_SKIP = 'beyond the --max-jobs/--budget cutoff'
+
+
+def input_bytes(meta: Metadata) -> float:
+    return meta.size * 1024**2
+
+
+def estimate_output_bytes(meta: Metadata) -> float:
+    """Predicted encoded size; never more than the source"""
+    pixel_rate = int(meta.width) * int(meta.height) * meta.fps
+    predicted = TARGET_BPP * pixel_rate * meta.duration / 8
+    if not predicted:
+        return input_bytes(meta)
+    return min(input_bytes(meta), predicted)
+
+
+def estimate_savings(meta: Metadata) -> float:
+    """Bytes an encode is expected to free"""
+    return input_bytes(meta) - estimate_output_bytes(meta)
+
+
+def estimate_cpu_seconds(meta: Metadata) -> float:
+    """CPU time an encode is expected to take"""
+    pixels = int(meta.width) * int(meta.height) * meta.frames
+    return pixels / PIXELS_PER_CPU_SECOND
+
+
+def savings_rate(meta: Metadata) -> float:
+    """Bytes freed per CPU-second of encoding"""
+    cost = estimate_cpu_seconds(meta)
+    if not cost:
+        return 0.0
+    return estimate_savings(meta) / cost
+
+
+SORT_KEYS = {
+    'savings': lambda job: -savings_rate(job.meta),
+    'size': lambda job: -input_bytes(job.meta),
+    'path': lambda job: str(job.input),
+}
+
+
+class Prioritiser:
+    """Arrange a stream of jobs and cut it off at a job count or CPU budget.
+
+    Any order other than `scan` has to see every job before it can emit the
+    first, so probing completes before encoding starts. Jobs past the cutoff
+    are reported through on_skip(path, reason).
+    """
+    order: str
+    max_jobs: Optional[int]
+    budget: Optional[float]
+
+    def __init__(self,
+                 order: str = 'scan',
+                 max_jobs: Optional[int] = None,
+                 budget: Optional[float] = None,
+                 on_skip: Optional[Callable[[Path, str], None]] = None) -> None:
+        if order not in ORDERS:
+            raise ValueError(f'Unknown order {order!r}, expected one of '
+                             f'{ORDERS}')
+        self.order = order
+        self.max_jobs = max_jobs
+        # Estimated CPU-hours of encoding to fit in
+        self.budget = budget
+        self.on_skip = on_skip
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(order={self.order!r})'
+
+    def __call__(self, jobs: Iterable[Job]) -> Iterator[Job]:
+        if self.order != 'scan':
+            jobs = sorted(jobs, key=SORT_KEYS[self.order])
+
+        taken = 0
+        spent = 0.0
+        for job in jobs:
+            cost = 0.0 if job.meta is None else estimate_cpu_seconds(job.meta)
+            over_count = self.max_jobs is not None and taken >= self.max_jobs
+            over_budget = (self.budget is not None
+                           and spent + cost > self.budget * 3600)
+            if over_count or over_budget:
+                if self.on_skip is not None:
+                    self.on_skip(job.input, BUDGET_SKIP)
+                continue
+            taken += 1
+            spent += cost
+            yield job
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Concurrent construction of Metadata objects. Each probe is an ffprobe
+round-trip that spends nearly all of its time waiting, so a thread pool keeps
+many of them in flight at once.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from queue import Queue
+from typing import Iterable, Iterator, Optional, Tuple
+
+from dlrippyr.cache import MetadataCache
+from dlrippyr.classes import Metadata
+from dlrippyr.log import logger
+
+DEFAULT_PROBE_JOBS = 8
+PROBE_TIMEOUT = 60
+
+ProbeResult = Tuple[Path, Optional[Metadata]]
+
+_FED = object()
+
+
+def probe_errors() -> tuple:
+    """Errors which mean "this one file could not be probed", as opposed to
+    a bug. Called only as one is being handled, so that subprocess isn't
+    imported until it's needed; ValueError covers json.JSONDecodeError"""
+    import subprocess
+    return (subprocess.SubprocessError, OSError, KeyError, IndexError,
+            ValueError)
+
+
+class ProbePool:
+    """Probe many files concurrently, with a bounded number in flight.
+
+    Results are (path, Metadata) pairs; the Metadata is None when the file
+    could not be probed, which is logged rather than raised so a single bad
+    file doesn't abort a library run.
+    """
+    workers: int
+    timeout: Optional[float]
+    cache: Optional[MetadataCache]
+
+    def __init__(self,
+                 workers: int = DEFAULT_PROBE_JOBS,
+                 timeout: Optional[float] = PROBE_TIMEOUT,
+                 cache: Optional[MetadataCache] = None) -> None:
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                        thread_name_prefix='dlrippyr-probe')
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(workers={self.workers})'
+
+    def __enter__(self) -> 'ProbePool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def probe(self, path: Path) -> ProbeResult:
+        """Probe a single file, in the calling thread"""
+        try:
+            return path, Metadata(path, cache=self.cache, timeout=self.timeout)
+        except probe_errors() as err:
+            logger.warning(f'Unable to probe {path}: {err!r}')
+            return path, None
+
+    def submit(self, path: Path) -> 'Future[ProbeResult]':
+        return self._pool.submit(self.probe, path)
+
+    def map(self, paths: Iterable[Path]) -> Iterator[ProbeResult]:
+        """Yield results in the same order as paths"""
+        window: deque = deque()
+
+        for path in paths:
+            window.append(self.submit(path))
+            # Keep the pool busy without reading arbitrarily far ahead
+            if len(window) >= self.workers * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+    def as_completed(self, paths: Iterable[Path]) -> Iterator[ProbeResult]:
+        """Yield results as soon as each probe finishes, in any order.
+
+        paths is read on a thread of its own, so a source which trickles
+        paths in, like a watched folder, never holds back a finished probe.
+        """
+        done: Queue = Queue()
+        # Probes in flight or finished but not yet taken
+        window = threading.Semaphore(self.workers * 2)
+        stop = threading.Event()
+        fed = {'count': 0, 'error': None}
+
+        def feed() -> None:
+            try:
+                for path in paths:
+                    while not window.acquire(timeout=1):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    fed['count'] += 1
+                    self.submit(path).add_done_callback(done.put)
+            except BaseException as err:
+                fed['error'] = err
+            finally:
+                done.put(_FED)
+
+        feeder = threading.Thread(target=feed,
+                                  name='dlrippyr-probe-feed',
+                                  daemon=True)
+        feeder.start()
+        finished = False
+        taken = 0
+        try:
+            while not finished or taken < fed['count']:
+                item = done.get()
+                if item is _FED:
+                    finished = True
+                    continue
+                taken += 1
+                window.release()
+                yield item.result()
+        finally:
+            stop.set()
+        if fed['error'] is not None:
+            raise fed['error']
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
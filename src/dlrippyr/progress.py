@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+Library-wide progress for a batch of encodes. Each job's share of the work is
+its frame count, from the probed duration and average frame rate, so overall
+percent, throughput and ETA are measured in frames rather than files.
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, TextIO
+
+from dlrippyr.classes import Job, SampleJob
+from dlrippyr.log import logger
+from dlrippyr.runner import Progress
+
+# Seconds between redraws of the live progress line
+REDRAW_INTERVAL = 1.0
+# Seconds between logged summaries in quiet mode
+LOG_INTERVAL = 60.0
+
+
+def job_frames(job: Job) -> float:
+    """Frames a job will encode; 0.0 where the source wasn't probed"""
+    if job.meta is None:
+        return 0.0
+    if isinstance(job, SampleJob):
+        span = min(job.end_tm, job.meta.duration) - job.start_tm
+        return max(0.0, span) * job.meta.fps
+    return job.meta.frames
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '--:--:--'
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{secs:02d}'
+
+
+class _Entry:
+    frames: float
+    fraction: float
+    fps: float
+    running: bool
+    finished: bool
+
+    def __init__(self, frames: float) -> None:
+        self.frames = frames
+        self.fraction = 0.0
+        self.fps = 0.0
+        self.running = False
+        self.finished = False
+
+
+class Snapshot:
+    """Aggregate progress over every job queued so far"""
+    done_frames: float
+    total_frames: float
+    fps: float
+    eta: Optional[float]
+    finished: int
+    running: int
+    total: int
+
+    def __init__(self, done_frames: float, total_frames: float, fps: float,
+                 eta: Optional[float], finished: int, running: int,
+                 total: int) -> None:
+        self.done_frames = done_frames
+        self.total_frames = total_frames
+        self.fps = fps
+        self.eta = eta
+        self.finished = finished
+        self.running = running
+        self.total = total
+
+    def __str__(self) -> str:
+        return (f'[{self.percent:5.1f}%] {self.finished}/{self.total} files, '
+                f'{self.running} running, {self.fps:.1f} fps, '
+                f'ETA {format_eta(self.eta)}')
+
+    @property
+    def percent(self) -> float:
+        if not self.total_frames:
+            return 100.0 * self.finished / self.total if self.total else 0.0
+        return 100.0 * self.done_frames / self.total_frames
+
+
+class LibraryProgress:
+    """Combine HandBrakeCLI progress from every running job into one view.
+
+    Jobs are added as they are queued, so the total grows while the pipeline
+    is still scanning; orders other than `scan` probe the whole library up
+    front, and so give a library-wide ETA from the start. The view is redrawn
+    in place on a terminal, or logged every LOG_INTERVAL seconds when quiet
+    or when stderr isn't a terminal.
+    """
+    quiet: bool
+    interval: float
+
+    def __init__(self,
+                 quiet: bool = False,
+                 interval: Optional[float] = None,
+                 stream: TextIO = sys.stderr) -> None:
+        self.stream = stream
+        self.live = not quiet and stream.isatty()
+        self.quiet = quiet
+        self.interval = interval or (REDRAW_INTERVAL
+                                     if self.live else LOG_INTERVAL)
+        self._jobs: Dict[Path, _Entry] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = time.monotonic()
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[Path(job.input)] = _Entry(job_frames(job))
+
+    def discard(self, path: Path) -> None:
+        """Forget a queued job which will no longer run"""
+        with self._lock:
+            self._jobs.pop(Path(path), None)
+
+    def update(self, job: Job, progress: Progress) -> None:
+        """on_progress callback for Job.run_handbrake"""
+        with self._lock:
+            entry = self._jobs.get(Path(job.input))
+            if entry is None:
+                return
+            entry.running = True
+            # HandBrakeCLI reports percent per pass
+            passes = max(1, progress.pass_count)
+            pass_id = min(max(1, progress.pass_id), passes)
+            entry.fraction = (pass_id - 1 + progress.percent / 100) / passes
+            entry.fps = progress.fps if progress.state == 'WORKING' else 0.0
+
+    def finish(self, job: Job) -> None:
+        with self._lock:
+            entry = self._jobs.get(Path(job.input))
+            if entry is None:
+                return
+            entry.running = False
+            entry.finished = True
+            entry.fraction = 1.0
+            entry.fps = 0.0
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            entries = list(self._jobs.values())
+        total = sum(e.frames for e in entries)
+        done = sum(e.frames * e.fraction for e in entries)
+        fps = sum(e.fps for e in entries if e.running)
+        # Jobs which don't report progress leave only the average to go on
+        rate = fps or done / max(time.monotonic() - self._start, 1e-9)
+        eta = (total - done) / rate if rate else None
+        return Snapshot(done, total, fps, eta,
+                        sum(e.finished for e in entries),
+                        sum(e.running for e in entries), len(entries))
+
+    def draw(self) -> None:
+        line = str(self.snapshot())
+        if self.live:
+            self.stream.write(f'\r\033[K{line}')
+            self.stream.flush()
+        else:
+            logger.info(f'Progress: {line}')
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop,
+                                        name='dlrippyr-progress',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.live:
+            self.draw()
+            self.stream.write('\n')
+            self.stream.flush()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.draw()
+
+    def __enter__(self) -> 'LibraryProgress':
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Machine-readable output for `info`: one record per file, written as soon as
+it's probed, and totals across the library, written after them or to a file
+of their own. Nothing but the running totals is kept, so memory stays flat
+however many files there are.
+"""
+
+import csv
+import json
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import IO, Dict, List, Optional
+
+from dlrippyr.classes import Metadata
+from dlrippyr.priority import estimate_savings, input_bytes
+
+FORMATS = ['text', 'jsonl', 'csv']
+
+FIELDS = [
+    'path', 'format_name', 'codec_name', 'profile', 'width', 'height', 'fps',
+    'bit_rate', 'size', 'duration', 'reclaimable'
+]
+TOTAL_FIELDS = ['group', 'key', 'files', 'bytes']
+
+# Nominal heights, largest first. Sources are classed by the height a 16:9
+# picture of their width would have, when that's more, so cropped scope
+# films land with their full-frame peers
+RESOLUTIONS = [2160, 1440, 1080, 720, 576, 480]
+# Share of a nominal height a picture needs to count as it
+RESOLUTION_SLACK = 0.9
+
+
+def resolution(meta: Metadata) -> str:
+    """A source's resolution class, like '1080p'"""
+    height = max(int(meta.height), int(meta.width) * 9 / 16)
+    for nominal in RESOLUTIONS:
+        if height >= nominal * RESOLUTION_SLACK:
+            return f'{nominal}p'
+    return 'SD'
+
+
+def reclaimable(meta: Metadata) -> int:
+    """Bytes an encode is estimated to free; none for HEVC sources"""
+    if meta.codec_name == 'hevc':
+        return 0
+    return int(estimate_savings(meta))
+
+
+def record(meta: Metadata) -> Dict:
+    """A file's metadata in plain units: bytes, seconds, Mb/s and frames a
+    second"""
+    return {
+        'path': str(meta.path),
+        'format_name': meta.format_name,
+        'codec_name': meta.codec_name,
+        'profile': meta.profile,
+        'width': int(meta.width),
+        'height': int(meta.height),
+        'fps': round(meta.fps, 3),
+        'bit_rate': round(meta.bit_rate, 3),
+        'size': int(input_bytes(meta)),
+        'duration': meta.duration,
+        'reclaimable': reclaimable(meta),
+    }
+
+
+class Totals:
+    """Running totals across a library"""
+    files: int
+    bytes: int
+    reclaimable: int
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.bytes = 0
+        self.reclaimable = 0
+        # Files with any space to reclaim
+        self.shrinkable = 0
+        self.files_by_codec: Counter = Counter()
+        self.bytes_by_codec: Counter = Counter()
+        self.files_by_resolution: Counter = Counter()
+        self.bytes_by_resolution: Counter = Counter()
+
+    def __str__(self) -> str:
+        lines = [
+            f'{self.files} files, {self.bytes / 1024**3:.1f} GiB; an '
+            f'estimated {self.reclaimable / 1024**3:.1f} GiB reclaimable'
+        ]
+        for group, files, size in self.groups():
+            for key, count in files.most_common():
+                lines.append(f'  {key:>8} {count:>7} files '
+                             f'{size[key] / 1024**3:>9.1f} GiB')
+        return '\n'.join(lines)
+
+    def add(self, meta: Metadata, rec: Dict) -> None:
+        """Count a file, given its metadata and record()"""
+        res = resolution(meta)
+        self.files += 1
+        self.bytes += rec['size']
+        self.reclaimable += rec['reclaimable']
+        self.shrinkable += rec['reclaimable'] > 0
+        self.files_by_codec[rec['codec_name']] += 1
+        self.bytes_by_codec[rec['codec_name']] += rec['size']
+        self.files_by_resolution[res] += 1
+        self.bytes_by_resolution[res] += rec['size']
+
+    def groups(self) -> List:
+        return [('codec', self.files_by_codec, self.bytes_by_codec),
+                ('resolution', self.files_by_resolution,
+                 self.bytes_by_resolution)]
+
+    def as_dict(self) -> Dict:
+        totals = {
+            'files': self.files,
+            'bytes': self.bytes,
+            'reclaimable': self.reclaimable,
+            'reclaimable_files': self.shrinkable,
+        }
+        for group, files, size in self.groups():
+            totals[f'by_{group}'] = {
+                key: {
+                    'files': count,
+                    'bytes': size[key]
+                }
+                for key, count in files.most_common()
+            }
+        return totals
+
+    def rows(self) -> List[Dict]:
+        rows = [{
+            'group': 'all',
+            'key': 'all',
+            'files': self.files,
+            'bytes': self.bytes
+        }, {
+            'group': 'reclaimable',
+            'key': 'all',
+            'files': self.shrinkable,
+            'bytes': self.reclaimable
+        }]
+        for group, files, size in self.groups():
+            rows.extend({
+                'group': group,
+                'key': key,
+                'files': count,
+                'bytes': size[key]
+            } for key, count in files.most_common())
+        return rows
+
+
+class Writer(ABC):
+    """Write each file's record as it comes, then the totals, to
+    totals_path if given"""
+    stream: IO[str]
+    totals_path: Optional[str]
+
+    def __init__(self,
+                 stream: IO[str],
+                 totals_path: Optional[str] = None) -> None:
+        self.stream = stream
+        self.totals_path = totals_path
+        self.totals = Totals()
+
+    def write(self, meta: Metadata) -> None:
+        rec = record(meta)
+        self.totals.add(meta, rec)
+        self.emit(rec)
+
+    @abstractmethod
+    def emit(self, rec: Dict) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class JsonlWriter(Writer):
+    """One JSON object per line. The totals are a last line with only a
+    "totals" key, or a JSON document in totals_path"""
+
+    def emit(self, rec: Dict) -> None:
+        self.stream.write(json.dumps(rec) + '\n')
+        self.stream.flush()
+
+    def close(self) -> None:
+        totals = {'totals': self.totals.as_dict()}
+        if self.totals_path is None:
+            self.stream.write(json.dumps(totals) + '\n')
+            self.stream.flush()
+        else:
+            with open(self.totals_path, 'w') as f:
+                f.write(json.dumps(totals, indent=2) + '\n')
+
+
+class CsvWriter(Writer):
+    """A table of files. A second table, of totals, has columns of its own,
+    so it goes to totals_path, and is left out without one"""
+
+    def __init__(self,
+                 stream: IO[str],
+                 totals_path: Optional[str] = None) -> None:
+        super().__init__(stream, totals_path)
+        self.files = csv.DictWriter(stream, FIELDS, lineterminator='\n')
+        self.files.writeheader()
+
+    def emit(self, rec: Dict) -> None:
+        self.files.writerow(rec)
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.stream.flush()
+        if self.totals_path is None:
+            return
+        with open(self.totals_path, 'w', newline='') as f:
+            totals = csv.DictWriter(f, TOTAL_FIELDS, lineterminator='\n')
+            totals.writeheader()
+            totals.writerows(self.totals.rows())
+
+
+WRITERS = {'jsonl': JsonlWriter, 'csv': CsvWriter}
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+asyncio-based HandBrakeCLI runner. Children are launched with `--json` so that
+their progress can be parsed from stdout as it streams, and every child in
+the process is supervised from a single event loop, whichever thread started
+it.
+"""
+
+import json
+import threading
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set
+
+from dlrippyr.log import logger
+
+if TYPE_CHECKING:
+    # Imported where it's used, as it's slow to import and only encodes
+    # need it
+    import asyncio
+
+# Lines of HandBrakeCLI's stderr log kept for reporting on failed encodes
+LOG_TAIL = 20
+# HandBrakeCLI's JSON job dump can be a single very long line
+LINE_LIMIT = 2**20
+# Each progress state carries its details under a key of its own
+STATE_KEYS = {
+    'SCANNING': 'Scanning',
+    'WORKING': 'Working',
+    'PAUSED': 'Paused',
+    'SEARCHING': 'Searching',
+    'MUXING': 'Muxing',
+    'WORKDONE': 'WorkDone',
+}
+
+
+# PIDs of every HandBrakeCLI child currently running in this process
+_children: Set[int] = set()
+_children_lock = threading.Lock()
+
+# Started by _shared_loop() on first use
+_loop: Optional['asyncio.AbstractEventLoop'] = None
+_loop_lock = threading.Lock()
+
+
+def children() -> List[int]:
+    """PIDs of the running HandBrakeCLI children, for pausing them"""
+    with _children_lock:
+        return list(_children)
+
+
+class Progress:
+    """A snapshot of one HandBrakeCLI child's progress"""
+    state: str
+    percent: float
+    fps: float
+    avg_fps: float
+    eta: Optional[int]
+    pass_id: int
+    pass_count: int
+
+    def __init__(self,
+                 state: str = 'WAITING',
+                 percent: float = 0.0,
+                 fps: float = 0.0,
+                 avg_fps: float = 0.0,
+                 eta: Optional[int] = None,
+                 pass_id: int = 1,
+                 pass_count: int = 1) -> None:
+        self.state = state
+        self.percent = percent
+        self.fps = fps
+        self.avg_fps = avg_fps
+        self.eta = eta
+        self.pass_id = pass_id
+        self.pass_count = pass_count
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(state={self.state!r}, '
+                f'percent={self.percent:.1f})')
+
+    def __str__(self) -> str:
+        eta = '--:--:--' if self.eta is None else (
+            f'{self.eta // 3600:02d}:{self.eta // 60 % 60:02d}:'
+            f'{self.eta % 60:02d}')
+        return (f'{self.percent:5.1f}% {self.fps:6.1f} fps '
+                f'(avg {self.avg_fps:6.1f}) ETA {eta}')
+
+    @classmethod
+    def from_json(cls, block: Dict) -> 'Progress':
+        """Build from the body of a HandBrakeCLI `Progress: {...}` block"""
+        state = block.get('State', 'UNKNOWN')
+        detail = block.get(STATE_KEYS.get(state, ''), {})
+
+        if state == 'WORKDONE':
+            return cls(state=state, percent=100.0, eta=0)
+
+        eta = detail.get('ETASeconds')
+        return cls(state=state,
+                   percent=100 * float(detail.get('Progress', 0.0)),
+                   fps=float(detail.get('Rate', 0.0)),
+                   avg_fps=float(detail.get('RateAvg', 0.0)),
+                   eta=None if eta is None else int(eta),
+                   pass_id=int(detail.get('Pass', 1)),
+                   pass_count=int(detail.get('PassCount', 1)))
+
+
+class ProgressParser:
+    """Incrementally reassemble the pretty-printed JSON blocks HandBrakeCLI
+    emits on stdout with `--json`, one line at a time.
+
+    Blocks open with a `Name: {` line and close with a `}` in column zero.
+    """
+
+    def __init__(self) -> None:
+        self._name: Optional[str] = None
+        self._lines: List[str] = []
+
+    def feed(self, line: str) -> Optional[Progress]:
+        """Consume a line, returning a Progress when one is completed"""
+        line = line.rstrip('\r\n')
+
+        if self._name is None:
+            name, sep, rest = line.partition(': ')
+            if sep and rest.strip() == '{':
+                self._name = name
+                self._lines = ['{']
+            return None
+
+        self._lines.append(line)
+        if line != '}':
+            return None
+
+        name, self._name = self._name, None
+        if name != 'Progress':
+            return None
+        try:
+            return Progress.from_json(json.loads('\n'.join(self._lines)))
+        except (ValueError, TypeError) as err:
+            logger.debug(f'Unparseable HandBrakeCLI progress: {err}')
+            return None
+
+
+ProgressCallback = Callable[[str, Progress], None]
+OutputCallback = Callable[[str, str], None]
+
+
+def with_json(cmd: List[str]) -> List[str]:
+    """Insert --json right after the HandBrakeCLI executable, if missing"""
+    if '--json' in cmd:
+        return list(cmd)
+    cmd = list(cmd)
+    for i, arg in enumerate(cmd):
+        if arg.endswith('HandBrakeCLI'):
+            cmd.insert(i + 1, '--json')
+            break
+    return cmd
+
+
+class HandBrakeRunner:
+    """Launch and supervise HandBrakeCLI children without blocking.
+
+    on_progress(tag, progress) fires for each parsed progress update and
+    on_output(tag, line) for each line of HandBrakeCLI's stderr log. The tag
+    identifies the child, defaulting to its input path.
+    """
+    on_progress: Optional[ProgressCallback]
+    on_output: Optional[OutputCallback]
+
+    def __init__(self,
+                 on_progress: Optional[ProgressCallback] = None,
+                 on_output: Optional[OutputCallback] = None) -> None:
+        self.on_progress = on_progress
+        self.on_output = on_output
+
+    async def run(self, cmd: List[str], tag: Optional[str] = None) -> int:
+        """Run one child to completion, returning its exit status"""
+        import asyncio
+        cmd = with_json(cmd)
+        if tag is None:
+            tag = cmd[cmd.index('-i') + 1] if '-i' in cmd else cmd[0]
+
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=LINE_LIMIT)
+        tail: deque = deque(maxlen=LOG_TAIL)
+
+        with _children_lock:
+            _children.add(process.pid)
+        try:
+            await asyncio.gather(self._read_progress(process.stdout, tag),
+                                 self._read_log(process.stderr, tag, tail))
+            returncode = await process.wait()
+        finally:
+            # Reading failed or was cancelled: don't leave the child running
+            # unsupervised, nor unreaped
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            with _children_lock:
+                _children.discard(process.pid)
+
+        if returncode != 0:
+            log = '\n'.join(tail)
+            logger.error(f'HandBrakeCLI exited {returncode} for {tag}:\n{log}')
+        return returncode
+
+    async def _read_progress(self, stream: 'asyncio.StreamReader',
+                             tag: str) -> None:
+        parser = ProgressParser()
+        async for raw in stream:
+            progress = parser.feed(raw.decode(errors='replace'))
+            if progress is not None and self.on_progress is not None:
+                self.on_progress(tag, progress)
+
+    async def _read_log(self, stream: 'asyncio.StreamReader', tag: str,
+                        tail: deque) -> None:
+        async for raw in stream:
+            line = raw.decode(errors='replace').rstrip()
+            tail.append(line)
+            if self.on_output is not None:
+                self.on_output(tag, line)
+
+
+def _shared_loop() -> 'asyncio.AbstractEventLoop':
+    """The one event loop every HandBrakeCLI child in the process is
+    supervised from, run in a thread of its own from first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            import asyncio
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever,
+                             name='dlrippyr-runner',
+                             daemon=True).start()
+        return _loop
+
+
+def run_handbrake(cmd: List[str],
+                  on_progress: Optional[ProgressCallback] = None,
+                  on_output: Optional[OutputCallback] = None) -> int:
+    """Blocking convenience wrapper for callers outside the event loop, like
+    a Scheduler's threads. The child runs under the shared loop, where the
+    callbacks are called"""
+    import asyncio
+    runner = HandBrakeRunner(on_progress=on_progress, on_output=on_output)
+    return asyncio.run_coroutine_threadsafe(runner.run(cmd),
+                                            _shared_loop()).result()
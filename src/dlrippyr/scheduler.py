@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+Run encode jobs concurrently in a fixed number of slots, or in slots sized to
+each job's source resolution when left on `auto`.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import click
+
+from dlrippyr.classes import Job
+from dlrippyr.journal import DONE, FAILED, RUNNING, Journal
+from dlrippyr.log import logger
+from dlrippyr.progress import LibraryProgress
+from dlrippyr.runner import Progress
+from dlrippyr.staging import Scratch
+
+# Threads a single x265 encode makes good use of, by source height. Beyond
+# these, an extra encode slot is a better use of the cores than a wider one.
+ENCODE_THREADS = [(720, 4), (1080, 8), (1440, 12)]
+MAX_ENCODE_THREADS = 16
+
+
+def encode_threads(job: Job) -> int:
+    """Number of cores one encode of this job can keep busy"""
+    if job.meta is None:
+        return MAX_ENCODE_THREADS
+    height = int(job.meta.height)
+    for limit, threads in ENCODE_THREADS:
+        if height <= limit:
+            return threads
+    return MAX_ENCODE_THREADS
+
+
+def parse_jobs(ctx, param, value: str) -> Optional[int]:
+    """click callback for --jobs: a positive count, or `auto` (None)"""
+    if value == 'auto':
+        return None
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise click.BadParameter("must be a positive integer or 'auto'")
+    return jobs
+
+
+class VerificationError(Exception):
+    pass
+
+
+class JobResult:
+    job: Job
+    returncode: Optional[int]
+    error: Optional[BaseException]
+    elapsed: float
+
+    def __init__(self,
+                 job: Job,
+                 returncode: Optional[int] = None,
+                 error: Optional[BaseException] = None,
+                 elapsed: float = 0.0) -> None:
+        self.job = job
+        self.returncode = returncode
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}("{self.job.input}", '
+                f'returncode={self.returncode})')
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.returncode == 0
+
+
+class Summary:
+    results: List[JobResult]
+    elapsed: float
+
+    def __init__(self, results: List[JobResult], elapsed: float) -> None:
+        self.results = results
+        self.elapsed = elapsed
+
+    def __str__(self) -> str:
+        lines = [
+            f'{len(self.succeeded)} of {len(self.results)} jobs succeeded in '
+            f'{self.elapsed / 60:.1f} minutes'
+        ]
+        for result in self.failed:
+            reason = (repr(result.error) if result.error else
+                      f'exit status {result.returncode}')
+            lines.append(f'    FAILED: {result.job.input} ({reason})')
+        return '\n'.join(lines)
+
+    @property
+    def succeeded(self) -> List[JobResult]:
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self) -> List[JobResult]:
+        return [r for r in self.results if not r.ok]
+
+
+class Scheduler:
+    """Run jobs concurrently, each occupying a share of a fixed capacity.
+
+    With an explicit slot count every job weighs one slot. With slots=None
+    (`auto`) the capacity is the host's core count and each job weighs the
+    number of threads its resolution can use, so a box fills up with many
+    SD encodes or a few 4K ones.
+    """
+    capacity: int
+    auto: bool
+    journal: Optional[Journal]
+    tracker: Optional[LibraryProgress]
+    scratch: Optional[Scratch]
+    verifier: Optional[Callable[[Job], Optional[str]]]
+    on_done: Optional[Callable[[JobResult], None]]
+    on_progress: Optional[Callable[[Job, Progress], None]]
+
+    def __init__(
+            self,
+            slots: Optional[int] = 1,
+            journal: Optional[Journal] = None,
+            tracker: Optional[LibraryProgress] = None,
+            scratch: Optional[Scratch] = None,
+            verifier: Optional[Callable[[Job], Optional[str]]] = None,
+            on_done: Optional[Callable[[JobResult], None]] = None,
+            on_progress: Optional[Callable[[Job, Progress], None]] = None
+    ) -> None:
+        self.auto = slots is None
+        # Optional record of each job's progress through running/done/failed
+        self.journal = journal
+        # Optional aggregate view fed with each job's HandBrakeCLI progress
+        self.tracker = tracker
+        # Optional local disk to stage each job's input and output on; the
+        # next job is staged as soon as the last is dispatched, while the
+        # running encodes carry on
+        self.scratch = scratch
+        # Optional check of each successful encode, returning why it failed
+        # or None. It runs once the job's slot is free, alongside the next
+        # encode
+        self.verifier = verifier
+        # Optional callback with each job's final result
+        self.on_done = on_done
+        # Optional callback with each job's HandBrakeCLI progress, when
+        # there's no tracker
+        self.on_progress = on_progress
+        self.capacity = (os.cpu_count() or 1) if self.auto else max(1, slots)
+        # Share of the capacity currently in use, lowered by a Throttle when
+        # the host is busy with other work
+        self.limit = self.capacity
+        self._free = self.capacity
+        self._cond = threading.Condition()
+
+    def __repr__(self) -> str:
+        slots = 'auto' if self.auto else self.capacity
+        return f'{self.__class__.__name__}(slots={slots})'
+
+    def weight(self, job: Job) -> int:
+        return min(self.capacity, self._per_encode(job) * job.concurrency)
+
+    def run(self, jobs: Iterable[Job]) -> Summary:
+        """Run every job, returning once all have finished or failed"""
+        start = time.monotonic()
+        futures = []
+        if self.scratch is not None:
+            jobs = self.scratch.stage(jobs)
+
+        # Verifying jobs hold a thread but not a slot, so allow for as many
+        # again
+        workers = self.capacity * (1 if self.verifier is None else 2)
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='dlrippyr-job') as pool:
+            for job in jobs:
+                weight = self._acquire(self.weight(job))
+                job.concurrency = self._fit(job, job.concurrency, weight)
+                futures.append(pool.submit(self._run_one, job, weight))
+
+        return Summary([f.result() for f in futures], time.monotonic() - start)
+
+    def _run_one(self, job: Job, weight: int) -> JobResult:
+        start = time.monotonic()
+        if self.journal is not None:
+            self.journal.mark(job, RUNNING)
+        on_progress = (self.on_progress
+                       if self.tracker is None else self.tracker.update)
+        try:
+            returncode = job.run_handbrake(on_progress=on_progress)
+            result = JobResult(job, returncode=returncode)
+        except Exception as err:  # One bad job must not sink the batch
+            logger.exception(f'Job for {job.input} raised')
+            result = JobResult(job, error=err)
+        finally:
+            self._release(weight)
+            if self.scratch is not None:
+                self.scratch.release(job)
+            if self.tracker is not None:
+                self.tracker.finish(job)
+        result.elapsed = time.monotonic() - start
+
+        if result.ok and self.verifier is not None:
+            try:
+                reason = self.verifier(job)
+                if reason is not None:
+                    result.error = VerificationError(reason)
+            except Exception as err:
+                logger.exception(f'Verifying {job.output} raised')
+                result.error = err
+
+        if not result.ok:
+            logger.error(f'Job for {job.input} failed: {result!r}')
+        if self.journal is not None:
+            self.journal.mark(job,
+                              DONE if result.ok else FAILED,
+                              error=None if result.ok else repr(result))
+        if self.on_done is not None:
+            self.on_done(result)
+        return result
+
+    def set_limit(self, limit: int) -> None:
+        """Use only limit of the capacity for new jobs. Running jobs are
+        left be, so a lower limit takes hold as they finish"""
+        limit = max(1, min(self.capacity, limit))
+        with self._cond:
+            self._free += limit - self.limit
+            self.limit = limit
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, job: Job, encodes: int = 1) -> Iterator[int]:
+        """Hold a share of the capacity for encodes like job's run outside
+        run(), such as a prediction's samples, yielding how many fit it"""
+        weight = self._acquire(
+            min(self.capacity,
+                self._per_encode(job) * encodes))
+        try:
+            yield self._fit(job, encodes, weight)
+        finally:
+            self._release(weight)
+
+    def _fit(self, job: Job, encodes: int, weight: int) -> int:
+        """How many of encodes like job's fit a share of weight"""
+        return max(1, min(encodes, weight // self._per_encode(job)))
+
+    def _per_encode(self, job: Job) -> int:
+        return encode_threads(job) if self.auto else 1
+
+    def _acquire(self, weight: int) -> int:
+        """Wait for room for a job, returning the weight it was given; no
+        more than the limit, so a heavy job still fits a lowered one"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._free >= min(weight, self.limit))
+            weight = min(weight, self.limit)
+            self._free -= weight
+            return weight
+
+    def _release(self, weight: int) -> None:
+        with self._cond:
+            self._free += weight
+            self._cond.notify_all()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Local scratch staging. Reading a source off a NAS and writing its output back
+over the network as HandBrakeCLI goes makes encodes stall on I/O, so a
+Scratch copies each queued input to local disk (an SSD or tmpfs) just before
+it's due, which, as the Scheduler pulls the next job as soon as it has
+dispatched the last, happens while the encodes before it run. The encode
+writes its output locally, and the result is copied back alongside its
+destination and renamed into place, so it appears there atomically.
+
+Copies go through copy_file_range or sendfile, so the data never passes
+through Python, and may be held to a bandwidth limit. Inputs which don't fit
+under the size cap, or in the space left on the scratch disk, are encoded in
+place as before.
+"""
+
+import errno
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+from dlrippyr.classes import HandBrakeJob, Job, partial_name
+from dlrippyr.log import logger
+from dlrippyr.metrics import metrics
+
+# Bytes moved per system call, and between bandwidth checks
+CHUNK_SIZE = 8 * 1024**2
+# Default cap on the inputs staged at any one time, in GiB
+DEFAULT_SCRATCH_SIZE = 50.0
+
+_copy_file_range = hasattr(os, 'copy_file_range')
+_sendfile = hasattr(os, 'sendfile')
+
+
+def _copy_chunk(fin: int, fout: int, count: int) -> int:
+    """Copy up to count bytes between the files' current offsets in the
+    kernel where it can, returning the number copied"""
+    global _copy_file_range, _sendfile
+    if _copy_file_range:
+        try:
+            return os.copy_file_range(fin, fout, count)
+        except OSError as err:
+            # Across filesystems, or on kernels and filesystems without it
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP):
+                raise
+            _copy_file_range = False
+    if _sendfile:
+        try:
+            return os.sendfile(fout, fin, None, count)
+        except OSError as err:
+            if err.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+            _sendfile = False
+    data = os.read(fin, count)
+    return os.write(fout, data)
+
+
+def copy_file(src: Path,
+              dst: Path,
+              bwlimit: float = 0,
+              sync: bool = False) -> int:
+    """Copy src to dst, at no more than bwlimit bytes a second if given,
+    returning the bytes copied. With sync, dst is flushed to disk before
+    returning, ready to be renamed over something that matters"""
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        size = os.fstat(fin.fileno()).st_size
+        start = time.monotonic()
+        done = 0
+        while done < size:
+            copied = _copy_chunk(fin.fileno(), fout.fileno(),
+                                 min(CHUNK_SIZE, size - done))
+            if not copied:
+                break
+            done += copied
+            if bwlimit:
+                ahead = done / bwlimit - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if sync:
+            os.fsync(fout.fileno())
+    return done
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Staged:
+    """One job's working directory on scratch and the bytes it reserves"""
+
+    def __init__(self, workdir: Path, reserved: int) -> None:
+        self.workdir = workdir
+        self.reserved = reserved
+
+
+class Scratch:
+    """Stage HandBrakeJobs' inputs and outputs on a local scratch directory.
+
+    Each run works in its own `dlrippyr-<pid>` directory under root, which
+    is removed by close(); any left by runs which died are swept up when the
+    next one starts.
+    """
+    root: Path
+    max_bytes: int
+    bwlimit: float
+
+    def __init__(self,
+                 root: Path,
+                 max_bytes: int = int(DEFAULT_SCRATCH_SIZE * 1024**3),
+                 bwlimit: float = 0) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # Bytes a second, or 0 for no limit
+        self.bwlimit = bwlimit
+        self.used = 0
+        self._count = 0
+        self._staged: Dict[int, _Staged] = {}
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._sweep()
+        self.workdir = self.root / f'dlrippyr-{os.getpid()}'
+        self.workdir.mkdir(exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}("{self.root}")'
+
+    def __enter__(self) -> 'Scratch':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @classmethod
+    def from_options(cls, root: Optional[str], size: float,
+                     bwlimit: float) -> Optional['Scratch']:
+        """Build the Scratch convert's options ask for, if any; size in GiB
+        and bwlimit in MiB/s"""
+        if root is None:
+            return None
+        return cls(Path(root),
+                   max_bytes=int(size * 1024**3),
+                   bwlimit=bwlimit * 1024**2)
+
+    def stage(self, jobs: Iterable[Job]) -> Iterator[Job]:
+        """Pass jobs through, staging each as it's asked for"""
+        for job in jobs:
+            if isinstance(job, HandBrakeJob):
+                self._stage(job)
+            yield job
+
+    def unstage(self, job: Job, returncode: int) -> None:
+        """Copy a successful staged encode's output back to its partial name
+        beside the destination, ready to be renamed into place, and free the
+        job's scratch space"""
+        try:
+            local = job.staged_output
+            if returncode != 0 or local is None or not local.exists():
+                return
+            partial = partial_name(job.output)
+            start = time.monotonic()
+            try:
+                copied = copy_file(local, partial, self.bwlimit, sync=True)
+            except OSError:
+                # Never leave half an output to be renamed into place
+                partial.unlink(missing_ok=True)
+                raise
+            metrics.inc('dlrippyr_scratch_bytes_total',
+                        copied,
+                        direction='out')
+            logger.debug(f'Copied {Path(job.output).name} back from scratch in '
+                         f'{time.monotonic() - start:.1f}s')
+        finally:
+            self.release(job)
+
+    def release(self, job: Job) -> None:
+        """Delete a job's staged files and free its space; safe to repeat"""
+        with self._lock:
+            staged = self._staged.pop(id(job), None)
+            if staged is None:
+                return
+            self.used -= staged.reserved
+        shutil.rmtree(staged.workdir, ignore_errors=True)
+        job.staging = job.staged_input = job.staged_output = None
+
+    def close(self) -> None:
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _stage(self, job: HandBrakeJob) -> None:
+        try:
+            size = os.stat(job.input).st_size
+            free = shutil.disk_usage(self.root).free
+        except OSError as err:
+            logger.warning(f'Unable to stage {job.input}: {err}')
+            return
+        # Leave room for an output as large as the input
+        with self._lock:
+            if self.used + size > self.max_bytes or 2 * size > free:
+                logger.info(f'Encoding {job.input} in place: no room on '
+                            'scratch')
+                return
+            self.used += size
+            self._count += 1
+            workdir = self.workdir / str(self._count)
+            self._staged[id(job)] = _Staged(workdir, size)
+
+        local = workdir / Path(job.input).name
+        start = time.monotonic()
+        try:
+            workdir.mkdir()
+            copied = copy_file(job.input, local, self.bwlimit)
+        except OSError as err:
+            logger.warning(f'Unable to stage {job.input}: {err}')
+            self.release(job)
+            return
+        elapsed = time.monotonic() - start
+        metrics.inc('dlrippyr_scratch_bytes_total', copied, direction='in')
+        logger.debug(f'Staged {job.input} in {elapsed:.1f}s')
+
+        job.staging = self
+        job.staged_input = local
+        job.staged_output = workdir / partial_name(job.output).name
+        job.cmd = job.make_cmd()
+
+    def _sweep(self) -> None:
+        """Remove the working directories of runs which are no longer
+        running"""
+        for stale in self.root.glob('dlrippyr-*'):
+            pid = stale.name.partition('-')[2]
+            if pid.isdigit() and not _alive(int(pid)):
+                logger.info(f'Removing stale scratch directory {stale}')
+                shutil.rmtree(stale, ignore_errors=True)
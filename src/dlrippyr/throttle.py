@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Load-adaptive throttling. A background controller samples how busy the host
+is with work other than our own encodes and CPU pressure (PSI), and backs
+off when that load rises: first by running fewer encodes at once, then, on
+a spike, by pausing the running HandBrakeCLI children with SIGSTOP until it
+passes. Inside configured full-speed windows, e.g. 01:00-07:00, throttling
+is off.
+
+Other work is measured as the host's busy CPU time from /proc/stat less what
+our children used, so the encodes' own load doesn't throttle them. Where
+/proc isn't available the load average stands in, more coarsely.
+"""
+
+import os
+import signal
+import threading
+from datetime import datetime, time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import click
+
+from dlrippyr.log import logger
+from dlrippyr.runner import children
+from dlrippyr.scheduler import Scheduler
+
+# Seconds between samples
+SAMPLE_INTERVAL = 5.0
+# Consecutive samples a change in load must persist for before acting
+CONFIRM_SAMPLES = 2
+# Share of the host's CPU used by other work at which to run fewer encodes,
+# and at which to pause them outright
+BUSY_SHARE = 0.25
+SPIKE_SHARE = 0.5
+# Share of time runnable tasks stalled waiting on a CPU (PSI "some avg10"),
+# as a percentage, which counts as busy while other work is running
+PSI_BUSY = 40.0
+
+PSI_PATH = '/proc/pressure/cpu'
+STAT_PATH = '/proc/stat'
+
+QUIET = 'quiet'
+BUSY = 'busy'
+SPIKE = 'spike'
+
+
+class Window:
+    """A daily span of wall-clock time, which may run past midnight"""
+    start: time
+    end: time
+
+    def __init__(self, start: time, end: time) -> None:
+        self.start = start
+        self.end = end
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}({self.start:%H:%M}-'
+                f'{self.end:%H:%M})')
+
+    def __contains__(self, now: datetime) -> bool:
+        clock = now.time()
+        if self.start <= self.end:
+            return self.start <= clock < self.end
+        return clock >= self.start or clock < self.end
+
+    @classmethod
+    def parse(cls, text: str) -> 'Window':
+        """From `HH:MM-HH:MM`"""
+        start, sep, end = text.partition('-')
+        if not sep:
+            raise ValueError(f'{text!r} is not of the form HH:MM-HH:MM')
+        return cls(time.fromisoformat(start.strip()),
+                   time.fromisoformat(end.strip()))
+
+
+def parse_windows(ctx, param, value: Iterable[str]) -> List[Window]:
+    """click callback for --full-speed"""
+    try:
+        return [Window.parse(text) for text in value]
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
+def read_psi(path: str = PSI_PATH) -> Optional[float]:
+    """CPU pressure "some avg10" percentage, or None without PSI"""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('some '):
+                    fields = dict(
+                        field.split('=') for field in line.split()[1:])
+                    return float(fields['avg10'])
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def read_cpu(path: str = STAT_PATH) -> Optional[Tuple[int, int]]:
+    """(busy, total) CPU time across the host, in clock ticks"""
+    try:
+        with open(path) as f:
+            fields = [int(field) for field in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # idle and iowait are the 4th and 5th; guest time is already in user
+    total = sum(fields[:8])
+    return total - fields[3] - fields[4], total
+
+
+def read_process_cpu(pid: int) -> Optional[int]:
+    """User plus system CPU time of a process, in clock ticks"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces, so split after it
+            fields = f.read().rpartition(')')[2].split()
+    except OSError:
+        return None
+    return int(fields[11]) + int(fields[12])
+
+
+class Load:
+    """One sample of how busy the host is"""
+    foreign: float
+    psi: Optional[float]
+
+    def __init__(self, foreign: float, psi: Optional[float] = None) -> None:
+        # Share of the host's CPU used by anything but our encodes, 0-1
+        self.foreign = foreign
+        self.psi = psi
+
+    def __str__(self) -> str:
+        psi = 'n/a' if self.psi is None else f'{self.psi:.0f}%'
+        return f'other load {self.foreign:.0%}, CPU pressure {psi}'
+
+    @property
+    def level(self) -> str:
+        if self.foreign >= SPIKE_SHARE:
+            return SPIKE
+        pressured = (self.psi is not None and self.psi >= PSI_BUSY
+                     and self.foreign >= BUSY_SHARE / 2)
+        if self.foreign >= BUSY_SHARE or pressured:
+            return BUSY
+        return QUIET
+
+
+class Sampler:
+    """Measure the load from other work between successive calls"""
+
+    def __init__(self) -> None:
+        self._cpu = read_cpu()
+        self._ours: Dict[int, int] = {}
+
+    def __call__(self) -> Load:
+        psi = read_psi()
+        cpu = read_cpu()
+        if cpu is None or self._cpu is None:
+            cpus = os.cpu_count() or 1
+            return Load(min(1.0, os.getloadavg()[0] / cpus), psi)
+
+        busy = cpu[0] - self._cpu[0]
+        total = cpu[1] - self._cpu[1]
+        self._cpu = cpu
+
+        ours = 0
+        seen = {}
+        for pid in children():
+            used = read_process_cpu(pid)
+            if used is None:
+                continue
+            # A child first seen now is counted from here on
+            ours += used - self._ours.get(pid, used)
+            seen[pid] = used
+        self._ours = seen
+
+        if total <= 0:
+            return Load(0.0, psi)
+        return Load(max(0.0, busy - ours) / total, psi)
+
+
+class Throttle:
+    """Adapt a Scheduler's concurrency, and pause its HandBrakeCLI children,
+    to the load from other work on the host"""
+    scheduler: Scheduler
+    windows: List[Window]
+    interval: float
+    paused: bool
+
+    def __init__(self,
+                 scheduler: Scheduler,
+                 windows: Iterable[Window] = (),
+                 interval: float = SAMPLE_INTERVAL,
+                 sampler: Optional[Callable[[], Load]] = None,
+                 clock: Callable[[], datetime] = datetime.now) -> None:
+        self.scheduler = scheduler
+        self.windows = list(windows)
+        self.interval = interval
+        self.sampler = sampler or Sampler()
+        self.clock = clock
+        self.paused = False
+        self._level = QUIET
+        self._streak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(windows={self.windows})'
+
+    def step(self, load: Load) -> None:
+        """Act on one sample"""
+        if any(self.clock() in window for window in self.windows):
+            self._resume()
+            self._set_limit(self.scheduler.capacity)
+            return
+
+        level = load.level
+        self._streak = self._streak + 1 if level == self._level else 1
+        self._level = level
+        if self._streak < CONFIRM_SAMPLES:
+            return
+
+        if level == QUIET:
+            self._resume()
+            self._set_limit(self.scheduler.limit + 1)
+        else:
+            self._set_limit(self.scheduler.limit - 1)
+            if level == SPIKE:
+                self._pause(load)
+            else:
+                self._resume()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop,
+                                        name='dlrippyr-throttle',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop adapting, letting everything run at full speed again"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._resume()
+        self._set_limit(self.scheduler.capacity)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.step(self.sampler())
+            except Exception:  # Never let throttling take the run down
+                logger.exception('Throttle sample failed')
+
+    def _set_limit(self, limit: int) -> None:
+        before = self.scheduler.limit
+        self.scheduler.set_limit(limit)
+        if self.scheduler.limit != before:
+            logger.info(f'Throttle: running up to {self.scheduler.limit} of '
+                        f'{self.scheduler.capacity} encode slots')
+
+    def _pause(self, load: Load) -> None:
+        # Re-sent every sample, to catch children started since
+        if not self.paused:
+            logger.info(f'Throttle: pausing encodes ({load})')
+        self.paused = True
+        self._signal(signal.SIGSTOP)
+
+    def _resume(self) -> None:
+        if self.paused:
+            logger.info('Throttle: resuming encodes')
+            self.paused = False
+            self._signal(signal.SIGCONT)
+
+    @staticmethod
+    def _signal(signum: int) -> None:
+        for pid in children():
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def __enter__(self) -> 'Throttle':
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -1,38 +1,105 @@
 #!/usr/bin/env python
-import subprocess
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Tuple
+
+from dlrippyr.log import logger
+from dlrippyr.metrics import metrics
+
+# Kept importable from here for existing callers
+from dlrippyr.runner import run_handbrake  # noqa: F401
 
 EXTS = ['mkv', 'mp4', 'mov', 'wmv', 'avi']
+# Dotted, lower-cased suffixes for single-lookup, case-insensitive matching
+VEXTS = frozenset(f'.{ext}' for ext in EXTS)
+# Directory listings are latency bound on network shares, not CPU bound, so
+# keep many scandir calls in flight at once
+SCAN_WORKERS = 16
+
+
+def is_vfile(name: str) -> bool:
+    """Check whether a file name carries one of the supported video extensions,
+    ignoring case"""
+    return os.path.splitext(name)[1].lower() in VEXTS
+
+
+def _scan_dir(path: Path) -> Tuple[List[Path], List[Path]]:
+    """List a single directory, splitting it into video files and the
+    sub-directories still to be walked"""
+    files = []
+    dirs = []
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(Path(entry.path))
+                    elif entry.is_file() and is_vfile(entry.name):
+                        files.append(Path(entry.path))
+                except OSError as err:
+                    logger.warning(f'Skipping {entry.path}: {err}')
+    except OSError as err:
+        logger.warning(f'Unable to scan {path}: {err}')
 
+    return files, dirs
 
-def find_vfiles(arg: str) -> set:
-    """Find video files recursively within the supplied path argument """
-    vfiles = set()
+
+def find_vfiles(arg: str, workers: int = SCAN_WORKERS) -> Iterator[Path]:
+    """Find video files recursively within the supplied path argument.
+
+    Each directory is listed exactly once, with listings fanned out over a
+    thread pool. Paths are yielded as soon as their directory has been read,
+    so callers can begin work before the whole tree has been walked.
+    """
     vpath = Path(arg)
 
     if vpath.is_file():
-        vfiles.add(vpath)
-    elif vpath.is_dir():
-        cwd = vpath
-        glob = list()
-        # Build up the paths list with tuples of (input, output)
-        for ext in EXTS:
-            glob.extend(cwd.rglob(f'*{ext}'))
-            glob.extend(cwd.rglob(f'*{ext.upper()}'))
-            for path in glob:
-                vfiles.add(path)
-
-    return vfiles
-
-
-def run_handbrake(cmd: List[str]) -> None:
-    process = subprocess.Popen(cmd)
-    # Regurgitate HandBrakeCLI back to stdout after it is gobbled up by
-    # subprocess
-    while True:
-        sout = process.communicate()[0]
-        if process.poll() is not None:
-            break
-        if sout:
-            print(sout)
+        metrics.inc('dlrippyr_files_scanned_total')
+        yield vpath
+        return
+    if not vpath.is_dir():
+        return
+
+    pool = ThreadPoolExecutor(max_workers=workers,
+                              thread_name_prefix='dlrippyr-scan')
+    start = time.monotonic()
+    found = listed = 0
+    try:
+        pending = {pool.submit(_scan_dir, vpath)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                listed += 1
+                found += len(files)
+                for subdir in dirs:
+                    pending.add(pool.submit(_scan_dir, subdir))
+                yield from files
+    finally:
+        # The consumer may stop early; don't leave the walk running behind it
+        pool.shutdown(wait=False, cancel_futures=True)
+        elapsed = time.monotonic() - start
+        metrics.inc('dlrippyr_dirs_scanned_total', listed)
+        metrics.inc('dlrippyr_files_scanned_total', found)
+        metrics.inc('dlrippyr_scan_seconds_total', elapsed)
+        metrics.event('scan',
+                      root=str(vpath),
+                      dirs=listed,
+                      files=found,
+                      seconds=elapsed)
+
+
+def iter_vfiles(srcs: Iterable[str],
+                workers: int = SCAN_WORKERS) -> Iterator[Path]:
+    """Stream the video files found across several source files and/or
+    directories, yielding each distinct path only once"""
+    seen = set()
+
+    for src in srcs:
+        for path in find_vfiles(src, workers=workers):
+            if path not in seen:
+                seen.add(path)
+                yield path
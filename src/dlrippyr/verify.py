@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Post-encode verification, in tiers of increasing cost, each including the
+ones before:
+
+- probe: the output's duration, streams and frame count are compared with
+  the source's, from ffprobe, without decoding anything
+- sampled: a few short, evenly spaced runs of frames are decoded from both,
+  concurrently, and compared for PSNR and SSIM. Needs NumPy, installed with
+  the `verify` extra
+- full: the whole output is decoded, looking for errors
+
+A full-file quality pass costs nearly as much as the encode, so sampling is
+the usual choice when sources are to be replaced.
+"""
+
+import importlib.util
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from dlrippyr.classes import Job, SampleJob, partial_name
+from dlrippyr.log import logger
+from dlrippyr.metrics import metrics
+from dlrippyr.staging import copy_file
+
+if TYPE_CHECKING:
+    # Optional, for the sampled tier, and imported only where it's used as
+    # it's slow to import
+    import numpy as np
+
+OFF = 'off'
+PROBE = 'probe'
+SAMPLED = 'sampled'
+FULL = 'full'
+TIERS = [OFF, PROBE, SAMPLED, FULL]
+
+# Allowed difference in duration, in seconds, and in frame count, as a share
+DURATION_TOLERANCE = 1.0
+FRAME_TOLERANCE = 0.01
+# Runs of frames decoded for the sampled tier, and frames in each
+DEFAULT_SAMPLES = 4
+SAMPLE_FRAMES = 8
+# Frames are compared as luma, scaled to this height
+COMPARE_HEIGHT = 540
+# Below these, a sample looks broken rather than merely compressed
+MIN_PSNR = 25.0
+MIN_SSIM = 0.8
+SSIM_WINDOW = 7
+
+
+class MissingDependencyError(Exception):
+    pass
+
+
+class Streams:
+    """What ffprobe says about a file's streams, for comparison"""
+    duration: float
+    counts: Dict[str, int]
+    width: int
+    height: int
+    fps: float
+    frames: Optional[int]
+
+    def __init__(self, _json: Dict) -> None:
+        self.duration = float(_json['format'].get('duration', 0.0))
+        self.counts = {}
+        self.width = self.height = 0
+        self.fps = 0.0
+        self.frames = None
+        for stream in _json.get('streams', []):
+            kind = stream.get('codec_type')
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            if kind == 'video' and self.counts[kind] == 1:
+                self.width = int(stream.get('width', 0))
+                self.height = int(stream.get('height', 0))
+                try:
+                    self.fps = float(Fraction(stream['avg_frame_rate']))
+                except (KeyError, ValueError, ZeroDivisionError):
+                    pass
+                if 'nb_read_packets' in stream:
+                    self.frames = int(stream['nb_read_packets'])
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}({self.duration:.2f}s, '
+                f'{self.counts})')
+
+
+def probe_streams(path: Path, count_frames: bool = False) -> Streams:
+    """Probe path's streams; count_frames reads, but doesn't decode, every
+    packet to count the video frames"""
+    cmd = [
+        'ffprobe', '-v', 'error', '-print_format', 'json', '-show_entries',
+        'format=duration:stream=codec_type,width,height,avg_frame_rate,'
+        'nb_read_packets'
+    ]
+    if count_frames:
+        cmd.append('-count_packets')
+    raw = subprocess.run(cmd + [f'{path}'],
+                         stdout=subprocess.PIPE,
+                         check=True)
+    return Streams(json.loads(raw.stdout))
+
+
+def check_probe(source: Streams, output: Streams) -> Optional[str]:
+    """Why output doesn't look like a whole encode of source, or None"""
+    drift = abs(source.duration - output.duration)
+    if drift > DURATION_TOLERANCE:
+        return (f'duration {output.duration:.2f}s differs from source '
+                f'{source.duration:.2f}s')
+    # Presets may drop audio and subtitle tracks, but not all of them
+    for kind in ('video', 'audio'):
+        if source.counts.get(kind) and not output.counts.get(kind):
+            return f'no {kind} stream in output'
+    if output.frames is not None and source.fps and output.fps:
+        # A preset may change the frame rate, so expect it at the output's
+        expected = source.duration * output.fps
+        if abs(output.frames - expected) > max(2, expected * FRAME_TOLERANCE):
+            return (f'{output.frames} frames where about {expected:.0f} '
+                    'were expected')
+    return None
+
+
+def decode_luma(path: Path, start: float, width: int, height: int,
+                fps: float) -> 'np.ndarray':
+    """SAMPLE_FRAMES frames of luma from start, as a (frames, height, width)
+    array, resampled to fps so source and output frames line up"""
+    import numpy as np
+    vf = f'fps={fps:.6f},scale={width}:{height},format=gray'
+    raw = subprocess.run([
+        'ffmpeg', '-v', 'error', '-ss', f'{start:.3f}', '-i', f'{path}',
+        '-an', '-sn', '-vf', vf, '-frames:v',
+        str(SAMPLE_FRAMES), '-f', 'rawvideo', '-'
+    ],
+                         stdout=subprocess.PIPE,
+                         check=True)
+    frames = np.frombuffer(raw.stdout, dtype=np.uint8)
+    frames = frames[:frames.size - frames.size % (width * height)]
+    return frames.reshape(-1, height, width).astype(np.float32)
+
+
+def psnr(a: 'np.ndarray', b: 'np.ndarray') -> 'np.ndarray':
+    """Per-frame PSNR in dB of two (frames, height, width) arrays"""
+    import numpy as np
+    mse = ((a - b)**2).mean(axis=(1, 2))
+    # Identical frames would be infinite; 100 dB is as good as
+    return np.where(mse > 0, 10 * np.log10(255.0**2 / np.maximum(mse, 1e-10)),
+                    100.0)
+
+
+def _box(x: 'np.ndarray', k: int) -> 'np.ndarray':
+    """Mean over each k x k window of every frame, from an integral image"""
+    import numpy as np
+    c = np.pad(x.cumsum(1).cumsum(2), ((0, 0), (1, 0), (1, 0)))
+    return (c[:, k:, k:] - c[:, :-k, k:] - c[:, k:, :-k] +
+            c[:, :-k, :-k]) / (k * k)
+
+
+def ssim(a: 'np.ndarray', b: 'np.ndarray',
+         window: int = SSIM_WINDOW) -> 'np.ndarray':
+    """Per-frame SSIM of two (frames, height, width) arrays, over uniform
+    windows"""
+    import numpy as np
+    c1 = (0.01 * 255)**2
+    c2 = (0.03 * 255)**2
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    mu_a = _box(a, window)
+    mu_b = _box(b, window)
+    var_a = _box(a * a, window) - mu_a**2
+    var_b = _box(b * b, window) - mu_b**2
+    cov = _box(a * b, window) - mu_a * mu_b
+    index = (((2 * mu_a * mu_b + c1) * (2 * cov + c2)) /
+             ((mu_a**2 + mu_b**2 + c1) * (var_a + var_b + c2)))
+    return index.mean(axis=(1, 2))
+
+
+def check_sampled(source: Path,
+                  output: Path,
+                  streams: Streams,
+                  samples: int = DEFAULT_SAMPLES) -> Optional[str]:
+    """Why sampled frames of output don't match source, or None"""
+    if not streams.height or not streams.fps:
+        return None
+    height = COMPARE_HEIGHT
+    width = max(2, round(streams.width * height / streams.height / 2) * 2)
+    starts = [streams.duration * (i + 0.5) / samples for i in range(samples)]
+
+    with ThreadPoolExecutor(max_workers=2 * samples) as pool:
+        pairs = [(pool.submit(decode_luma, source, start, width, height,
+                              streams.fps),
+                  pool.submit(decode_luma, output, start, width, height,
+                              streams.fps)) for start in starts]
+        for start, (src, out) in zip(starts, pairs):
+            a, b = src.result(), out.result()
+            frames = min(len(a), len(b))
+            if not frames:
+                return f'no frames decoded at {start:.0f}s'
+            a, b = a[:frames], b[:frames]
+            quality = psnr(a, b).mean(), ssim(a, b).mean()
+            logger.debug(f'{output} at {start:.0f}s: PSNR {quality[0]:.1f} '
+                         f'dB, SSIM {quality[1]:.3f}')
+            if quality[0] < MIN_PSNR or quality[1] < MIN_SSIM:
+                return (f'PSNR {quality[0]:.1f} dB, SSIM {quality[1]:.3f} '
+                        f'against source at {start:.0f}s')
+    return None
+
+
+def check_decode(output: Path) -> Optional[str]:
+    """Why output doesn't decode cleanly from end to end, or None"""
+    raw = subprocess.run([
+        'ffmpeg', '-v', 'error', '-xerror', '-i', f'{output}', '-map', '0',
+        '-f', 'null', '-'
+    ],
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE)
+    errors = raw.stderr.decode(errors='replace').strip().splitlines()
+    if raw.returncode != 0 or errors:
+        return 'decode failed: ' + (errors[0] if errors else
+                                    f'exit status {raw.returncode}')
+    return None
+
+
+def replace_source(job: Job) -> Path:
+    """Put a verified output in its source's place, named after the source
+    with the output's extension, and delete the source. Returns the new path
+    of the output. Raises FileExistsError, touching nothing, if another file
+    already has that name"""
+    source = Path(job.input)
+    output = Path(job.output)
+    target = source.with_suffix(output.suffix)
+    if target.exists() and target != source and not target.samefile(output):
+        raise FileExistsError(f'{target} already exists, so {source} is '
+                              'kept alongside its output')
+    try:
+        os.replace(output, target)
+    except OSError:
+        # On another filesystem; copy it over, then rename into place
+        partial = partial_name(target)
+        copy_file(output, partial, sync=True)
+        os.replace(partial, target)
+        output.unlink()
+    if target != source:
+        source.unlink()
+    logger.info(f'Replaced {source} with {target}')
+    return target
+
+
+def have_numpy() -> bool:
+    """Whether NumPy is installed, without importing it"""
+    return importlib.util.find_spec('numpy') is not None
+
+
+class Verifier:
+    """Check finished encodes to the chosen tier, optionally replacing each
+    source with its output once it passes"""
+    tier: str
+    replace: bool
+
+    def __init__(self, tier: str = PROBE, replace: bool = False) -> None:
+        if tier in (SAMPLED, FULL) and not have_numpy():
+            raise MissingDependencyError(
+                f'The {tier} verification tier needs NumPy; install it with '
+                '`pip install dlrippyr[verify]`')
+        self.tier = tier
+        self.replace = replace
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(tier={self.tier!r}, '
+                f'replace={self.replace})')
+
+    def __call__(self, job: Job) -> Optional[str]:
+        """Verify a successful job, returning why it failed, or None"""
+        # A sample is only part of its source, so has nothing to match
+        if self.tier == OFF or isinstance(job, SampleJob):
+            return None
+        try:
+            reason = self.check(Path(job.input), Path(job.output))
+        except (OSError, subprocess.CalledProcessError, ValueError) as err:
+            reason = f'unable to verify: {err}'
+        metrics.inc('dlrippyr_verify_total',
+                    tier=self.tier,
+                    status='failed' if reason else 'ok')
+        if reason is not None:
+            logger.error(f'{job.output} failed verification: {reason}')
+            return reason
+        if self.replace:
+            try:
+                job.output = replace_source(job)
+            except FileExistsError as err:
+                # The encode is still good; only the swap is refused
+                logger.warning(str(err))
+        return None
+
+    def check(self, source: Path, output: Path) -> Optional[str]:
+        streams = probe_streams(output, count_frames=True)
+        checks: List = [lambda: check_probe(probe_streams(source), streams)]
+        if self.tier in (SAMPLED, FULL):
+            checks.append(lambda: check_sampled(source, output, streams))
+        if self.tier == FULL:
+            checks.append(lambda: check_decode(output))
+        for check in checks:
+            reason = check()
+            if reason is not None:
+                return reason
+        return None
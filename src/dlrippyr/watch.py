@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Watch-folder mode. `dlrippyr watch DIR` follows a directory tree with inotify
+and feeds video files into the encode pipeline once they have been closed
+after writing and their size has settled, so new rips are picked up without
+rescanning or reprobing the rest of the library.
+
+inotify is reached through ctypes, so this is Linux only.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import click
+
+from dlrippyr.cache import MetadataCache
+from dlrippyr.classes import HandBrakeJob
+from dlrippyr.journal import PENDING, Journal
+from dlrippyr.log import logger
+from dlrippyr.pipeline import Pipeline
+from dlrippyr.probe import DEFAULT_PROBE_JOBS, ProbePool
+from dlrippyr.scheduler import Scheduler, parse_jobs
+from dlrippyr.utils import is_vfile
+
+DEFAULT_PRESET = 'conf/x265-1080p-mkv.json'
+# Seconds a file's size must hold still after it was last written
+SETTLE_SECONDS = 10.0
+# Seconds between checks on files waiting to settle
+POLL_INTERVAL = 1.0
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Minimal ctypes binding to the Linux inotify API"""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = libc
+        self.fd = self._check(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self.watches: Dict[int, Path] = {}
+
+    @staticmethod
+    def _check(result: int) -> int:
+        if result < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return result
+
+    def add(self, path: Path, mask: int = WATCH_MASK) -> int:
+        wd = self._check(
+            self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask))
+        self.watches[wd] = Path(path)
+        return wd
+
+    def read(self, timeout: float) -> List[Tuple[Path, int]]:
+        """Wait up to timeout seconds for events, returning (path, mask)"""
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if not poller.poll(timeout * 1000):
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos + EVENT.size <= len(buf):
+            wd, mask, _, length = EVENT.unpack_from(buf, pos)
+            name = buf[pos + EVENT.size:pos + EVENT.size + length].rstrip(
+                b'\0')
+            pos += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((Path(), mask))
+                continue
+            parent = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            if parent is None:
+                continue
+            events.append((parent / os.fsdecode(name) if name else parent,
+                           mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Watcher:
+    """Yield video files under root as they finish being written.
+
+    A file becomes a candidate when it is closed after writing or moved into
+    the tree, and is yielded once its size has held still for settle
+    seconds; any further write restarts the wait, so copies which close and
+    reopen a file are not picked up half done.
+    """
+    root: Path
+    settle: float
+
+    def __init__(self, root: Path, settle: float = SETTLE_SECONDS) -> None:
+        self.root = Path(root)
+        self.settle = settle
+        self.inotify = Inotify()
+        # Candidate path -> (size last seen, when it last changed)
+        self.pending: Dict[Path, Tuple[int, float]] = {}
+
+    def watch(self, stop: Optional[threading.Event] = None) -> Iterator[Path]:
+        """Stream settled files until stop is set"""
+        stop = stop or threading.Event()
+        self._add_tree(self.root)
+        logger.info(f'Watching {len(self.inotify.watches)} directories '
+                    f'under {self.root}')
+        try:
+            while not stop.is_set():
+                for path, mask in self.inotify.read(POLL_INTERVAL):
+                    self._handle(path, mask)
+                yield from self._settled()
+        finally:
+            self.inotify.close()
+
+    def _add_tree(self, top: Path, new: bool = False) -> None:
+        """Watch top and every directory beneath it. If top is new to the
+        tree, as when a directory is moved in whole, video files already in
+        it become candidates; those there at startup are left alone"""
+        for dirpath, _, filenames in os.walk(top):
+            try:
+                self.inotify.add(Path(dirpath))
+            except OSError as err:
+                logger.warning(f'Unable to watch {dirpath}: {err}')
+            if new:
+                for name in filenames:
+                    self._touch(Path(dirpath) / name)
+
+    def _handle(self, path: Path, mask: int) -> None:
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped; only a rescan can recover them
+            logger.warning('inotify queue overflowed; rescanning '
+                           f'{self.root}')
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    self._touch(Path(dirpath) / name)
+        elif mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path, new=True)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.pending.pop(path, None)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._touch(path)
+        elif mask & IN_MODIFY and path in self.pending:
+            self._touch(path)
+
+    def _touch(self, path: Path) -> None:
+        # Dot files include partial outputs and most copy tools' temp files
+        if path.name.startswith('.') or not is_vfile(path.name):
+            return
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return
+        self.pending[path] = (size, time.monotonic())
+
+    def _settled(self) -> Iterator[Path]:
+        now = time.monotonic()
+        for path, (size, changed) in list(self.pending.items()):
+            if now - changed < self.settle:
+                continue
+            try:
+                current = path.stat().st_size
+            except OSError:
+                del self.pending[path]
+                continue
+            if current != size or not current:
+                self.pending[path] = (current, now)
+                continue
+            del self.pending[path]
+            yield path
+
+
+@click.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('-p',
+              '--preset',
+              default=DEFAULT_PRESET,
+              show_default=True,
+              help='Conversion preset as created using the HandBrake GUI.'
+              'JSON format.')
+@click.option('-f',
+              '--force',
+              is_flag=True,
+              default=False,
+              help='Optional flag to force (re)encoding of an HEVC file')
+@click.option('-j',
+              '--jobs',
+              default='1',
+              show_default=True,
+              callback=parse_jobs,
+              help='Number of encodes to run concurrently, or "auto" to size '
+              'encode slots from the core count and each source\'s '
+              'resolution')
+@click.option('--probe-jobs',
+              type=click.IntRange(min=1),
+              default=DEFAULT_PROBE_JOBS,
+              show_default=True,
+              help='Number of files to probe for metadata concurrently')
+@click.option('--settle',
+              type=click.FloatRange(min=0),
+              default=SETTLE_SECONDS,
+              show_default=True,
+              help='Seconds a new file\'s size must hold still before it is '
+              'encoded')
+def watch(directory, preset, force, jobs, probe_jobs, settle):
+    """
+    Watch a directory tree and encode video files as they arrive, once they
+    have been fully written. Runs until interrupted.
+    """
+    stop = threading.Event()
+    journal = Journal()
+
+    def classify(file, meta):
+        if meta.codec_name == 'hevc' and not force:
+            return 'already encoded in HEVC'
+        job = HandBrakeJob(file, preset=preset, meta=meta)
+        journal.mark(job, PENDING)
+        return job
+
+    def prefilter(file):
+        if journal.is_done(file, preset):
+            return 'already converted by a previous run'
+        return None
+
+    def on_signal(signum, frame):
+        logger.info('Stopping once running encodes finish')
+        stop.set()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    watcher = Watcher(Path(directory), settle=settle)
+    with MetadataCache() as cache, ProbePool(workers=probe_jobs,
+                                             cache=cache) as pool:
+        pipeline = Pipeline(pool,
+                            Scheduler(slots=jobs, journal=journal),
+                            classify,
+                            prefilter=prefilter)
+        summary = pipeline.feed(watcher.watch(stop))
+    journal.close()
+
+    click.echo(summary)
@@ -7,4 +7,87 @@
     - https://docs.pytest.org/en/stable/writing_plugins.html
 """
 
-# import pytest
+import copy
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from dlrippyr.classes import Metadata
+
+
+@pytest.fixture
+def probe_json():
+    """Trimmed ffprobe output for a 1080p AVC file, as Metadata requests it"""
+    return {
+        'streams': [{
+            'codec_name': 'h264',
+            'profile': 'High',
+            'avg_frame_rate': '24000/1001',
+            'height': 1080,
+            'width': 1920,
+        }],
+        'format': {
+            'format_name': 'matroska,webm',
+            'duration': '5400.000000',
+            'bit_rate': '10000000',
+            'size': '6750000000',
+        },
+    }
+
+
+@pytest.fixture
+def make_meta(probe_json):
+    """Factory for Metadata built from probe_json, with stream/format fields
+    overridden by keyword, without running ffprobe"""
+
+    def factory(path='a.mkv', **fields):
+        _json = copy.deepcopy(probe_json)
+        for field, value in fields.items():
+            section = 'format' if field in _json['format'] else 'streams'
+            if section == 'format':
+                _json['format'][field] = value
+            else:
+                _json['streams'][0][field] = value
+        meta = Metadata.__new__(Metadata)
+        meta.path = Path(path)
+        meta.parse_json(_json)
+        return meta
+
+    return factory
+
+
+@pytest.fixture
+def fake_ffprobe(tmp_path, monkeypatch, probe_json):
+    """Put an ffprobe on PATH which fails for any file named bad.*"""
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    exe = bindir / 'ffprobe'
+    exe.write_text('#!/bin/sh\n'
+                   'for last; do :; done\n'
+                   'case "$last" in */bad.*) echo "{}"; exit 1;; esac\n'
+                   f"echo '{json.dumps(probe_json)}'\n")
+    exe.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bindir))
+    return exe
+
+
+@pytest.fixture
+def fake_handbrake(tmp_path, monkeypatch):
+    """A HandBrakeCLI which writes 1 MiB to whatever -o names, then fails
+    for any input named bad*"""
+    bindir = tmp_path / 'hbbin'
+    bindir.mkdir()
+    exe = bindir / 'HandBrakeCLI'
+    exe.write_text('#!/bin/sh\n'
+                   'status=0\n'
+                   'while [ "$#" -gt 1 ]; do\n'
+                   '  case "$1$2" in -i*/bad*) status=2;; esac\n'
+                   '  [ "$1" = "-o" ] && head -c 1048576 /dev/zero > "$2"\n'
+                   '  shift\n'
+                   'done\n'
+                   'exit $status\n')
+    exe.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bindir}{os.pathsep}{os.environ["PATH"]}')
+    return exe
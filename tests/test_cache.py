@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+from dlrippyr.cache import MetadataCache
+from dlrippyr.classes import Metadata
+
+
+def test_cache_roundtrip(tmp_path, probe_json):
+    video = tmp_path / 'a.mkv'
+    video.write_bytes(b'x' * 10)
+
+    with MetadataCache(tmp_path / 'c.sqlite') as store:
+        assert store.get(video) is None
+        store.put(video, probe_json)
+        assert store.get(video) == probe_json
+
+
+def test_cache_invalidated_on_change(tmp_path, probe_json):
+    video = tmp_path / 'a.mkv'
+    video.write_bytes(b'x' * 10)
+
+    with MetadataCache(tmp_path / 'c.sqlite') as store:
+        store.put(video, probe_json)
+        video.write_bytes(b'x' * 20)
+        assert store.get(video) is None
+        assert store.prune() == 1
+        assert len(store) == 0
+
+
+def test_cache_rebuild_and_trim(tmp_path, probe_json):
+    videos = []
+    for i in range(3):
+        videos.append(tmp_path / f'{i}.mkv')
+        videos[-1].write_bytes(b'x')
+
+    with MetadataCache(tmp_path / 'c.sqlite') as store:
+        for video in videos:
+            store.put(video, probe_json)
+        assert store.trim(2) == 1
+        assert len(store) == 2
+
+    with MetadataCache(tmp_path / 'c.sqlite', rebuild=True) as store:
+        assert all(store.get(video) is None for video in videos)
+
+
+def test_metadata_served_from_cache(tmp_path, monkeypatch, probe_json):
+    """No ffprobe is spawned for a file the cache already knows"""
+    video = tmp_path / 'a.mkv'
+    video.write_bytes(b'x')
+    monkeypatch.setenv('PATH', '')
+
+    with MetadataCache(tmp_path / 'c.sqlite') as store:
+        store.put(video, probe_json)
+        meta = Metadata(video, cache=store)
+
+    assert meta.codec_name == 'h264'
+    assert meta.height == 1080
+    assert meta.bit_rate == 10
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from dlrippyr import chunked
+from dlrippyr.classes import SampleJob
+from dlrippyr.runner import Progress
+
+
+def test_split_points_snap_to_keyframes():
+    frames = [0.0, 9.5, 19.0, 31.0, 40.0]
+
+    assert chunked.split_points(frames, 40.0, 4) == [0.0, 9.5, 19.0, 31.0]
+    # Cuts never repeat when keyframes are sparse
+    assert chunked.split_points([0.0, 35.0], 40.0, 4) == [0.0, 35.0]
+
+
+def test_chunks_for(make_meta):
+    meta = make_meta(duration='1000')
+
+    assert chunked.chunks_for(meta, 8) == 3
+    assert chunked.chunks_for(make_meta(duration='60'), 8) == 1
+
+
+def test_verify(monkeypatch):
+    probes = {
+        'src': {'format': 100.0, 'video': 100.0, 'audio': 100.02},
+        'good': {'format': 100.3, 'video': 100.3, 'audio': 100.35},
+        'short': {'format': 95.0, 'video': 95.0, 'audio': 95.0},
+        'drift': {'format': 100.0, 'video': 100.0, 'audio': 100.9},
+    }
+    monkeypatch.setattr(chunked, 'probe_durations',
+                        lambda path: probes[Path(path).name])
+
+    assert chunked.verify(Path('src'), Path('good'), 4)[0]
+    assert not chunked.verify(Path('src'), Path('short'), 4)[0]
+    assert 'drift' in chunked.verify(Path('src'), Path('drift'), 4)[1]
+
+
+def test_progress_combines_segments(make_meta):
+    job = chunked.ChunkedJob(Path('film.mkv'),
+                             preset='conf/x265.json',
+                             chunks=2,
+                             meta=make_meta(duration='100'))
+    segments = [
+        SampleJob(job.input,
+                  preset=job.preset,
+                  output=Path(f'{i}.mp4'),
+                  start_tm=start,
+                  end_tm=end,
+                  meta=job.meta)
+        for i, (start, end) in enumerate([(0, 25), (25, 101)])
+    ]
+    seen = []
+    update = job._combine(segments, lambda j, progress: seen.append(progress))
+
+    update(segments[0], Progress('WORKING', percent=100, fps=10))
+    update(segments[1], Progress('WORKING', percent=50, fps=20))
+    assert seen[-1].percent == pytest.approx(62.5)
+    assert seen[-1].fps == 30
+    assert job.progress is seen[-1]
+
+
+def test_keyframes_read_only_near_cuts(tmp_path, monkeypatch):
+    calls = []
+
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(
+            cmd, 0, stdout=b'45.0,K_\n46.0,__\n95.5,K_\n45.0,K_\n')
+
+    monkeypatch.setattr(subprocess, 'run', run)
+
+    assert chunked.keyframes(Path('film.mkv'), [50.0, 100.0],
+                             window=10) == [45.0, 95.5]
+    cmd = calls[0]
+    assert cmd[cmd.index('-read_intervals') + 1] == (
+        '40.000%+20.000,90.000%+20.000')
+    assert chunked.keyframes(Path('film.mkv'), []) == []
+
+
+def test_failed_segment_is_recorded(tmp_path, fake_handbrake, make_meta,
+                                    monkeypatch):
+    monkeypatch.setattr(chunked, 'keyframes', lambda path, around: around)
+    job = chunked.ChunkedJob(tmp_path / 'bad.mkv',
+                             preset=str(tmp_path / 'x265.json'),
+                             output=tmp_path / 'bad.mp4',
+                             chunks=2,
+                             meta=make_meta(tmp_path / 'bad.mkv',
+                                            duration='1000'))
+    recorded = []
+    monkeypatch.setattr(job, 'record',
+                        lambda returncode, elapsed: recorded.append(returncode))
+
+    assert job.run_handbrake() == 1
+    assert recorded == [1]
+    assert not job.segdir.exists()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import os
+import subprocess
+import sys
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from dlrippyr.cli import SUBCOMMANDS, cli
+
+# Slow to import, and not needed just to print help or probe a cached file
+HEAVY = ['loguru', 'asyncio', 'subprocess']
+# Not needed until a subcommand runs: NumPy, and the SQLite-backed stores
+DEFERRED = [
+    'numpy', 'sqlite3', 'dlrippyr.cache', 'dlrippyr.history',
+    'dlrippyr.index', 'dlrippyr.journal', 'dlrippyr.convert', 'dlrippyr.info'
+]
+
+
+def run_python(code: str) -> str:
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    return subprocess.run([sys.executable, '-c', code],
+                          env=env,
+                          stdout=subprocess.PIPE,
+                          check=True,
+                          text=True).stdout
+
+
+def test_help_lists_subcommands_without_importing_them():
+    output = run_python('import sys\n'
+                        'from dlrippyr.cli import cli\n'
+                        'try:\n'
+                        '    cli(["--help"])\n'
+                        'except SystemExit:\n'
+                        '    pass\n'
+                        'print("--", *sorted(sys.modules))\n')
+    shown, loaded = output.split('\n-- ')
+    listed = [line.split(None, 1) for line in shown.splitlines()]
+    for name, (_, short_help) in SUBCOMMANDS.items():
+        assert [name, short_help] in listed
+    loaded = loaded.split()
+    for module in HEAVY + DEFERRED:
+        assert module not in loaded
+
+
+@pytest.mark.parametrize('command, heavy', [
+    ('info', HEAVY + ['numpy']),
+    # NumPy is only for --verify sampled/full
+    ('convert', ['numpy']),
+])
+def test_command_imports_stay_light(command, heavy):
+    loaded = run_python('import sys\n'
+                        f'import dlrippyr.{command}\n'
+                        'print(*sorted(sys.modules))\n').split()
+    for module in heavy:
+        assert module not in loaded
+
+
+@pytest.mark.parametrize('name', sorted(SUBCOMMANDS))
+def test_subcommands_load(name):
+    command = cli.get_command(click.Context(cli), name)
+    assert isinstance(command, click.Command)
+    assert command.name == name
+    result = CliRunner().invoke(cli, [name, '--help'])
+    assert result.exit_code == 0, result.output
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch, fake_ffprobe):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.setenv('XDG_STATE_HOME', str(tmp_path / 'state'))
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / 'film.mkv'
+    source.write_bytes(b'\0' * 1024)
+    return source
+
+
+@pytest.mark.parametrize('rehearsal', ['--dry-run', '--plan'])
+def test_resume_rehearsal(library, rehearsal):
+    result = CliRunner().invoke(
+        cli, ['convert', '--resume', rehearsal, '-p', 'conf/x265.json',
+              str(library)])
+    assert result.exit_code == 0, result.output
+
+
+def test_changed_only_keeps_unencoded_files(library):
+    convert = ['convert', '--changed-only', '--min-size', '1000000', '-p',
+               'conf/x265.json', str(library.parent)]
+    first = CliRunner().invoke(cli, convert)
+    assert '1 added' in first.output, first.output
+    # info keeps an index of its own, so doesn't use up convert's changes
+    CliRunner().invoke(cli, ['info', '--changed-only', str(library.parent)])
+    # A policy skip isn't settled, so the file comes round again
+    again = CliRunner().invoke(cli, convert)
+    assert '1 added' in again.output, again.output
+
+
+def test_log_setup_hides_debug():
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    logged = subprocess.run([
+        sys.executable, '-c', 'from dlrippyr import log\n'
+        'log.setup()\n'
+        'log.logger.debug("handbrake chatter")\n'
+        'log.logger.info("encoding")\n'
+    ],
+                            env=env,
+                            stderr=subprocess.PIPE,
+                            check=True,
+                            text=True).stderr
+    assert 'encoding' in logged
+    assert 'handbrake chatter' not in logged
+
+
+def test_log_first_use_from_many_threads():
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    logged = subprocess.run([
+        sys.executable, '-c', 'import threading\n'
+        'from dlrippyr import log\n'
+        'log.setup()\n'
+        'barrier = threading.Barrier(8)\n'
+        'def first():\n'
+        '    barrier.wait()\n'
+        '    log.logger.info("started")\n'
+        'threads = [threading.Thread(target=first) for _ in range(8)]\n'
+        'for thread in threads: thread.start()\n'
+        'for thread in threads: thread.join()\n'
+    ],
+                            env=env,
+                            stderr=subprocess.PIPE,
+                            check=True,
+                            text=True).stderr
+    # One sink, so each line once
+    assert logged.count('started') == 8, logged
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import struct
+
+import pytest
+
+from dlrippyr.classes import Metadata
+from dlrippyr.container import parse_header
+
+
+def box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def mp4(fourcc=b'hvc1', config=b'hvcC', moov_last=True) -> bytes:
+    """An MP4 with one 60.06s, 1280x720 video track at 24000/1001 fps"""
+    mvhd = box(b'mvhd', struct.pack('>IIIII', 0, 0, 0, 1000, 60060) +
+               bytes(80))
+    hdlr = box(b'hdlr', bytes(8) + b'vide' + bytes(13))
+    mdhd = box(b'mdhd', struct.pack('>IIIII', 0, 0, 0, 24000, 1441440) +
+               bytes(4))
+    entry = box(fourcc,
+                bytes(24) + struct.pack('>HH', 1280, 720) + bytes(50) +
+                box(config, b'\x01\x01' + bytes(20)))
+    stsd = box(b'stsd', struct.pack('>II', 0, 1) + entry)
+    stts = box(b'stts', struct.pack('>IIII', 0, 1, 1440, 1001))
+    stbl = box(b'stbl', stsd + stts)
+    trak = box(b'trak', box(b'mdia', hdlr + mdhd + box(b'minf', stbl)))
+    moov = box(b'moov', mvhd + trak)
+    ftyp = box(b'ftyp', b'isom' + bytes(4) + b'isom')
+    mdat = box(b'mdat', bytes(4096))
+    return ftyp + mdat + moov if moov_last else ftyp + moov + mdat
+
+
+def element(ident: bytes, data: bytes) -> bytes:
+    return ident + b'\x01' + len(data).to_bytes(7, 'big') + data
+
+
+def mkv(tracks_after_cluster=False) -> bytes:
+    """A Matroska file with one 60s, 1920x1080 AVC track at 24000/1001 fps"""
+    header = element(b'\x1a\x45\xdf\xa3', element(b'\x42\x82', b'matroska'))
+    info = element(
+        b'\x15\x49\xa9\x66',
+        element(b'\x2a\xd7\xb1', (1000000).to_bytes(3, 'big')) +
+        element(b'\x44\x89', struct.pack('>d', 60000.0)))
+    video = element(b'\xe0', element(b'\xb0', (1920).to_bytes(2, 'big')) +
+                    element(b'\xba', (1080).to_bytes(2, 'big')))
+    tracks = element(
+        b'\x16\x54\xae\x6b',
+        element(
+            b'\xae',
+            element(b'\x83', b'\x01') + element(b'\x86', b'V_MPEG4/ISO/AVC') +
+            element(b'\x63\xa2', b'\x01\x64\x00\x28') +
+            element(b'\x23\xe3\x83', (41708333).to_bytes(4, 'big')) + video))
+    cluster = element(b'\x1f\x43\xb6\x75', bytes(4096))
+
+    if not tracks_after_cluster:
+        return header + element(b'\x18\x53\x80\x67', info + tracks + cluster)
+
+    def seekhead(position: int) -> bytes:
+        seek = element(b'\x53\xab', b'\x16\x54\xae\x6b') + element(
+            b'\x53\xac', position.to_bytes(8, 'big'))
+        return element(b'\x11\x4d\x9b\x74', element(b'\x4d\xbb', seek))
+
+    position = len(seekhead(0) + info + cluster)
+    return header + element(b'\x18\x53\x80\x67', seekhead(position) + info +
+                            cluster + tracks)
+
+
+@pytest.mark.parametrize('moov_last', [True, False])
+def test_mp4_header(tmp_path, moov_last):
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(mp4(moov_last=moov_last))
+
+    _json = parse_header(video)
+    assert _json['streams'][0] == {
+        'codec_name': 'hevc',
+        'profile': 'Main',
+        'avg_frame_rate': '24000/1001',
+        'height': 720,
+        'width': 1280,
+    }
+    assert float(_json['format']['duration']) == pytest.approx(60.06)
+    assert _json['format']['size'] == str(video.stat().st_size)
+
+
+@pytest.mark.parametrize('tracks_after_cluster', [False, True])
+def test_mkv_header(tmp_path, tracks_after_cluster):
+    video = tmp_path / 'a.mkv'
+    video.write_bytes(mkv(tracks_after_cluster))
+
+    _json = parse_header(video)
+    assert _json['streams'][0] == {
+        'codec_name': 'h264',
+        'profile': 'High',
+        'avg_frame_rate': '24000/1001',
+        'height': 1080,
+        'width': 1920,
+    }
+    assert _json['format']['duration'] == '60.000000'
+
+
+def test_unparseable_headers(tmp_path):
+    unknown = tmp_path / 'a.mp4'
+    unknown.write_bytes(mp4(fourcc=b'encv'))
+    truncated = tmp_path / 'b.mkv'
+    truncated.write_bytes(mkv()[:60])
+    avi = tmp_path / 'c.avi'
+    avi.write_bytes(b'RIFF' + bytes(100))
+
+    for video in (unknown, truncated, avi, tmp_path / 'missing.mkv'):
+        assert parse_header(video) is None
+
+
+def test_metadata_without_ffprobe(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    video = tmp_path / 'a.mkv'
+
+    # Nothing is read until a field is wanted
+    meta = Metadata(video, lazy=True)
+    video.write_bytes(mkv())
+    assert meta.codec_name == 'h264'
+    assert meta.frames == pytest.approx(60 * 24000 / 1001)
+    assert not hasattr(meta, '__dict__')
+
+
+def test_metadata_falls_back_to_ffprobe(tmp_path, fake_ffprobe):
+    video = tmp_path / 'a.avi'
+    video.write_bytes(b'RIFF' + bytes(100))
+    assert Metadata(video).codec_name == 'h264'
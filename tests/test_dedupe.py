@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import os
+from pathlib import Path
+
+import pytest
+
+from dlrippyr import dedupe
+from dlrippyr.dedupe import Deduper
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe, 'BLOCK_SIZE', 16)
+    data = os.urandom(4096)
+    for name in ('a/film.mkv', 'b/film.mkv'):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(data)
+    os.link(tmp_path / 'b/film.mkv', tmp_path / 'b/link.mkv')
+    # Same size and the same head, middle and tail blocks, but not a copy
+    (tmp_path / 'near.mkv').write_bytes(data[:100] + b'x' + data[101:])
+    (tmp_path / 'other.mkv').write_bytes(os.urandom(4096))
+    return tmp_path
+
+
+def test_skips_copies_and_hard_links(library):
+    dedup = Deduper()
+    reasons = {
+        name: dedup(library / name)
+        for name in ('a/film.mkv', 'near.mkv', 'b/film.mkv', 'b/link.mkv',
+                     'other.mkv')
+    }
+    original = library / 'a/film.mkv'
+    assert reasons == {
+        'a/film.mkv': None,
+        'near.mkv': None,
+        'b/film.mkv': f'duplicates of {original}',
+        'b/link.mkv': f'duplicates of {original}',
+        'other.mkv': None,
+    }
+
+
+def test_hard_link_to_original(library):
+    dedup = Deduper()
+    assert dedup(library / 'b/film.mkv') is None
+    assert dedup(library / 'b/link.mkv') == (
+        f'hard links to {library / "b/film.mkv"}')
+
+
+def test_links_outputs(library, monkeypatch):
+    monkeypatch.chdir(library)
+    dedup = Deduper()
+    for name in ('a/film.mkv', 'b/link.mkv', 'b/film.mkv'):
+        dedup(library / name)
+    encoded = library / 'film_x265.mp4'
+    encoded.write_bytes(b'encoded')
+
+    made = dedup.link({library / 'a/film.mkv': encoded})
+    # b/film.mkv would be encoded to the very same name, so has no link
+    assert made == [(Path('link_x265.mp4'), encoded)]
+    assert os.path.samefile('link_x265.mp4', encoded)
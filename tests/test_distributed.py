@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+import socket
+import socketserver
+import threading
+
+import pytest
+
+from dlrippyr.classes import HandBrakeJob
+from dlrippyr.distributed import (Coordinator, RemoteJob, Worker, receive,
+                                  send)
+
+
+def make_jobs(tmp_path, count):
+    """Jobs for the fake HandBrakeCLI, every fourth of which fails"""
+    return [
+        HandBrakeJob(tmp_path / (f'{i}.mkv' if i % 4 else f'bad{i}.mkv'),
+                     preset=str(tmp_path / 'x265.json'),
+                     output=tmp_path / f'{i}.mp4') for i in range(count)
+    ]
+
+
+def start_workers(address, count):
+    ran = []
+    threads = [
+        threading.Thread(target=lambda i=i: ran.append(
+            Worker(address, name=f'w{i}', poll_interval=0.01).run()))
+        for i in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads, ran
+
+
+def test_jobs_shared_between_workers(tmp_path, fake_handbrake):
+    coordinator = Coordinator(('localhost', 0))
+    threads, ran = start_workers(coordinator.address, 3)
+
+    summary = coordinator.run(make_jobs(tmp_path, 12))
+    for thread in threads:
+        thread.join()
+
+    assert len(summary.results) == sum(ran) == 12
+    assert len(summary.failed) == 3
+    assert len(list(tmp_path.glob('*.mp4'))) == 9
+
+
+def test_silent_worker_is_requeued(tmp_path, fake_handbrake):
+    coordinator = Coordinator(str(tmp_path / 'sock'), lease_timeout=0.2)
+    jobs = make_jobs(tmp_path, 1)
+    result = []
+    feeder = threading.Thread(
+        target=lambda: result.append(coordinator.run(jobs)), daemon=True)
+    feeder.start()
+
+    # A worker which takes the job, then hangs
+    hung = socket.socket(socket.AF_UNIX)
+    hung.connect(coordinator.address)
+    stream = hung.makefile('rwb')
+    send(stream, type='hello', worker='hung')
+    message = {'type': 'wait'}
+    while message['type'] == 'wait':
+        send(stream, type='request')
+        message = receive(stream)
+    assert message['type'] == 'job'
+
+    threads, ran = start_workers(coordinator.address, 1)
+    feeder.join(timeout=10)
+    for thread in threads:
+        thread.join()
+    hung.close()
+
+    assert ran == [1]
+    assert len(result[0].results) == 1
+
+
+def test_stale_lease_is_ignored(tmp_path):
+    coordinator = Coordinator(('localhost', 0), lease_timeout=60)
+    job = HandBrakeJob(tmp_path / 'a.mkv',
+                       preset=str(tmp_path / 'x265.json'),
+                       output=tmp_path / 'a.mp4')
+    coordinator._queue.append((0, job))
+    first = coordinator.lease('w1')
+    with coordinator._cond:
+        coordinator._requeue(0)
+    second = coordinator.lease('w2')
+
+    # Each lease writes to a partial output of its own, and only the
+    # current one may move it into place
+    assert RemoteJob.from_message(first).partial != RemoteJob.from_message(
+        second).partial
+    assert not coordinator.confirm(0, first['lease'])
+    assert coordinator.confirm(0, second['lease'])
+    coordinator.complete(0, first['lease'], 0)
+    assert coordinator._results == []
+    coordinator.complete(0, second['lease'], 0)
+    assert len(coordinator._results) == 1
+    coordinator._server.server_close()
+    # The stdlib's server classes are left as they were
+    assert not socketserver.ThreadingTCPServer.daemon_threads
+
+
+def test_lease_carries_fields_not_a_command(tmp_path):
+    coordinator = Coordinator(('localhost', 0))
+    job = HandBrakeJob(tmp_path / 'a.mkv',
+                       preset=str(tmp_path / 'x265.json'),
+                       output=tmp_path / 'a.mp4')
+    coordinator._queue.append((0, job))
+    message = coordinator.lease('w1')
+    coordinator._server.server_close()
+
+    assert 'cmd' not in message
+    cmd = RemoteJob.from_message(message).cmd
+    assert cmd[:4] == ['nice', '-n', '10', 'HandBrakeCLI']
+    assert cmd[cmd.index('-i') + 1] == str(tmp_path / 'a.mkv')
+
+    for bad in ({'input': 'a.mkv'}, {'preset': ['sh', '-c']},
+                {'lease': '../x'}, {'start': '0; rm', 'end': 10}):
+        with pytest.raises(ValueError):
+            RemoteJob.from_message({**message, **bad})
+
+
+def test_expired_lease_keeps_its_output_out(tmp_path, fake_handbrake):
+    output = tmp_path / 'a.mp4'
+    output.write_bytes(b'newer encode')
+    job = RemoteJob(tmp_path / 'a.mkv',
+                    output,
+                    str(tmp_path / 'x265.json'),
+                    'lease0',
+                    confirm=lambda: False)
+
+    assert job.run_handbrake() == 0
+    assert output.read_bytes() == b'newer encode'
+    assert not job.partial.exists()
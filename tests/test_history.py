@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import pytest
+
+from dlrippyr.classes import HandBrakeJob
+from dlrippyr.history import History, Plan
+from dlrippyr.scheduler import JobResult
+
+
+@pytest.fixture
+def history(tmp_path):
+    with History(tmp_path / 'history.sqlite') as store:
+        yield store
+
+
+def finished(tmp_path, meta, seconds, outsize, preset='conf/x265.json'):
+    output = tmp_path / f'{meta.path}.out'
+    output.write_bytes(b'x' * outsize)
+    job = HandBrakeJob(meta.path, preset=preset, output=output, meta=meta)
+    return JobResult(job, returncode=0, elapsed=seconds)
+
+
+def test_falls_back_to_the_model(tmp_path, history, make_meta):
+    meta = make_meta('a.mkv')
+    history.record(finished(tmp_path, meta, 100.0, 1000))
+    estimate = history.estimate(
+        HandBrakeJob(meta.path, preset='conf/x265.json', meta=meta))
+    assert not estimate.from_history
+    assert estimate.wall_seconds > 0
+
+
+def test_predicts_from_similar_encodes(tmp_path, history, make_meta):
+    # Half-hour 1080p encodes which ran at 100s and came out at 1000 bytes,
+    # apart from one which shared the box and took far longer
+    for i, seconds in enumerate((100.0, 100.0, 100.0, 5000.0)):
+        meta = make_meta(f'{i}.mkv', duration='1800.0')
+        history.record(finished(tmp_path, meta, seconds, 1000))
+    # Different resolution, preset and failures don't count
+    history.record(
+        finished(tmp_path, make_meta('sd.mkv', height=480), 1.0, 10))
+    history.record(
+        finished(tmp_path, make_meta('p.mkv'), 1.0, 10, preset='conf/y.json'))
+    failed = finished(tmp_path, make_meta('f.mkv'), 1.0, 10)
+    failed.returncode = 1
+    history.record(failed)
+
+    # Twice as long a source should take twice as long, twice the size
+    meta = make_meta('new.mkv', duration='3600.0', height=1036)
+    job = HandBrakeJob(meta.path, preset='conf/x265.json', meta=meta)
+    estimate = history.estimate(job)
+    assert estimate.from_history
+    assert estimate.wall_seconds == pytest.approx(200.0 * 1036 / 1080)
+    assert estimate.output_bytes == pytest.approx(2000 * 1036 / 1080)
+
+    plan = Plan(history, slots=2)
+    assert list(plan([job, job])) == []
+    assert plan.files == plan.from_history == 2
+    assert plan.wall_seconds == pytest.approx(2 * estimate.wall_seconds)
+    assert 'across 2 slots' in str(plan)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import shutil
+
+import pytest
+
+from dlrippyr import index
+from dlrippyr.index import ScanIndex
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    # Trust mtimes however recent, as the tree is built moments before
+    monkeypatch.setattr(index, 'RACY_NS', 0)
+    lib = tmp_path / 'lib'
+    for name in ('a/1.mkv', 'a/2.mp4', 'b/3.mkv', 'b/deep/4.avi', 'c/x.txt'):
+        (lib / name).parent.mkdir(parents=True, exist_ok=True)
+        (lib / name).write_bytes(b'x')
+    return lib
+
+
+def names(paths):
+    return sorted(path.name for path in paths)
+
+
+def test_rescan_lists_only_changed_dirs(tmp_path, library):
+    db = tmp_path / 'index.sqlite'
+    with ScanIndex(db) as store:
+        diff = store.scan([str(library)])
+        assert names(diff.added) == ['1.mkv', '2.mp4', '3.mkv', '4.avi']
+        store.commit()
+
+    with ScanIndex(db) as store:
+        diff = store.scan([str(library)])
+        assert diff.changed == diff.removed == []
+        assert (diff.listed, diff.skipped) == (0, 5)
+
+    (library / 'a' / '1.mkv').write_bytes(b'xx')
+    (library / 'a' / 'new.mkv').write_bytes(b'x')
+    shutil.rmtree(library / 'b')
+    with ScanIndex(db) as store:
+        diff = store.scan([str(library)])
+        assert names(diff.added) == ['new.mkv']
+        assert names(diff.modified) == ['1.mkv']
+        assert names(diff.removed) == ['3.mkv', '4.avi']
+        assert diff.listed == 2
+        # Not committed, so the next scan sees the same again
+    with ScanIndex(db) as store:
+        diff = store.scan([str(library)])
+        assert names(diff.changed) == ['1.mkv', 'new.mkv']
+        store.forget(library / 'a' / 'new.mkv')
+        store.commit()
+
+    # A forgotten file, as after a failed encode, comes round again
+    with ScanIndex(db) as store:
+        assert names(store.scan([str(library)]).added) == ['new.mkv']
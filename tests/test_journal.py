@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+from dlrippyr.classes import HandBrakeJob, partial_name, segment_dir
+from dlrippyr.journal import DONE, RUNNING, Journal
+
+PRESET = 'conf/x265-1080p-mkv.json'
+
+
+def make_job(tmp_path):
+    src = tmp_path / 'a.mkv'
+    src.write_bytes(b'x' * 10)
+    return HandBrakeJob(src, preset=PRESET, output=tmp_path / 'a.mp4')
+
+
+def test_done_survives_until_input_changes(tmp_path):
+    job = make_job(tmp_path)
+    job.output.touch()
+
+    with Journal(tmp_path / 'j.sqlite') as journal:
+        assert not journal.is_done(job.input, PRESET)
+        journal.mark(job, DONE)
+        assert journal.is_done(job.input, PRESET)
+        assert not journal.is_done(job.input, 'conf/other.json')
+
+        job.input.write_bytes(b'y' * 20)
+        assert not journal.is_done(job.input, PRESET)
+
+
+def test_done_needs_output(tmp_path):
+    job = make_job(tmp_path)
+
+    with Journal(tmp_path / 'j.sqlite') as journal:
+        journal.mark(job, DONE)
+        assert not journal.is_done(job.input, PRESET)
+
+
+def test_recover_removes_partials(tmp_path):
+    job = make_job(tmp_path)
+    partial_name(job.output).touch()
+
+    with Journal(tmp_path / 'j.sqlite') as journal:
+        journal.mark(job, RUNNING)
+        assert journal.recover() == [partial_name(job.output)]
+        assert not partial_name(job.output).exists()
+
+
+def test_recover_removes_segment_dirs(tmp_path):
+    job = make_job(tmp_path)
+    segment_dir(job.output).mkdir()
+    (segment_dir(job.output) / 'segment000.mp4').touch()
+
+    with Journal(tmp_path / 'j.sqlite') as journal:
+        journal.mark(job, RUNNING)
+        assert journal.recover() == [segment_dir(job.output)]
+        assert not segment_dir(job.output).exists()
+
+
+def test_output_written_atomically(tmp_path):
+    job = make_job(tmp_path)
+    assert job.cmd[-1] == str(partial_name(job.output))
+
+    partial_name(job.output).touch()
+    job.finalise(1)
+    assert not partial_name(job.output).exists()
+    assert not job.output.exists()
+
+    partial_name(job.output).touch()
+    job.finalise(0)
+    assert job.output.exists()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import json
+
+import pytest
+
+from dlrippyr import classes, utils
+from dlrippyr.classes import HandBrakeJob, Metadata, partial_name
+from dlrippyr.metrics import Metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """A fresh registry in place of the process-wide one"""
+    fresh = Metrics()
+    monkeypatch.setattr(utils, 'metrics', fresh)
+    monkeypatch.setattr(classes, 'metrics', fresh)
+    yield fresh
+    fresh.close()
+
+
+def test_render_histogram_is_cumulative():
+    registry = Metrics()
+    for value in (0.02, 0.2, 40):
+        registry.observe('probe', value, buckets=(0.1, 1))
+    registry.inc('files', 3, job='x')
+
+    text = registry.render()
+    assert 'files{job="x"} 3' in text
+    assert 'probe_bucket{le="0.1"} 1' in text
+    assert 'probe_bucket{le="1"} 2' in text
+    assert 'probe_bucket{le="+Inf"} 3' in text
+    assert 'probe_count 3' in text
+
+
+def test_event_log_and_textfile(tmp_path):
+    registry = Metrics()
+    registry.configure(events=tmp_path / 'events.jsonl',
+                       textfile=tmp_path / 'dlrippyr.prom')
+    registry.inc('dlrippyr_files_scanned_total', 2)
+    registry.event('scan', files=2)
+    registry.close()
+
+    [line] = (tmp_path / 'events.jsonl').read_text().splitlines()
+    record = json.loads(line)
+    assert record['event'] == 'scan' and record['files'] == 2
+    assert 'host' in record
+    prom = (tmp_path / 'dlrippyr.prom').read_text()
+    assert '# TYPE dlrippyr_files_scanned_total counter' in prom
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'dlrippyr.prom', 'events.jsonl'
+    ]
+
+
+def test_stages_are_instrumented(tmp_path, registry, fake_ffprobe):
+    for name in ('a.mkv', 'b.mp4', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'x' * 100)
+    assert len(list(utils.find_vfiles(str(tmp_path)))) == 2
+    Metadata(tmp_path / 'a.mkv')
+
+    out = tmp_path / 'a_x265.mp4'
+    job = HandBrakeJob(tmp_path / 'a.mkv',
+                       preset='conf/x265-1080p-mkv.json',
+                       output=out)
+    job.cmd = ['/bin/sh', '-c', f'printf %25s > {partial_name(out)}']
+    assert job.run_handbrake() == 0
+
+    text = registry.render()
+    assert 'dlrippyr_files_scanned_total 2' in text
+    assert 'dlrippyr_probe_seconds_count 1' in text
+    assert ('dlrippyr_encodes_total{job="HandBrakeJob",status="ok"} 1'
+            in text)
+    assert 'dlrippyr_encode_ratio_sum{job="HandBrakeJob"} 0.25' in text
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+import time
+from pathlib import Path
+
+from dlrippyr.classes import BasicJob
+from dlrippyr.pipeline import Pipeline
+from dlrippyr.probe import ProbePool
+from dlrippyr.scheduler import Scheduler
+
+
+class CountingJob(BasicJob):
+    started = 0
+
+    def __init__(self, input: Path) -> None:
+        super().__init__(input)
+
+    def run_handbrake(self, on_progress=None) -> int:
+        CountingJob.started += 1
+        time.sleep(0.01)
+        return 0
+
+
+def test_pipeline_streams_with_back_pressure(tmp_path, fake_ffprobe):
+    lib = tmp_path / 'lib'
+    lib.mkdir()
+    for i in range(30):
+        (lib / f'{i:02d}.mkv').touch()
+    CountingJob.started = 0
+    made = []
+    lead = []
+    skips = []
+
+    def classify(path, meta):
+        if int(path.stem) % 3 == 0:
+            return 'divisible by three'
+        made.append(path)
+        lead.append(len(made) - CountingJob.started)
+        return CountingJob(path)
+
+    with ProbePool(workers=2) as pool:
+        pipeline = Pipeline(pool,
+                            Scheduler(slots=1),
+                            classify,
+                            on_skip=lambda path, reason: skips.append(path),
+                            job_queue_size=2)
+        summary = pipeline.run([str(lib)])
+
+    assert len(summary.succeeded) == 20
+    assert len(skips) == 10
+    # Probing never gets more than a queue's worth ahead of encoding, give
+    # or take a job blocked on a full queue, one waiting on a free slot and
+    # one submitted but not yet started
+    assert max(lead) <= 2 + 3
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+import json
+
+from dlrippyr.policy import Policy, fit_scale, preset_size
+
+PRESET = 'conf/x265-1080p-mkv.json'
+
+
+def test_preset_size(tmp_path):
+    assert preset_size(PRESET) == (1920, 1080)
+    unsized = tmp_path / 'unsized.json'
+    unsized.write_text(json.dumps({'PresetList': [{'PictureWidth': 0}]}))
+    assert preset_size(str(unsized)) is None
+    assert preset_size(str(tmp_path / 'missing.json')) is None
+
+
+def test_policy_rules(make_meta):
+    policy = Policy.from_options(PRESET, bpp=0.05, size=100, upscale=False)
+    # 10 Mb/s 1080p at 23.976 fps is ~0.2 bpp
+    assert policy(make_meta()) is None
+    assert policy(make_meta(bit_rate='1500000')) == (
+        'below 0.05 bits per pixel per frame')
+    assert policy(make_meta(size=str(50 * 1024**2))) == 'smaller than 100 MiB'
+    assert 'upscaled' in policy(make_meta(width=1280, height=720))
+    # Frame rate unknown, so bits per pixel can't be judged
+    assert policy(make_meta(bit_rate='1500000', avg_frame_rate='0/0')) is None
+
+
+def test_default_policy_skips_nothing(make_meta):
+    policy = Policy.from_options(PRESET)
+    assert policy(make_meta(bit_rate='1500000')) is None
+
+
+def test_zero_thresholds_disable_rules(make_meta):
+    policy = Policy.from_options(PRESET, bpp=0, size=0, upscale=True)
+    assert policy.rules == []
+    assert policy(make_meta(bit_rate='1000', width=640, height=480)) is None
+
+
+def test_upscale_fits_within_preset_size(make_meta):
+    policy = Policy.from_options(PRESET, bpp=0, size=0, upscale=False)
+    # Letterboxed scope and pillarboxed 4:3 sources already fill one side
+    assert policy(make_meta(width=1920, height=800)) is None
+    assert policy(make_meta(width=1440, height=1080)) is None
+    assert 'upscaled' in policy(make_meta(width=1280, height=534))
+    assert fit_scale(1280, 534, 1920, 1080) == 1.5
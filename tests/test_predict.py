@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+from pathlib import Path
+
+import pytest
+
+from dlrippyr.classes import SampleJob
+from dlrippyr.predict import Predictor, sample_windows
+from dlrippyr.scheduler import Scheduler
+
+
+def test_sample_windows_spread():
+    windows = sample_windows(1000, 4, 10)
+
+    assert windows[0] == (50, 60)
+    assert windows[-1] == (940, 950)
+    assert len(windows) == 4
+    assert sample_windows(60, 4, 10) == []
+
+
+def test_sample_cmd_stop_is_a_duration():
+    job = SampleJob(Path('a.mkv'), preset='conf/x.json', start_tm=30,
+                    end_tm=45)
+
+    assert job.cmd[job.cmd.index('--stop-at') + 1] == 'seconds:15'
+
+
+def test_predictor_extrapolates(tmp_path, fake_handbrake, make_meta):
+    # 5400 s of source at 6750000000 bytes; four 10 s samples of 1 MiB each
+    meta = make_meta(tmp_path / 'a.mkv')
+    prediction = Predictor('conf/x265-1080p-mkv.json',
+                           workdir=tmp_path).predict(meta)
+
+    assert prediction.output_bytes == pytest.approx(1024**2 * 5400 / 10)
+    assert prediction.saving == pytest.approx(
+        100 * (1 - 1024**2 * 540 / 6750000000))
+    assert not list(tmp_path.glob('dlrippyr-predict-*'))
+
+
+def test_samples_share_the_encode_budget(tmp_path, fake_handbrake,
+                                         make_meta):
+    budget = Scheduler(slots=2)
+    meta = make_meta(tmp_path / 'a.mkv')
+    with budget.reserve(SampleJob(meta.path, preset='conf/x265.json'),
+                        4) as slots:
+        # Four samples are squeezed into the two slots there are
+        assert slots == 2
+    prediction = Predictor('conf/x265-1080p-mkv.json',
+                           workdir=tmp_path,
+                           budget=budget).predict(meta)
+
+    assert prediction.output_bytes == pytest.approx(1024**2 * 5400 / 10)
+    assert budget.limit == budget._free == 2
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+from dlrippyr.classes import HandBrakeJob
+from dlrippyr.priority import (BUDGET_SKIP, Prioritiser, estimate_cpu_seconds,
+                               estimate_savings)
+
+
+def make_job(meta):
+    return HandBrakeJob(meta.path, preset='conf/x.json', meta=meta)
+
+
+def test_estimates(make_meta):
+    fat = make_meta(bit_rate='20000000', size='13500000000')
+    lean = make_meta(bit_rate='4000000', size='2700000000')
+
+    assert estimate_savings(fat) > estimate_savings(lean) > 0
+    assert estimate_cpu_seconds(fat) == estimate_cpu_seconds(lean)
+
+
+def test_savings_order_and_cutoff(make_meta):
+    jobs = [
+        make_job(make_meta('lean.mkv', bit_rate='4000000', size='2700000000')),
+        make_job(make_meta('fat.mkv', bit_rate='20000000',
+                           size='13500000000')),
+        make_job(make_meta('mid.mkv', bit_rate='8000000', size='5400000000')),
+    ]
+    skipped = []
+    prioritise = Prioritiser(order='savings',
+                             max_jobs=2,
+                             on_skip=lambda path, why: skipped.append(why))
+
+    assert [j.input.name for j in prioritise(jobs)] == ['fat.mkv', 'mid.mkv']
+    assert skipped == [BUDGET_SKIP]
+
+
+def test_budget(make_meta):
+    jobs = [make_job(make_meta(f'{i}.mkv')) for i in range(4)]
+    hours = estimate_cpu_seconds(jobs[0].meta) / 3600
+
+    assert len(list(Prioritiser(budget=hours * 2.5)(jobs))) == 2
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+from dlrippyr.probe import ProbePool
+
+
+def test_map_preserves_order(tmp_path, fake_ffprobe):
+    paths = [tmp_path / f'{i}.mkv' for i in range(20)]
+
+    with ProbePool(workers=4) as pool:
+        results = list(pool.map(paths))
+
+    assert [path for path, _ in results] == paths
+    assert all(meta.codec_name == 'h264' for _, meta in results)
+
+
+def test_as_completed_reports_failures(tmp_path, fake_ffprobe):
+    paths = [tmp_path / 'good.mkv', tmp_path / 'bad.mkv']
+
+    with ProbePool(workers=2) as pool:
+        results = dict(pool.as_completed(paths))
+
+    assert results[paths[0]].height == 1080
+    assert results[paths[1]] is None
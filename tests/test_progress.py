@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import io
+
+import pytest
+
+from dlrippyr.classes import HandBrakeJob, SampleJob
+from dlrippyr.progress import LibraryProgress, format_eta
+from dlrippyr.runner import Progress
+
+PRESET = 'conf/x265-1080p-mkv.json'
+
+
+class Terminal(io.StringIO):
+
+    def isatty(self) -> bool:
+        return True
+
+
+def test_snapshot_weighs_jobs_by_frames(make_meta):
+    tracker = LibraryProgress(stream=io.StringIO())
+    # 1000 and 3000 frames at 25 fps
+    metas = [
+        make_meta(name, duration=seconds, avg_frame_rate='25/1')
+        for name, seconds in (('short.mkv', '40'), ('long.mkv', '120'))
+    ]
+    short, long = (HandBrakeJob(m.path, preset=PRESET, meta=m) for m in metas)
+    tracker.add(short)
+    tracker.add(long)
+
+    tracker.finish(short)
+    tracker.update(long, Progress('WORKING', percent=50.0, fps=100.0))
+    snap = tracker.snapshot()
+    assert snap.total_frames == pytest.approx(4000)
+    assert snap.percent == pytest.approx(62.5)
+    assert (snap.finished, snap.running, snap.total) == (1, 1, 2)
+    # 1500 frames left at 100 fps
+    assert snap.eta == pytest.approx(15)
+
+    # Two-pass encodes report percent per pass
+    tracker.update(long,
+                   Progress('WORKING', percent=50.0, pass_id=2, pass_count=2))
+    assert tracker.snapshot().done_frames == pytest.approx(1000 + 2250)
+
+
+def test_samples_and_discards(make_meta):
+    tracker = LibraryProgress(stream=io.StringIO())
+    meta = make_meta(duration='600', avg_frame_rate='25/1')
+    tracker.add(
+        SampleJob(meta.path, preset=PRESET, start_tm=60, end_tm=70, meta=meta))
+    assert tracker.snapshot().total_frames == pytest.approx(250)
+    tracker.discard(meta.path)
+    assert tracker.snapshot().total == 0
+
+
+def test_live_line_is_redrawn(make_meta):
+    stream = Terminal()
+    meta = make_meta()
+    job = HandBrakeJob(meta.path, preset=PRESET, meta=meta)
+    with LibraryProgress(stream=stream, interval=0.01) as tracker:
+        tracker.add(job)
+        tracker.update(job, Progress('WORKING', percent=10.0, fps=50.0))
+    assert stream.getvalue().count('\r') >= 1
+    assert '[ 10.0%] 0/1 files, 1 running, 50.0 fps' in stream.getvalue()
+    assert stream.getvalue().endswith('\n')
+
+
+def test_format_eta():
+    assert format_eta(None) == '--:--:--'
+    assert format_eta(3725.9) == '1:02:05'
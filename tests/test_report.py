@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import csv
+import io
+import json
+
+import pytest
+
+from dlrippyr.report import CsvWriter, JsonlWriter, resolution
+
+
+@pytest.mark.parametrize('width, height, expected', [
+    (3840, 1600, '2160p'),
+    (1920, 800, '1080p'),
+    (1440, 1080, '1080p'),
+    (1280, 720, '720p'),
+    (720, 576, '576p'),
+    (720, 480, '480p'),
+    (640, 360, 'SD'),
+])
+def test_resolution(make_meta, width, height, expected):
+    assert resolution(make_meta(width=width, height=height)) == expected
+
+
+@pytest.fixture
+def library(make_meta):
+    return [
+        make_meta('a.mkv'),
+        make_meta('b.mkv', codec_name='hevc'),
+        make_meta('c.mkv', width=1280, height=720),
+    ]
+
+
+def test_jsonl_streams_records_then_totals(library):
+    out = io.StringIO()
+    writer = JsonlWriter(out)
+    writer.write(library[0])
+    assert json.loads(out.getvalue())['path'] == 'a.mkv'
+    for meta in library[1:]:
+        writer.write(meta)
+    writer.close()
+
+    *records, last = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r['path'] for r in records] == ['a.mkv', 'b.mkv', 'c.mkv']
+    assert records[1]['reclaimable'] == 0
+    totals = last['totals']
+    assert totals['files'] == 3
+    assert totals['bytes'] == sum(r['size'] for r in records)
+    assert totals['reclaimable'] == sum(r['reclaimable'] for r in records) > 0
+    assert totals['reclaimable_files'] == 2
+    assert totals['by_codec']['h264']['files'] == 2
+    assert totals['by_resolution'] == {
+        '1080p': {
+            'files': 2,
+            'bytes': 2 * records[0]['size']
+        },
+        '720p': {
+            'files': 1,
+            'bytes': records[2]['size']
+        },
+    }
+
+
+def test_csv_tables(library, tmp_path):
+    out = io.StringIO()
+    writer = CsvWriter(out, str(tmp_path / 'totals.csv'))
+    for meta in library:
+        writer.write(meta)
+    writer.close()
+
+    # One table, readable as it is
+    assert [r['codec_name'] for r in csv.DictReader(io.StringIO(
+        out.getvalue()))] == ['h264', 'hevc', 'h264']
+    with open(tmp_path / 'totals.csv', newline='') as f:
+        rows = {(r['group'], r['key']): r for r in csv.DictReader(f)}
+    assert rows['all', 'all']['files'] == '3'
+    assert rows['codec', 'hevc']['files'] == '1'
+    assert rows['resolution', '720p']['files'] == '1'
+
+
+def test_csv_leaves_out_totals_without_a_path(library):
+    out = io.StringIO()
+    writer = CsvWriter(out)
+    for meta in library:
+        writer.write(meta)
+    writer.close()
+
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert len(rows) == 4
+    assert all(len(row) == len(rows[0]) for row in rows)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import os
+import threading
+import time
+
+import pytest
+
+from dlrippyr.runner import (ProgressParser, children, run_handbrake,
+                             with_json)
+
+HB_STDOUT = '''Version: {
+    "Name": "HandBrake",
+    "Official": true
+}
+Progress: {
+    "State": "WORKING",
+    "Working": {
+        "ETASeconds": 3725,
+        "Pass": 1,
+        "PassCount": 1,
+        "Progress": 0.25,
+        "Rate": 48.5,
+        "RateAvg": 45.25
+    }
+}
+Progress: {
+    "State": "WORKDONE",
+    "WorkDone": {
+        "Error": 0
+    }
+}
+'''
+
+
+def test_parser_reassembles_blocks():
+    parser = ProgressParser()
+    updates = [p for p in map(parser.feed, HB_STDOUT.splitlines()) if p]
+
+    assert [u.state for u in updates] == ['WORKING', 'WORKDONE']
+    assert updates[0].percent == 25.0
+    assert updates[0].fps == 48.5
+    assert str(updates[0]).endswith('ETA 01:02:05')
+    assert updates[1].percent == 100.0
+
+
+def test_with_json():
+    cmd = ['nice', '-n', '10', 'HandBrakeCLI', '-i', 'a.mkv']
+
+    assert with_json(cmd)[:5] == ['nice', '-n', '10', 'HandBrakeCLI', '--json']
+    assert with_json(with_json(cmd)).count('--json') == 1
+
+
+def test_runner_streams_progress(tmp_path):
+    """Several children are supervised from one loop, tagged by input"""
+    stdout = tmp_path / 'stdout.txt'
+    stdout.write_text(HB_STDOUT)
+    exe = tmp_path / 'HandBrakeCLI'
+    exe.write_text(f'#!/bin/sh\ncat {stdout}\necho log line >&2\n'
+                   'case "$3" in bad*) exit 3;; esac\n')
+    exe.chmod(0o755)
+    seen = []
+    codes = {}
+
+    def run(name):
+        codes[name] = run_handbrake(
+            [str(exe), '-i', name],
+            on_progress=lambda tag, p: seen.append(
+                (tag, threading.current_thread().name)))
+
+    threads = [
+        threading.Thread(target=run, args=(name, )) for name in ('a', 'bad')
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert codes == {'a': 0, 'bad': 3}
+    assert sorted(tag for tag, _ in seen) == ['a', 'a', 'bad', 'bad']
+    assert {loop for _, loop in seen} == {'dlrippyr-runner'}
+
+
+def test_child_killed_when_supervision_fails(tmp_path):
+    stdout = tmp_path / 'stdout.txt'
+    stdout.write_text(HB_STDOUT)
+    pidfile = tmp_path / 'pid'
+    exe = tmp_path / 'HandBrakeCLI'
+    exe.write_text(f'#!/bin/sh\necho $$ > {pidfile}\ncat {stdout}\n'
+                   'exec sleep 30\n')
+    exe.chmod(0o755)
+
+    def fail(tag, progress):
+        raise RuntimeError('callback failed')
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError):
+        run_handbrake([str(exe), '-i', 'a'], on_progress=fail)
+    assert time.monotonic() - start < 10
+    # Killed and reaped, so gone altogether
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pidfile.read_text()), 0)
+    assert children() == []
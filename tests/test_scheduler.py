@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import threading
+import time
+from pathlib import Path
+
+from dlrippyr.classes import BasicJob
+from dlrippyr.scheduler import Scheduler
+
+
+class SleepJob(BasicJob):
+    """Stand-in encode which tracks how many copies run at once"""
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, name: str, returncode: int = 0) -> None:
+        super().__init__(Path(name))
+        self.returncode = returncode
+
+    def run_handbrake(self, on_progress=None) -> int:
+        with SleepJob.lock:
+            SleepJob.running += 1
+            SleepJob.peak = max(SleepJob.peak, SleepJob.running)
+        time.sleep(0.05)
+        with SleepJob.lock:
+            SleepJob.running -= 1
+        if self.returncode < 0:
+            raise RuntimeError('boom')
+        return self.returncode
+
+
+def test_slots_bound_concurrency():
+    SleepJob.peak = 0
+    summary = Scheduler(slots=3).run(SleepJob(f'{i}.mkv') for i in range(9))
+
+    assert SleepJob.peak == 3
+    assert len(summary.succeeded) == 9
+
+
+def test_failures_are_per_job():
+    jobs = [SleepJob('a.mkv'), SleepJob('b.mkv', 1), SleepJob('c.mkv', -1)]
+    summary = Scheduler(slots=2).run(jobs)
+
+    assert [r.job.input.name for r in summary.failed] == ['b.mkv', 'c.mkv']
+    assert '1 of 3 jobs succeeded' in str(summary)
+
+
+def test_jobs_weigh_their_concurrency():
+    wide = SleepJob('wide.mkv')
+    wide.concurrency = 3
+    assert Scheduler(slots=4).weight(wide) == 3
+    assert Scheduler(slots=4).weight(SleepJob('narrow.mkv')) == 1
+
+    squeezed = SleepJob('squeezed.mkv')
+    squeezed.concurrency = 8
+    Scheduler(slots=2).run([squeezed])
+    assert squeezed.concurrency == 2
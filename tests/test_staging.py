@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import os
+import time
+
+import pytest
+
+from dlrippyr import staging
+from dlrippyr.classes import HandBrakeJob, partial_name
+from dlrippyr.staging import Scratch, copy_file
+
+
+@pytest.mark.parametrize('kernel', [True, False])
+def test_copy_file(tmp_path, monkeypatch, kernel):
+    if not kernel:
+        monkeypatch.setattr(staging, '_copy_file_range', False)
+        monkeypatch.setattr(staging, '_sendfile', False)
+    monkeypatch.setattr(staging, 'CHUNK_SIZE', 64 * 1024)
+    data = os.urandom(256 * 1024)
+    (tmp_path / 'src').write_bytes(data)
+
+    start = time.monotonic()
+    copied = copy_file(tmp_path / 'src', tmp_path / 'dst', bwlimit=1024**2)
+    assert time.monotonic() - start >= 0.2
+    assert copied == len(data)
+    assert (tmp_path / 'dst').read_bytes() == data
+
+
+@pytest.fixture
+def nas(tmp_path):
+    share = tmp_path / 'nas'
+    share.mkdir()
+    (share / 'film.mkv').write_bytes(b'source' * 1000)
+    return share
+
+
+def make_job(nas):
+    return HandBrakeJob(nas / 'film.mkv',
+                        preset='conf/x265.json',
+                        output=nas / 'film_x265.mp4')
+
+
+def test_stages_input_and_returns_output(tmp_path, nas):
+    scratch = Scratch(tmp_path / 'scratch')
+    job, = scratch.stage([make_job(nas)])
+
+    local_in = job.cmd[job.cmd.index('-i') + 1]
+    local_out = job.cmd[job.cmd.index('-o') + 1]
+    assert local_in.startswith(str(scratch.workdir))
+    assert local_out.startswith(str(scratch.workdir))
+    assert open(local_in, 'rb').read() == b'source' * 1000
+    assert scratch.used == 6000
+
+    # Stand in for the encode
+    with open(local_out, 'wb') as f:
+        f.write(b'encoded')
+    job.finalise(0)
+
+    assert (nas / 'film_x265.mp4').read_bytes() == b'encoded'
+    assert not partial_name(nas / 'film_x265.mp4').exists()
+    assert list(scratch.workdir.iterdir()) == []
+    assert scratch.used == 0
+    scratch.close()
+    assert not scratch.workdir.exists()
+
+
+def test_oversized_inputs_run_in_place(tmp_path, nas):
+    scratch = Scratch(tmp_path / 'scratch', max_bytes=100)
+    job, = scratch.stage([make_job(nas)])
+
+    assert job.staged_input is None
+    assert job.cmd[job.cmd.index('-i') + 1] == str(nas / 'film.mkv')
+    assert scratch.used == 0
+
+
+def test_sweeps_dead_runs(tmp_path):
+    stale = tmp_path / 'dlrippyr-999999999'
+    (stale / '1').mkdir(parents=True)
+    Scratch(tmp_path).close()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import signal
+from datetime import datetime
+
+import pytest
+
+from dlrippyr import throttle
+from dlrippyr.scheduler import Scheduler
+from dlrippyr.throttle import Load, Throttle, Window
+
+
+@pytest.mark.parametrize('text, clock, inside', [
+    ('01:00-07:00', '03:30', True),
+    ('01:00-07:00', '07:00', False),
+    ('22:30-06:00', '23:59', True),
+    ('22:30-06:00', '05:59', True),
+    ('22:30-06:00', '12:00', False),
+])
+def test_window(text, clock, inside):
+    now = datetime.fromisoformat(f'2024-01-01T{clock}')
+    assert (now in Window.parse(text)) is inside
+
+
+def test_window_rejects_garbage():
+    with pytest.raises(ValueError):
+        Window.parse('1am')
+
+
+def test_set_limit_clamps_to_capacity():
+    scheduler = Scheduler(slots=4)
+    scheduler.set_limit(2)
+    assert (scheduler.limit, scheduler._free) == (2, 2)
+    # A heavy job is given no more than the limit, so still fits
+    assert scheduler._acquire(3) == 2
+    scheduler._release(2)
+    scheduler.set_limit(0)
+    assert scheduler.limit == 1
+    scheduler.set_limit(9)
+    assert (scheduler.limit, scheduler._free) == (4, 4)
+
+
+@pytest.fixture
+def signals(monkeypatch):
+    sent = []
+    monkeypatch.setattr(throttle, 'children', lambda: [101])
+    monkeypatch.setattr(throttle.os, 'kill',
+                        lambda pid, signum: sent.append((pid, signum)))
+    return sent
+
+
+def test_backs_off_and_recovers(signals):
+    scheduler = Scheduler(slots=4)
+    control = Throttle(scheduler, clock=lambda: datetime(2024, 1, 1, 12))
+
+    # A single busy sample is a blip, not a trend
+    control.step(Load(0.3))
+    assert scheduler.limit == 4
+    control.step(Load(0.3))
+    assert scheduler.limit == 3
+    # High pressure counts while other work is running
+    control.step(Load(0.15, psi=60.0))
+    assert scheduler.limit == 2
+
+    control.step(Load(0.8))
+    control.step(Load(0.8))
+    assert control.paused
+    assert scheduler.limit == 1
+    assert signals == [(101, signal.SIGSTOP)]
+
+    control.step(Load(0.0, psi=60.0))
+    control.step(Load(0.0, psi=60.0))
+    assert not control.paused
+    assert scheduler.limit == 2
+    assert signals[-1] == (101, signal.SIGCONT)
+
+    control.stop()
+    assert scheduler.limit == 4
+
+
+def test_full_speed_window_overrides(signals):
+    scheduler = Scheduler(slots=4)
+    control = Throttle(scheduler,
+                       windows=[Window.parse('22:00-06:00')],
+                       clock=lambda: datetime(2024, 1, 1, 2))
+    scheduler.set_limit(1)
+    for _ in range(3):
+        control.step(Load(0.9))
+    assert not control.paused
+    assert scheduler.limit == 4
+    assert signals == []
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+from pathlib import Path
+
+from dlrippyr import utils
+
+DIRTREE = Path(__file__).parent / 'dirtree' / 'data'
+
+
+def test_find_vfiles_dir():
+    """Every supported extension is found once, regardless of case"""
+    found = list(utils.find_vfiles(str(DIRTREE)))
+
+    assert len(found) == len(set(found)) == 16
+    assert {p.suffix for p in found} == {'.mp4', '.mkv', '.AVI', '.WMV', '.mov'}
+
+
+def test_find_vfiles_file():
+    """A file argument is passed through untouched"""
+    sample = DIRTREE / 'dummies-02' / '1foo' / 'sample13.gif'
+
+    assert list(utils.find_vfiles(str(sample))) == [sample]
+
+
+def test_find_vfiles_missing():
+    assert list(utils.find_vfiles(str(DIRTREE / 'nope'))) == []
+
+
+def test_iter_vfiles_dedupes():
+    """Overlapping sources yield each path only once"""
+    srcs = [str(DIRTREE), str(DIRTREE / 'dummies-05')]
+
+    assert len(list(utils.iter_vfiles(srcs))) == 16
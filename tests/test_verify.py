@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+from pathlib import Path
+
+import pytest
+
+from dlrippyr import verify
+from dlrippyr.classes import BasicJob, HandBrakeJob
+from dlrippyr.scheduler import Scheduler, VerificationError
+from dlrippyr.verify import (SAMPLED, MissingDependencyError, Streams,
+                             Verifier, check_probe, replace_source)
+
+
+def streams(duration=60.0, fps='25/1', frames=None, kinds=('video', 'audio')):
+    _json = {'format': {'duration': str(duration)}, 'streams': []}
+    for kind in kinds:
+        stream = {'codec_type': kind}
+        if kind == 'video':
+            stream.update(width=1920, height=1080, avg_frame_rate=fps)
+            if frames is not None:
+                stream['nb_read_packets'] = str(frames)
+        _json['streams'].append(stream)
+    return Streams(_json)
+
+
+@pytest.mark.parametrize('output, reason', [
+    (streams(frames=1500), None),
+    (streams(frames=750, fps='25/2'), None),
+    (streams(duration=58.0, frames=1450), 'duration'),
+    (streams(frames=1500, kinds=('video', )), 'no audio stream'),
+    (streams(frames=1200), '1200 frames'),
+])
+def test_check_probe(output, reason):
+    result = check_probe(streams(), output)
+    if reason is None:
+        assert result is None
+    else:
+        assert reason in result
+
+
+def test_psnr_and_ssim():
+    np = pytest.importorskip('numpy')
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (2, 32, 32)).astype(np.float32)
+    # As from a broken decode: nothing to do with the source
+    garbage = rng.integers(0, 256, frames.shape).astype(np.float32)
+
+    assert verify.psnr(frames, frames).tolist() == [100.0, 100.0]
+    assert verify.ssim(frames, frames) == pytest.approx([1.0, 1.0])
+    assert (verify.psnr(frames, garbage) < verify.MIN_PSNR).all()
+    assert (verify.ssim(frames, garbage) < verify.MIN_SSIM).all()
+
+
+def test_sampled_tier_needs_numpy(monkeypatch):
+    monkeypatch.setattr(verify, 'have_numpy', lambda: False)
+    with pytest.raises(MissingDependencyError):
+        Verifier(SAMPLED)
+
+
+class DoneJob(BasicJob):
+
+    def __init__(self, name: str) -> None:
+        super().__init__(Path(name), output=Path(f'{name}.out'))
+
+    def run_handbrake(self, on_progress=None) -> int:
+        return 0
+
+
+def test_failed_verification_fails_the_job():
+    summary = Scheduler(slots=2, verifier=lambda job: (
+        'too short' if job.input.name == 'b.mkv' else None)).run(
+            DoneJob(name) for name in ('a.mkv', 'b.mkv', 'c.mkv'))
+
+    failed, = summary.failed
+    assert failed.job.input.name == 'b.mkv'
+    assert isinstance(failed.error, VerificationError)
+    assert len(summary.succeeded) == 2
+
+
+def test_replace_source(tmp_path):
+    source = tmp_path / 'lib' / 'film.mkv'
+    source.parent.mkdir()
+    source.write_bytes(b'source')
+    output = tmp_path / 'film_x265.mp4'
+    output.write_bytes(b'encoded')
+    job = HandBrakeJob(source, preset='conf/x265.json', output=output)
+
+    assert replace_source(job) == source.with_suffix('.mp4')
+    assert source.with_suffix('.mp4').read_bytes() == b'encoded'
+    assert not source.exists()
+    assert not output.exists()
+
+
+def test_replace_source_keeps_existing_sibling(tmp_path):
+    source = tmp_path / 'Title.mkv'
+    source.write_bytes(b'source')
+    sibling = tmp_path / 'Title.mp4'
+    sibling.write_bytes(b'another cut')
+    output = tmp_path / 'Title_x265.mp4'
+    output.write_bytes(b'encoded')
+    job = HandBrakeJob(source, preset='conf/x265.json', output=output)
+
+    with pytest.raises(FileExistsError):
+        replace_source(job)
+    assert source.read_bytes() == b'source'
+    assert sibling.read_bytes() == b'another cut'
+    assert output.read_bytes() == b'encoded'
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+import sys
+import threading
+import time
+
+import pytest
+
+from dlrippyr import watch
+from dlrippyr.probe import ProbePool
+from dlrippyr.watch import Watcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                                reason='inotify is Linux only')
+
+
+@pytest.fixture
+def watched(tmp_path, monkeypatch):
+    """Run a Watcher over tmp_path, collecting what it yields"""
+    yield from run_watcher(tmp_path, monkeypatch)
+
+
+def run_watcher(root, monkeypatch):
+    monkeypatch.setattr(watch, 'POLL_INTERVAL', 0.05)
+    watcher = Watcher(root, settle=0.3)
+    stop = threading.Event()
+    seen = []
+    thread = threading.Thread(
+        target=lambda: seen.extend(watcher.watch(stop)), daemon=True)
+    thread.start()
+    time.sleep(0.2)
+    yield seen
+    stop.set()
+    thread.join(timeout=5)
+
+
+def wait_for(seen, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while len(seen) < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_yields_files_once_settled(tmp_path, watched):
+    (tmp_path / 'notes.txt').write_text('x')
+    (tmp_path / '.a.partial.mp4').write_bytes(b'x')
+    video = tmp_path / 'a.mkv'
+    with open(video, 'wb') as f:
+        f.write(b'x' * 10)
+    # A copy which closes and reopens the file restarts the wait
+    time.sleep(0.15)
+    with open(video, 'ab') as f:
+        f.write(b'x' * 10)
+    assert watched == []
+
+    wait_for(watched, 1)
+    assert watched == [video]
+    time.sleep(0.5)
+    assert watched == [video]
+
+
+def test_follows_new_directories(tmp_path, watched):
+    season = tmp_path / 'show' / 'season1'
+    season.mkdir(parents=True)
+    time.sleep(0.2)
+    (season / 'e01.mp4').write_bytes(b'x')
+
+    wait_for(watched, 1)
+    assert watched == [season / 'e01.mp4']
+
+
+def test_leaves_files_there_at_startup(tmp_path, monkeypatch):
+    (tmp_path / 'root.mkv').write_bytes(b'x')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'old.mkv').write_bytes(b'x')
+    watcher = run_watcher(tmp_path, monkeypatch)
+    seen = next(watcher)
+    (tmp_path / 'sub' / 'new.mkv').write_bytes(b'x')
+
+    wait_for(seen, 1)
+    time.sleep(0.5)
+    assert seen == [tmp_path / 'sub' / 'new.mkv']
+    next(watcher, None)
+
+
+def test_as_completed_streams_a_trickle(tmp_path, fake_ffprobe):
+    gate = threading.Event()
+
+    def trickle():
+        yield tmp_path / 'a.mkv'
+        gate.wait(5)
+        yield tmp_path / 'b.mkv'
+
+    with ProbePool(workers=2) as pool:
+        results = pool.as_completed(trickle())
+        # The first result arrives while the source is still blocked
+        assert next(results)[0] == tmp_path / 'a.mkv'
+        gate.set()
+        assert [path for path, _ in results] == [tmp_path / 'b.mkv']
@@ -1,25 +0,0 @@
-#!/usr/bin/env python
-
-
-def test_file():
-    pass
-
-
-def test_dir():
-    pass
-
-
-def test_dry_run():
-    pass
-
-
-def test_sample():
-    pass
-
-
-def test_info():
-    pass
-
-
-def test_user_preset():
-    pass